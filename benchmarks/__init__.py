@@ -0,0 +1 @@
+"""Benchmarks for hsmpy, not part of the installed package."""
@@ -0,0 +1,182 @@
+"""
+    Generator of synthetic machines for benchmarks and stress tests.
+
+    *generate* returns (states, transitions, events) tuple describing a valid
+    machine with configurable shape and mix of transitions. Same arguments
+    and seed always produce the same layout. Generated event types are
+    attributes of this module, so machines can be stored as artifacts.
+    Machines with 10^4 states (e.g. depth=5, fanout=10) build and validate
+    in a few seconds.
+"""
+
+import random
+from hsmpy import State, Event, Initial, T, Local, Internal, Choice
+
+
+def guard(evt, hsm):
+    """Guard used by generated transitions, passes for odd or missing data."""
+    return evt.data is None or bool(evt.data % 2)
+
+
+class _Scope(object):
+    """Names of states within one (sub)machine, transitions can't leave it."""
+    def __init__(self):
+        self.names = []
+        self.parent = {}
+        self.children = {}
+        self.orthogonal = set()
+
+    def add(self, name, parent):
+        self.names += [name]
+        self.parent[name] = parent
+        self.children[name] = []
+        if parent is not None:
+            self.children[parent] += [name]
+
+
+def _make_events(n_events, seed):
+    """
+        Returns list of event types. They are bound as attributes of this
+        module, so that they can be pickled (e.g. into artifacts), and the
+        same name always gives the same type.
+    """
+    events = []
+    for i in range(n_events):
+        name = 'Gen{0}Event{1}'.format(seed, i)
+        if name not in globals():
+            globals()[name] = type(name, (Event,), {'__module__': __name__})
+        events += [globals()[name]]
+    return events
+
+
+class _Generator(object):
+    def __init__(self, rnd, events, params):
+        self.rnd = rnd
+        self.events = events
+        self.p = params
+        self.counter = 0
+
+    def new_name(self):
+        self.counter += 1
+        return 's{0}'.format(self.counter)
+
+    def machine(self, depth):
+        """Returns (states, trans) for (sub)machine *depth* levels deep."""
+        scope = _Scope()
+        scope.add('top', None)
+        states = {'top': State(self.children('top', depth - 1, scope))}
+        trans = self.transitions(scope)
+        return (states, trans)
+
+    def children(self, parent, depth, scope):
+        """Returns states dict (or list of submachines) for *parent*."""
+        if depth <= 0:
+            return {}
+        if (parent != 'top' and self.p['regions'] > 0
+                and self.rnd.random() < self.p['orthogonal_ratio']):
+            scope.orthogonal.add(parent)
+            return [self.machine(depth) for _ in range(self.p['regions'])]
+        children = {}
+        for _ in range(self.p['fanout']):
+            name = self.new_name()
+            scope.add(name, parent)
+            children[name] = State(self.children(name, depth - 1, scope))
+        return children
+
+    def transitions(self, scope):
+        rnd = self.rnd
+        trans = dict((name, {}) for name in scope.names)
+        free = dict((name, list(self.events)) for name in scope.names)
+
+        def take_event(name):
+            events = free[name]
+            return events.pop(rnd.randrange(len(events)))
+
+        # initial transitions go to first child, every other child can be
+        # reached from its previous sibling so that no state is unreachable
+        for name in scope.names:
+            children = scope.children[name]
+            if children:
+                trans[name][Initial] = T(children[0])
+            for prev, child in zip(children, children[1:]):
+                trans[prev][take_event(prev)] = T(child)
+
+        density = self.p['transition_density']
+        for name in scope.names:
+            count = int(density) + (rnd.random() < density - int(density))
+            for _ in range(min(count, len(free[name]))):
+                trans[name][take_event(name)] = self.transition(name, scope)
+
+        return dict((name, outgoing) for name, outgoing in trans.items()
+                    if outgoing)
+
+    def transition(self, source, scope):
+        rnd = self.rnd
+        p = self.p
+        guard_fn = guard if rnd.random() < p['guard_ratio'] else None
+        roll = rnd.random()
+        if roll < p['internal_ratio']:
+            return Internal(guard=guard_fn)
+        roll -= p['internal_ratio']
+        if roll < p['local_ratio']:
+            related = list(scope.children[source])
+            if scope.parent[source] is not None:
+                related += [scope.parent[source]]
+            if related:
+                return Local(rnd.choice(related), guard=guard_fn)
+        roll -= p['local_ratio']
+        if roll < p['choice_ratio']:
+            switch = dict((i, rnd.choice(scope.names)) for i in range(3))
+            return Choice(switch, default=rnd.choice(scope.names))
+        return T(rnd.choice(scope.names), guard=guard_fn)
+
+
+def generate(depth=4, fanout=3, regions=2, orthogonal_ratio=0.1,
+             transition_density=2.0, local_ratio=0.2, internal_ratio=0.1,
+             choice_ratio=0.1, guard_ratio=0.2, n_events=10, seed=0):
+    """
+        Returns (states, transitions, events) tuple describing a valid
+        machine, where *events* is the list of event types it uses.
+
+        Parameters
+        ----------
+        depth : int
+            number of state levels (including 'top' state)
+        fanout : int
+            number of children of every composite state
+        regions : int
+            number of submachines in every orthogonal state
+        orthogonal_ratio : float
+            probability that non-top state having children is orthogonal
+            state instead of composite, submachines of orthogonal state
+            have the same depth as it would have as a composite
+        transition_density : float
+            average number of random transitions going out of each state,
+            in addition to those needed for making all states reachable
+        local_ratio, internal_ratio, choice_ratio : float
+            probabilities that random transition is local, internal or
+            choice transition, regular transition is used otherwise
+        guard_ratio : float
+            probability that random transition has a guard (which passes
+            when event's data is None or an odd number)
+        n_events : int
+            number of event types, must be larger than fanout
+        seed : int
+            seed for random number generator
+    """
+    if n_events <= fanout:
+        raise ValueError("n_events must be larger than fanout")
+    params = {
+        'fanout': fanout,
+        'regions': regions,
+        'orthogonal_ratio': orthogonal_ratio,
+        'transition_density': transition_density,
+        'local_ratio': local_ratio,
+        'internal_ratio': internal_ratio,
+        'choice_ratio': choice_ratio,
+        'guard_ratio': guard_ratio,
+    }
+    events = _make_events(n_events, seed)
+    gen = _Generator(random.Random(seed), events, params)
+    states, trans = gen.machine(depth)
+    return (states, trans, events)
@@ -0,0 +1,187 @@
+"""
+    Machines used in benchmarks.
+
+    Every function in MACHINES takes no arguments and returns a tuple
+    (states, transitions, events, prepare), where *events* is the list of
+    event instances that is dispatched in a loop, and *prepare* is a function
+    that is called with HSM instance before it's started.
+"""
+
+from hsmpy import State, Event, Initial, T, Local, Internal
+from tests import reusable as r
+from benchmarks import generator
+
+
+class Ping(Event):
+    pass
+
+
+class Poke(Event):
+    pass
+
+
+class Noise(Event):
+    """Event that no state responds to."""
+    pass
+
+
+def do_nothing(evt, hsm):
+    pass
+
+
+def deep_machine(depth=30):
+    """
+        Machine with states nested *depth* levels deep. Ping is handled by
+        the deepest state with a transition to the outermost nested state,
+        which exits and enters the whole chain, Poke is handled by internal
+        transition in 'top', so it has to bubble up through all levels.
+    """
+    names = ['d{0}'.format(i) for i in range(depth)]
+    states = {}
+    for name in reversed(names):
+        states = {name: State(states)}
+    states = {'top': State(states)}
+    trans = {
+        'top': {
+            Initial: T(names[0]),
+            Poke: Internal(action=do_nothing),
+        },
+        names[-1]: {
+            Ping: T(names[0]),
+        },
+    }
+    for name, child in zip(names, names[1:]):
+        trans[name] = {Initial: T(child)}
+    return (states, trans, [Ping(), Poke(), Noise()])
+
+
+def wide_machine(width=200):
+    """
+        Machine having *width* leaf states directly under 'top'. Ping moves
+        from each leaf to the next one, Poke is a local transition from
+        'top' back to the first leaf.
+    """
+    names = ['s{0}'.format(i) for i in range(width)]
+    states = {'top': State(dict((name, State()) for name in names))}
+    trans = {
+        'top': {
+            Initial: T(names[0]),
+            Poke: Local(names[0]),
+        },
+    }
+    for name, nxt in zip(names, names[1:] + names[:1]):
+        trans[name] = {Ping: T(nxt)}
+    return (states, trans, [Ping()] * 10 + [Poke(), Noise()])
+
+
+def orthogonal_machine(regions=30):
+    """
+        Machine with one orthogonal state that has *regions* identical
+        submachines. Each region toggles between two states on its own event
+        type, so every event is relevant to only one region, except Ping
+        which all of them respond to.
+    """
+    region_events = [type('Region{0}'.format(i), (Event,), {})
+                     for i in range(regions)]
+
+    def submachine(evt):
+        sub_states = {
+            'top': State({
+                'on': State(),
+                'off': State(),
+            })
+        }
+        sub_trans = {
+            'top': {
+                Initial: T('off'),
+                Ping: Local('off'),
+            },
+            'on': {
+                evt: T('off'),
+            },
+            'off': {
+                evt: T('on'),
+            },
+        }
+        return (sub_states, sub_trans)
+
+    states = {
+        'top': State({
+            'regions': State([submachine(evt) for evt in region_events]),
+        })
+    }
+    trans = {
+        'top': {
+            Initial: T('regions'),
+        }
+    }
+    events = [evt() for evt in region_events] + [Ping(), Noise()]
+    return (states, trans, events)
+
+
+def _set_foo(value):
+    def prepare(hsm):
+        hsm.data.foo = value
+    return prepare
+
+
+def _nothing(hsm):
+    pass
+
+
+def miro():
+    states, trans = r.make_miro_machine(use_logging=False)
+    events = [evt() for evt in [r.A, r.B, r.C, r.D, r.E, r.F, r.G, r.H, r.I]]
+    return (states, trans, events, _nothing)
+
+
+def nested():
+    states, trans = r.make_nested_machine(use_logging=False)
+    events = [evt() for evt in [r.A, r.B, r.C, r.AB_ex, r.AC_ex, r.BC_ex,
+                                r.AB_loc, r.AC_loc, r.BC_loc, r.BA_ex,
+                                r.CA_ex, r.CB_ex, r.BA_loc, r.CA_loc,
+                                r.CB_loc]]
+    return (states, trans, events, _nothing)
+
+
+def submachines():
+    states, trans = r.make_submachines_machine(use_logging=False)
+    events = [r.A(), r.A(), r.B(), r.TERMINATE(), r.A()]
+    return (states, trans, events, _nothing)
+
+
+def choice():
+    states, trans = r.make_choice_machine(use_logging=False)
+    events = [r.A(n) for n in [0, 1, 2, 3, 4, 5, 6, 7, 20, 40, 60]]
+    return (states, trans, events, _set_foo(3))
+
+
+def deep():
+    return deep_machine() + (_nothing,)
+
+
+def wide():
+    return wide_machine() + (_nothing,)
+
+
+def orthogonal():
+    return orthogonal_machine() + (_nothing,)
+
+
+def generated():
+    states, trans, event_types = generator.generate(
+        depth=5, fanout=4, regions=3, orthogonal_ratio=0.05, seed=0)
+    events = [evt(data) for evt in event_types for data in [None, 1, 2]]
+    return (states, trans, events, _nothing)
+
+
+MACHINES = [
+    ('miro', miro),
+    ('nested', nested),
+    ('submachines', submachines),
+    ('choice', choice),
+    ('deep', deep),
+    ('wide', wide),
+    ('orthogonal', orthogonal),
+    ('generated', generated),
+]
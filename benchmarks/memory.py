@@ -0,0 +1,116 @@
+"""
+    Compares memory footprint of dict-based and slots-based events and states.
+
+    Run with:
+
+        python -m benchmarks.memory
+"""
+
+import gc
+import sys
+import types
+from hsmpy import HSM, State, SlimState, Event, SlimEvent, Initial, T
+from tests.reusable import allocated_dict
+
+
+class DictEvent(Event):
+    """Regular event subclass, instances have __dict__."""
+    pass
+
+
+class Tick(SlimEvent):
+    __slots__ = ()
+
+
+class DictState(State):
+    """Regular state subclass, instances have __dict__."""
+    pass
+
+
+class SlimLeaf(SlimState):
+    __slots__ = ()
+
+
+def instance_size(obj):
+    """Returns size in bytes of object and its __dict__ (if allocated)."""
+    size = sys.getsizeof(obj)
+    attrs = allocated_dict(obj)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+    return size
+
+
+# objects of these types are code shared between instances, not their data;
+# they aren't counted nor walked into
+_SHARED_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType, types.CodeType)
+
+
+def deep_size(obj):
+    """
+        Returns size in bytes of object and of every object reachable from
+        it (found by *gc.get_referents*), each counted once. Classes,
+        modules and functions aren't counted.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+def make_wide_machine(Cls, n):
+    states = {
+        'top': Cls(dict(('s{0}'.format(i), Cls()) for i in range(n)))
+    }
+    trans = {
+        'top': {
+            Initial: T('s0'),
+        }
+    }
+    return (states, trans)
+
+
+def hsm_size(hsm):
+    """
+        Returns total size of HSM instance: its states, transitions, data
+        and every table built from them.
+    """
+    return deep_size(hsm)
+
+
+def machine_size(Cls, n=100):
+    """Returns total size of HSM with n leaf states."""
+    states, trans = make_wide_machine(Cls, n)
+    hsm = HSM(states, trans, skip_validation=True)  # leaves are unreachable
+    return hsm_size(hsm)
+
+
+def run():
+    old_data = type('HSM_data', (object,), {})
+    results = [
+        ('Event subclass', instance_size(DictEvent(1))),
+        ('SlimEvent subclass', instance_size(Tick(1))),
+        ('State subclass', instance_size(DictState())),
+        ('SlimState subclass', instance_size(SlimLeaf())),
+        ('HSM with 100 State subclass leaves', machine_size(DictState)),
+        ('HSM with 100 SlimState leaves', machine_size(SlimLeaf)),
+        ('per-instance data class', sys.getsizeof(old_data)
+                                    + instance_size(old_data())),
+        ('HSMData instance', instance_size(HSM(
+            *make_wide_machine(State, 1)).data)),
+    ]
+    return results
+
+
+if __name__ == '__main__':
+    import logging
+    logging.disable(logging.DEBUG)
+    for name, size in run():
+        print '{0:<40}{1:>8} bytes'.format(name, size)
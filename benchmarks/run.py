@@ -0,0 +1,178 @@
+"""
+    Runs benchmarks and saves results as JSON.
+
+    Usage:
+
+        python -m benchmarks.run [-o results.json] [-n EVENTS]
+        python -m benchmarks.run --compare old.json new.json
+
+    For every machine in machines.MACHINES it measures:
+
+        * dispatch throughput (events per second) and per-event latency
+          percentiles (in microseconds), with the interpreter and, where the
+          machine supports it, with the code generation backend
+        * HSM construction time without validation
+        * validation time
+        * memory used by one HSM instance, including its states,
+          transitions and the tables built from them
+"""
+
+import sys
+import json
+import logging
+import time
+import argparse
+import platform
+import subprocess
+from timeit import default_timer as timer
+from hsmpy import HSM, EventBus, codegen
+from benchmarks import machines, memory
+
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def percentile(sorted_values, p):
+    """Returns p-th percentile of already sorted list of values."""
+    index = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def make_hsm(make_machine, compiled=False):
+    states, trans, events, prepare = make_machine()
+    hsm = HSM(states, trans)
+    prepare(hsm)
+    if compiled:
+        codegen.compile_machine(hsm)
+    return hsm, events
+
+
+def measure_dispatch(make_machine, n_events, compiled=False):
+    """Returns dict with throughput and latency percentiles."""
+    hsm, events = make_hsm(make_machine, compiled)
+    eb = EventBus()
+    hsm.start(eb)
+    latencies = []
+    for i in xrange(n_events):
+        evt = events[i % len(events)]
+        start = timer()
+        eb.dispatch(evt)
+        latencies.append(timer() - start)
+    latencies.sort()
+    result = {'events_per_second': n_events / sum(latencies)}
+    for p in PERCENTILES:
+        key = 'latency_p{0}_us'.format(p).replace('.', '_')
+        result[key] = percentile(latencies, p) * 1e6
+    return result
+
+
+def measure_construction(make_machine, repeat):
+    """Returns (construction_seconds, validation_seconds) averages."""
+    construction = validation = 0.0
+    for _ in range(repeat):
+        states, trans, _, _ = make_machine()
+        start = timer()
+        hsm = HSM(states, trans, skip_validation=True)
+        construction += timer() - start
+        start = timer()
+        hsm._validate(states, hsm.trans, hsm.flattened)
+        validation += timer() - start
+    return (construction / repeat, validation / repeat)
+
+
+def run_machine(make_machine, n_events, repeat):
+    construction, validation = measure_construction(make_machine, repeat)
+    hsm, _ = make_hsm(make_machine)
+    result = {
+        'construction_ms': construction * 1e3,
+        'validation_ms': validation * 1e3,
+        'memory_bytes': memory.hsm_size(hsm),
+        'states': len(hsm.flattened),
+        'dispatch': measure_dispatch(make_machine, n_events),
+    }
+    try:
+        result['dispatch_codegen'] = measure_dispatch(make_machine, n_events,
+                                                      compiled=True)
+    except ValueError:
+        pass  # machine not supported by code generation backend
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(n_events=5000, repeat=5, names=None):
+    """Runs benchmarks and returns results as dict."""
+    results = {}
+    for name, make_machine in machines.MACHINES:
+        if names and name not in names:
+            continue
+        results[name] = run_machine(make_machine, n_events, repeat)
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'events': n_events,
+        'results': results,
+    }
+
+
+def flatten_results(results, prefix=''):
+    """Returns dict mapping 'machine.group.metric' keys to numbers."""
+    flat = {}
+    for key, val in results.items():
+        if isinstance(val, dict):
+            flat.update(flatten_results(val, prefix + key + '.'))
+        else:
+            flat[prefix + key] = val
+    return flat
+
+
+def compare(old, new):
+    """Returns list of (metric, old_value, new_value, ratio) tuples."""
+    old_flat = flatten_results(old['results'])
+    new_flat = flatten_results(new['results'])
+    rows = []
+    for key in sorted(set(old_flat) & set(new_flat)):
+        ratio = new_flat[key] / float(old_flat[key]) if old_flat[key] else None
+        rows += [(key, old_flat[key], new_flat[key], ratio)]
+    return rows
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='hsmpy benchmarks')
+    parser.add_argument('-o', '--output', help='file to write results to')
+    parser.add_argument('-n', '--events', type=int, default=5000,
+                        help='number of events dispatched to each machine')
+    parser.add_argument('-m', '--machine', action='append',
+                        help='run only given machine (can be repeated)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files')
+    args = parser.parse_args(argv)
+    # test machines set up debug logging, measure without it
+    logging.disable(logging.DEBUG)
+
+    if args.compare:
+        old, new = [json.load(open(path)) for path in args.compare]
+        for key, old_val, new_val, ratio in compare(old, new):
+            ratio = '' if ratio is None else '{0:.2f}x'.format(ratio)
+            print '{0:<50}{1:>14.2f}{2:>14.2f}{3:>9}'.format(
+                key, old_val, new_val, ratio)
+        return
+
+    results = run(args.events, names=args.machine)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,12 +2,18 @@ import elements
 import eventbus
 
 State = elements.State
+SlimState = elements.SlimState
 HSM = elements.HSM
 Transition = elements.Transition
 LocalTransition = elements.LocalTransition
 InternalTransition = elements.InternalTransition
 ChoiceTransition = elements.ChoiceTransition
+Junction = elements.Junction
+Fork = elements.Fork
+Join = elements.Join
 Initial = elements.Initial
+Completion = elements.Completion
+pure = elements.pure
 # aliases
 T = Transition
 Local = LocalTransition
@@ -15,8 +21,10 @@ Internal = InternalTransition
 Choice = ChoiceTransition
 
 Event = eventbus.Event
+SlimEvent = eventbus.SlimEvent
 EventBus = eventbus.EventBus
 
-__all__ = ['State', 'HSM', 'Transition', 'T', 'LocalTransition', 'Local',
-           'InternalTransition', 'Internal', 'ChoiceTransition', 'Choice',
-           'Initial', 'EventBus', 'Event']
+__all__ = ['State', 'SlimState', 'HSM', 'Transition', 'T', 'LocalTransition',
+           'Local', 'InternalTransition', 'Internal', 'ChoiceTransition',
+           'Choice', 'Junction', 'Fork', 'Join', 'Initial', 'Completion',
+           'pure', 'EventBus', 'Event', 'SlimEvent']
@@ -0,0 +1,216 @@
+"""
+    Precompiled machine artifacts.
+
+    Parsing and validating big state/transition dicts, and collecting events
+    that machine listens to, is done every time an HSM is constructed. This
+    module allows doing that work once: *dump* writes the parsed and validated
+    machine structure into a compact binary artifact, and *load* recreates the
+    HSM from it without parsing or validating anything.
+
+    Artifact doesn't contain any code. State classes, event classes and
+    callables (actions, guards, choice keys, on_enter/on_exit functions) are
+    stored as references by their qualified name ('module:name') and are
+    looked up again when loading, so they must be defined at module level.
+"""
+
+import sys
+import zlib
+import cPickle as pickle
+import elements as e
+import logic as l
+
+
+FORMAT_VERSION = 6
+
+# State attributes that are stored explicitly or recomputed when loading (id
+# and cached name), all other instance attributes are pickled as they are
+_STATE_ATTRS = ('states', 'parent', 'sig', 'kind', 'on_enter', 'on_exit',
+                'history', 'final', 'id', '_name')
+
+_TRAN_TYPES = {
+    e._Transition: 'T',
+    e._Local: 'L',
+    e._Internal: 'I',
+    e._Choice: 'C',
+    e._Chain: 'X',
+    e._Fork: 'F',
+    e._Join: 'J',
+}
+_TRAN_CLASSES = dict((v, k) for k, v in _TRAN_TYPES.items())
+
+# actions and guards of compound transitions (made from junctions)
+_FUNC_TYPES = {
+    e._Sequence: 'S',
+    e._AllOf: 'A',
+}
+_FUNC_CLASSES = dict((v, k) for k, v in _FUNC_TYPES.items())
+
+
+def get_ref(obj):
+    """
+        Returns string 'module:name' that can be used for looking up the given
+        module-level object (class or function) by *resolve_ref*.
+
+        Raises
+        ------
+        ValueError : if object cannot be found by its qualified name (eg.
+            lambda or nested function/class)
+    """
+    module = sys.modules.get(getattr(obj, '__module__', None))
+    name = getattr(obj, '__name__', None)
+    if module is not None:
+        if getattr(module, name, None) is obj:
+            return '{0}:{1}'.format(module.__name__, name)
+        # module-level lambdas can be found by the name they are bound to
+        for attr, val in vars(module).items():
+            if val is obj:
+                return '{0}:{1}'.format(module.__name__, attr)
+    raise ValueError("Cannot reference {0!r} by qualified name, it must be "
+                     "defined at module level".format(obj))
+
+
+def resolve_ref(ref):
+    """Returns object referenced by 'module:name' string."""
+    module_name, _, name = ref.partition(':')
+    __import__(module_name)
+    try:
+        return getattr(sys.modules[module_name], name)
+    except AttributeError:
+        raise LookupError("Module '{0}' has no attribute '{1}' referenced by "
+                          "artifact".format(module_name, name))
+
+
+def _pack_state(state, index_of):
+    # managed attributes live in slots, __dict__ (if any) holds the rest
+    extra = dict((k, v) for k, v in getattr(state, '__dict__', {}).items()
+                 if k not in _STATE_ATTRS)
+    parent = None if state.parent is None else index_of[id(state.parent)]
+    children = [index_of[id(sub)] for sub in state.states]
+    return (state.sig, state.kind, parent, children, get_ref(type(state)),
+            get_ref(state.on_enter), get_ref(state.on_exit), state.history,
+            state.final, extra)
+
+
+def _unpack_state(packed):
+    (sig, kind, _, _, cls_ref, enter_ref, exit_ref, history, final,
+     extra) = packed
+    state = object.__new__(resolve_ref(cls_ref))
+    if extra:
+        state.__dict__.update(extra)
+    state.sig = sig
+    state.kind = kind
+    state.on_enter = resolve_ref(enter_ref)
+    state.on_exit = resolve_ref(exit_ref)
+    state.history = history
+    state.final = final
+    state.id = None
+    state._name = None
+    return state
+
+
+def _pack_func(func):
+    # compound functions reference every function they call
+    if type(func) in _FUNC_TYPES:
+        return (_FUNC_TYPES[type(func)],
+                tuple(get_ref(f) for f in func.functions))
+    return get_ref(func)
+
+
+def _unpack_func(packed):
+    if isinstance(packed, tuple):
+        Which = _FUNC_CLASSES[packed[0]]
+        return Which(tuple(resolve_ref(ref) for ref in packed[1]))
+    return resolve_ref(packed)
+
+
+def _pack_tran(tran):
+    if isinstance(tran, e._Chain):
+        return ('X', tuple(_pack_tran(branch) for branch in tran.branches))
+    if isinstance(tran, e._Choice):
+        fields = (tran.switch, tran.default, get_ref(tran.key),
+                  get_ref(tran.action))
+    else:
+        fields = (tran.target, _pack_func(tran.action),
+                  _pack_func(tran.guard))
+        # targets of forks, sources and mask of joins
+        fields += tuple(tran[3:])
+    return (_TRAN_TYPES[type(tran)],) + fields
+
+
+def _unpack_tran(packed):
+    Which = _TRAN_CLASSES[packed[0]]
+    if Which is e._Chain:
+        return Which(tuple(_unpack_tran(branch) for branch in packed[1]))
+    if Which is e._Choice:
+        switch, default, key_ref, action_ref = packed[1:]
+        return Which(switch, default, resolve_ref(key_ref),
+                     resolve_ref(action_ref))
+    target, action, guard = packed[1:4]
+    return Which(target, _unpack_func(action), _unpack_func(guard),
+                 *packed[4:])
+
+
+def dumps(hsm):
+    """
+        Returns precompiled artifact (str) describing given HSM instance.
+
+        HSM should have been validated when it was constructed, artifact is
+        loaded without performing any checks.
+
+        Raises
+        ------
+        ValueError : if some class or callable used by the machine cannot be
+            referenced by qualified name
+    """
+    index_of = dict((id(st), i) for i, st in enumerate(hsm.flattened))
+    states = [_pack_state(st, index_of) for st in hsm.flattened]
+    trans = [(src_sig, get_ref(evt), _pack_tran(tran))
+             for src_sig, outgoing in hsm.trans.items()
+             for evt, tran in outgoing.items()]
+    event_set = (hsm.event_set if hsm.event_set is not None
+                 else l.get_events(hsm.flattened, hsm.trans))
+    events = [get_ref(evt) for evt in event_set]
+    data = (FORMAT_VERSION, index_of[id(hsm.root)], states, trans, events)
+    return zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+
+def loads(artifact):
+    """
+        Returns new HSM instance recreated from artifact created by *dumps*.
+
+        Raises
+        ------
+        ValueError : if artifact was created by incompatible version
+        LookupError : if referenced class or callable doesn't exist anymore
+    """
+    data = pickle.loads(zlib.decompress(artifact))
+    if data[0] != FORMAT_VERSION:
+        raise ValueError("Unsupported artifact format version "
+                         "{0}".format(data[0]))
+    _, root_index, packed_states, packed_trans, events = data
+
+    flattened = [_unpack_state(packed) for packed in packed_states]
+    for state, packed in zip(flattened, packed_states):
+        parent_index, children = packed[2], packed[3]
+        state.parent = (None if parent_index is None
+                        else flattened[parent_index])
+        state.states = [flattened[i] for i in children]
+
+    trans = {}
+    for src_sig, evt_ref, packed in packed_trans:
+        outgoing = trans.setdefault(src_sig, {})
+        outgoing[resolve_ref(evt_ref)] = _unpack_tran(packed)
+
+    event_set = set(resolve_ref(ref) for ref in events)
+    return e.HSM._from_parsed(flattened[root_index], flattened, trans,
+                              event_set)
+
+
+def dump(hsm, fp):
+    """Writes precompiled artifact for given HSM into file object *fp*."""
+    fp.write(dumps(hsm))
+
+
+def load(fp):
+    """Returns new HSM instance recreated from artifact read from *fp*."""
+    return loads(fp.read())
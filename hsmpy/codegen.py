@@ -0,0 +1,326 @@
+"""
+    Code generation backend.
+
+    Generic event handling (*get_merged_sequences*) rebuilds the tree of active
+    states and re-discovers the exit/entry paths every time an event is
+    dispatched. For a machine without orthogonal regions the active
+    configuration is fully determined by its leaf state, so all of that can be
+    worked out in advance: this module generates Python source with one
+    function per (leaf state, event type) that has guard checks and the whole
+    exit/transition/entry call sequence inlined.
+
+    Parts of the machine whose outcome can only be decided at runtime (Choice
+    transitions, Choice initial transitions when entering target state) are
+    not compiled, events for which they would be considered are handed back
+    to the interpreter.
+
+    Generated code doesn't reference any objects directly, states and
+    transitions are bound by their index when the code is loaded, so the
+    compiled code object can be cached on disk and reused by every machine
+    having the same structure.
+"""
+
+import os
+import imp
+import marshal
+import hashlib
+import elements as e
+import logic as l
+
+
+CODEGEN_VERSION = 2
+
+
+def _event_name(evt):
+    return '{0}.{1}'.format(evt.__module__, evt.__name__)
+
+
+class _Layout(object):
+    """Deterministic numbering of machine's states, events and transitions."""
+    def __init__(self, hsm):
+        if any(st.kind == 'orthogonal' for st in hsm.flattened):
+            raise ValueError("Code generation doesn't support orthogonal "
+                             "states")
+        if any(st.history for st in hsm.flattened):
+            raise ValueError("Code generation doesn't support states with "
+                             "history")
+        if any(st.final for st in hsm.flattened):
+            raise ValueError("Code generation doesn't support final states")
+        self.hsm = hsm
+        self.states = hsm.flattened
+        self.state_index = dict((id(st), i)
+                                for i, st in enumerate(self.states))
+        self.leaves = [i for i, st in enumerate(self.states)
+                       if st.kind == 'leaf']
+        self.events = sorted(set(evt for outgoing in hsm.trans.values()
+                                 for evt in outgoing if evt is not e.Initial),
+                             key=_event_name)
+        names = [_event_name(evt) for evt in self.events]
+        # ambiguous names make numbering depend on the process, so compiled
+        # code mustn't be shared through the disk cache
+        self.cacheable = len(set(names)) == len(names)
+        # branches of transition chains are numbered separately
+        self.transitions = [
+            tran
+            for st in self.states
+            for evt in sorted(hsm.trans.get(st.sig, {}), key=_event_name)
+            for tran in l.get_branches(hsm.trans[st.sig][evt])]
+        self.tran_index = dict((id(tr), i)
+                               for i, tr in enumerate(self.transitions))
+
+    def describe(self):
+        """Returns string describing everything that generated code uses."""
+        def tran_desc(tran):
+            if isinstance(tran, e._Choice):
+                return ('C',)
+            if isinstance(tran, e._Chain):
+                return ('X',) + tuple(tran_desc(br) for br in tran.branches)
+            return (type(tran).__name__, tran.target,
+                    tran.action is e.do_nothing, tran.guard is e.always_true)
+
+        def parent(st):
+            return None if st.parent is None else self.index(st.parent)
+
+        states = [(st.sig, st.kind, parent(st)) for st in self.states]
+        trans = [(self.index(l.get_state_by_sig(sig, self.states)),
+                  _event_name(evt), tran_desc(tran))
+                 for sig, outgoing in self.hsm.trans.items()
+                 for evt, tran in outgoing.items()]
+        return repr((CODEGEN_VERSION, states, sorted(trans)))
+
+    def index(self, state):
+        return self.state_index[id(state)]
+
+    def namespace(self):
+        """Returns dict with objects that generated code refers to."""
+        ns = {}
+        for i, st in enumerate(self.states):
+            ns['x{0}'.format(i)] = st._exit
+            ns['n{0}'.format(i)] = st._enter
+        for i, tran in enumerate(self.transitions):
+            ns['a{0}'.format(i)] = tran.action
+            if not isinstance(tran, e._Choice):
+                ns['g{0}'.format(i)] = tran.guard
+        return ns
+
+
+def _has_static_entry(state, trans, flat):
+    """Checks that entering state doesn't depend on Choice initial keys."""
+    if state.kind != 'composite':
+        return True
+    init_tran = trans[state.sig][e.Initial]
+    if isinstance(init_tran, e._Choice):
+        return False
+    target = l.get_state_by_sig(init_tran.target, flat)
+    return _has_static_entry(target, trans, flat)
+
+
+def _candidates(leaf, evt, trans):
+    """
+        Returns list of (state, transition) tuples that can respond to event
+        type *evt* when machine is in *leaf* state, ordered by priority. List
+        ends with the first transition that is certain to be taken.
+    """
+    found = []
+    for st in reversed(l.get_path_from_root(leaf)):
+        tran = trans.get(st.sig, {}).get(evt)
+        if tran is None:
+            continue
+        for branch in l.get_branches(tran):
+            found += [(st, branch)]
+            if (not isinstance(branch, e._Choice)
+                    and branch.guard is e.always_true):
+                return found
+    return found
+
+
+def _find_node(tree, state):
+    """Returns (state, subtree) node from tree that is a single path."""
+    node = tree[0]
+    while node[0] is not state:
+        node = node[1][0]
+    return node
+
+
+def _call_lines(layout, actions):
+    lines = []
+    for act in actions:
+        if isinstance(act.item, e.State):
+            prefix = 'x' if act.kind == 'exit' else 'n'
+            lines += ['{0}{1}(evt, hsm)'.format(prefix,
+                                                layout.index(act.item))]
+        elif act.function is not e.do_nothing:
+            lines += ['a{0}(evt, hsm)'.format(
+                layout.tran_index[id(act.item)])]
+    return lines
+
+
+def _generate_function(layout, leaf_index, evt_index):
+    """
+        Returns source of the function (or None if interpreter must be used)
+        handling event type with *evt_index* while in leaf with *leaf_index*.
+    """
+    hsm = layout.hsm
+    leaf = layout.states[leaf_index]
+    evt = layout.events[evt_index]
+    candidates = _candidates(leaf, evt, hsm.trans)
+    if any(isinstance(tran, e._Choice) for _, tran in candidates):
+        return None
+
+    tree = l.tree_from_state_set(set(l.get_path_from_root(leaf)))
+    event = evt.__new__(evt)  # only used for naming actions
+    lines = ['def d{0}_{1}(evt, hsm):'.format(leaf_index, evt_index)]
+    for st, tran in candidates:
+        if isinstance(tran, e._Internal):
+            new_leaf = leaf
+        else:
+            target = l.get_state_by_sig(tran.target, hsm.flattened)
+            if not _has_static_entry(target, hsm.trans, hsm.flattened):
+                return None
+        response = (_find_node(tree, st), tran)
+        exits, entries = l.get_response_sequence(response, event, hsm.trans,
+                                                 hsm.flattened, None)
+        if not isinstance(tran, e._Internal):
+            new_leaf = [act.item for act in entries
+                        if isinstance(act.item, e.State)][-1]
+        body = _call_lines(layout, exits + entries)
+        body += ['return {0}'.format(layout.index(new_leaf))]
+        if tran.guard is e.always_true:
+            lines += ['    ' + ln for ln in body]
+            return '\n'.join(lines)
+        lines += ['    if g{0}(evt, hsm):'.format(layout.tran_index[id(tran)])]
+        lines += ['        ' + ln for ln in body]
+    lines += ['    return {0}'.format(leaf_index)]
+    return '\n'.join(lines)
+
+
+def generate_source(hsm):
+    """
+        Returns Python source of the module implementing event handling for
+        given HSM instance. Module defines TABLE dict that maps
+        (leaf_index, event_index) tuples to functions, or to None where
+        interpreter must be used. Each function takes event instance and HSM
+        instance, performs all actions and returns index of the new leaf.
+
+        Raises
+        ------
+        ValueError : if machine has orthogonal states
+    """
+    return _generate(_Layout(hsm))
+
+
+def _generate(layout):
+    funcs = []
+    table = []
+    for leaf_index in layout.leaves:
+        leaf = layout.states[leaf_index]
+        for evt_index, evt in enumerate(layout.events):
+            if not _candidates(leaf, evt, layout.hsm.trans):
+                continue  # nobody responds, event will be ignored
+            source = _generate_function(layout, leaf_index, evt_index)
+            if source is None:
+                table += ['    ({0}, {1}): None,'.format(leaf_index,
+                                                         evt_index)]
+            else:
+                funcs += [source]
+                table += ['    ({0}, {1}): d{0}_{1},'.format(leaf_index,
+                                                             evt_index)]
+    return '\n\n\n'.join(funcs + ['TABLE = {\n' + '\n'.join(table) + '\n}\n'])
+
+
+def _get_code(layout, cache_dir):
+    """Returns code object, reading it from or writing it to disk cache."""
+    path = None
+    if cache_dir is not None and layout.cacheable:
+        # marshal format and bytecode are specific to interpreter version,
+        # which is identified by the magic number of its .pyc files
+        key = hashlib.sha1(imp.get_magic() + layout.describe()).hexdigest()
+        path = os.path.join(cache_dir, 'hsmpy_{0}.bin'.format(key))
+        if os.path.exists(path):
+            with open(path, 'rb') as fp:
+                return marshal.load(fp)
+    code = compile(_generate(layout), '<hsmpy codegen>', 'exec')
+    if path is not None:
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as fp:
+            marshal.dump(code, fp)
+        os.rename(tmp_path, path)
+    return code
+
+
+class CompiledMachine(object):
+    def __init__(self, hsm, cache_dir=None):
+        """
+            Generates (or loads from *cache_dir*) specialized event handling
+            code for the given HSM instance.
+
+            Parameters
+            ----------
+            hsm : HSM
+                machine to compile, it cannot have orthogonal states
+            cache_dir : str (optional)
+                directory in which compiled code is cached between runs
+        """
+        layout = _Layout(hsm)
+        namespace = layout.namespace()
+        exec _get_code(layout, cache_dir) in namespace
+        self.hsm = hsm
+        self._states = layout.states
+        self._leaf_index = dict((id(layout.states[i]), i)
+                                for i in layout.leaves)
+        self._paths = dict((i, frozenset(l.get_path_from_root(st)))
+                           for i, st in enumerate(layout.states))
+        self._table = dict((i, {}) for i in layout.leaves)
+        for (leaf_index, evt_index), func in namespace['TABLE'].items():
+            self._table[leaf_index][layout.events[evt_index]] = func
+        self._last_set = None
+        self._last_leaf = None
+
+    def _current_leaf(self):
+        state_set = self.hsm.current_state_set
+        if state_set is not self._last_set:
+            # state set was changed by the interpreter
+            leaf = [st for st in state_set if st.kind == 'leaf'][0]
+            self._last_set = state_set
+            self._last_leaf = self._leaf_index[id(leaf)]
+        return self._last_leaf
+
+    def handle(self, event):
+        """
+            Performs transition for event. Returns False if event wasn't
+            handled and it has to be handled by the interpreter instead.
+        """
+        leaf = self._current_leaf()
+        handlers = self._table[leaf]
+        evt_type = event.__class__
+        if evt_type not in handlers:
+            return True  # no state responds to this event
+        func = handlers[evt_type]
+        if func is None:
+            return False
+        new_leaf = func(event, self.hsm)
+        if new_leaf != leaf:
+            old_path, new_path = self._paths[leaf], self._paths[new_leaf]
+            self.hsm._update_handled(old_path - new_path, new_path - old_path)
+            new_set = set(new_path)
+            self.hsm.current_state_set = new_set
+            self._last_set = new_set
+            self._last_leaf = new_leaf
+        return True
+
+
+def compile_machine(hsm, cache_dir=None):
+    """
+        Compiles event handling code for given HSM instance and makes it use
+        compiled code instead of the interpreter. Should be called before the
+        machine is started.
+
+        Returns CompiledMachine instance.
+
+        Raises
+        ------
+        ValueError : if machine has orthogonal states
+    """
+    compiled = CompiledMachine(hsm, cache_dir)
+    hsm._compiled = compiled
+    return compiled
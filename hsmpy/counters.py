@@ -0,0 +1,129 @@
+"""
+    Transition coverage and hot-path counters.
+
+    Counters are enabled by assigning them to HSM instance:
+
+        hsm.counters = Counters(hsm)
+
+    From then on every state entry and exit, and every transition taken
+    (including initial transitions) is counted. Every (source state, event
+    type, transition) in *hsm.trans* gets a numeric id when Counters instance
+    is created, states are identified by their dense ids (*State.id*), and
+    counts are kept in arrays indexed by those ids, so counting an action is
+    a lookup of its id and an increment. When *counters* attribute is None
+    (default) nothing is counted.
+
+    Like profiling, counting is done by the interpreter, machines compiled by
+    codegen backend handle events with the interpreter while counters are set.
+"""
+
+from array import array
+import elements as e
+from logic import get_branches
+
+
+def _array(size):
+    return array('L', [0]) * size
+
+
+def _event_name(evt):
+    return evt.__name__
+
+
+class Counters(object):
+    def __init__(self, hsm):
+        """
+            Constructor
+
+            Parameters
+            ----------
+            hsm : HSM
+                machine whose states and transitions are counted
+        """
+        # states are numbered in the order of hsm.flattened
+        self.states = list(hsm.flattened)
+        # (source_state, event_type, transition) tuples, every branch of
+        # transition chain is counted separately
+        self.transitions = [
+            (st, evt, tran)
+            for st in self.states
+            for evt in sorted(hsm.trans.get(st.sig, {}), key=_event_name)
+            for tran in get_branches(hsm.trans[st.sig][evt])]
+        # event types get dense ids too, in order of appearance
+        self._event_ids = {}
+        for _, evt, _ in self.transitions:
+            self._event_ids.setdefault(evt, len(self._event_ids))
+        # transitions are looked up by ids of source state and event type
+        # of transition action (one transition object can be shared by
+        # states and event types), and by identity of the branch when
+        # transition is a chain; objects are alive as long as hsm is
+        self._tran_ids = dict(
+            ((st.id, self._event_ids[evt], id(tran)), i)
+            for i, (st, evt, tran) in enumerate(self.transitions))
+        self.reset()
+
+    def reset(self):
+        """Sets all counts to zero."""
+        self.entries = _array(len(self.states))
+        self.exits = _array(len(self.states))
+        self.taken = _array(len(self.transitions))
+
+    def count(self, actions):
+        """Counts states and transitions whose actions are being performed."""
+        tran_ids = self._tran_ids
+        event_ids = self._event_ids
+        for act in actions:
+            kind = act.kind
+            if kind == 'transition':
+                tran = act.item
+                if type(tran) is e._Chosen:
+                    # made on the fly by the Choice transition
+                    tran = tran.choice
+                evt_id = event_ids[act.event]
+                self.taken[tran_ids[act.state.id, evt_id, id(tran)]] += 1
+            elif kind == 'exit':
+                self.exits[act.state.id] += 1
+            else:
+                self.entries[act.state.id] += 1
+
+    def report(self):
+        """
+            Returns dict with keys:
+                * 'states': list of dicts with keys 'state', 'entries' and
+                  'exits', one for every state
+                * 'transitions': list of dicts with keys 'source', 'event',
+                  'kind' (transition type), 'target' (None for internal and
+                  choice transitions) and 'count', one for every transition
+                  (every branch of transition chain has its own)
+        """
+        states = [{'state': st.name,
+                   'entries': self.entries[i],
+                   'exits': self.exits[i]}
+                  for i, st in enumerate(self.states)]
+        transitions = []
+        for i, (st, evt, tran) in enumerate(self.transitions):
+            target = getattr(tran, 'target', None)
+            transitions += [{
+                'source': st.name,
+                'event': evt.__name__,
+                'kind': type(tran).__name__,
+                'target': None if target is None else e.State.sig_to_name(
+                    target),
+                'count': self.taken[i],
+            }]
+        return {'states': states, 'transitions': transitions}
+
+    def hot(self, n=10):
+        """Returns *n* most frequently taken transitions from the report."""
+        transitions = self.report()['transitions']
+        return sorted(transitions, key=lambda tr: tr['count'],
+                      reverse=True)[:n]
+
+    def dead(self):
+        """Returns transitions from the report that were never taken."""
+        return [tr for tr in self.report()['transitions'] if not tr['count']]
+
+    def unvisited(self):
+        """Returns names of states that were never entered."""
+        return [st.name for i, st in enumerate(self.states)
+                if not self.entries[i]]
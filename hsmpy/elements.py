@@ -1,9 +1,12 @@
 import logging
 from collections import namedtuple
-from eventbus import Event
+from eventbus import Event, SlimEvent, _get_slim_state, _set_slim_state
 from itertools import izip_longest
 import re
-from logic import parse, get_events, get_merged_sequences, entry_sequence
+from timeit import default_timer as clock
+from logic import (parse, get_events, get_merged_sequences, entry_sequence,
+                   get_subtree_events, history_sequence, flatten,
+                   get_completion_sequences, fork_plan)
 from validation import (find_unreachable_states,
                         find_duplicate_sigs,
                         find_nonexistent_transition_sources,
@@ -11,11 +14,31 @@ from validation import (find_unreachable_states,
                         find_missing_initial_transitions,
                         find_invalid_initial_transitions,
                         find_invalid_local_transitions,
-                        find_invalid_choice_transitions)
+                        find_invalid_choice_transitions,
+                        find_invalid_history_states,
+                        find_invalid_final_states,
+                        find_invalid_forks_and_joins)
 
 
 _log = logging.getLogger(__name__)
 
+# caches of conversions between state names and sigs, both are immutable so
+# results can be reused; caches are emptied when they reach the size limit,
+# so that names of unknown states passed to HSM.is_in can't grow them
+# without bound
+_CONVERSION_CACHE_SIZE = 4096
+_names_by_sig = {}
+_sigs_by_name = {}
+
+
+def _cached_conversion(cache, key, convert):
+    result = cache.get(key)
+    if result is None:
+        result = convert(key)  # malformed names raise and aren't stored
+        if len(cache) >= _CONVERSION_CACHE_SIZE:
+            cache.clear()
+        cache[key] = result
+    return result
 
 # used for parsing State name into signature tuple
 re_name_and_index = re.compile("""
@@ -35,7 +58,8 @@ re_last_name = re.compile("""
 
 
 class State(object):
-    def __init__(self, states=None, on_enter=None, on_exit=None):
+    def __init__(self, states=None, on_enter=None, on_exit=None,
+                 history=None, final=False):
         """
             Constructor
 
@@ -54,6 +78,18 @@ class State(object):
             on_exit : function
                 function to be called when state is exited, before state's
                 *exit* method
+            history : str (optional)
+                'shallow' or 'deep', valid only for composite states; when
+                composite state with history is entered again without
+                specific substate being targeted, instead of following its
+                initial transition it restores the substate that was active
+                when it was exited ('shallow'), or all of the substates that
+                were active, at every level ('deep'); initial transition is
+                used on the first entry
+            final : bool (optional)
+                if True, state is a final state, valid only for leaf states
+                without outgoing transitions; entering it completes its
+                parent state, see Completion event
         """
         self.states = {} if states is None else states
         self.parent = None
@@ -61,6 +97,13 @@ class State(object):
         self.kind = 'unknown'
         self.on_enter = on_enter or do_nothing
         self.on_exit = on_exit or do_nothing
+        self.history = history
+        self.final = final
+        # position in machine's flattened list of states (parse order), set
+        # by parse and HSM
+        self.id = None
+        # (sig, name) tuple, name is valid as long as sig is the same object
+        self._name = None
 
     def _enter(self, evt, hsm):
         """Used internally by HSM"""
@@ -114,6 +157,10 @@ class State(object):
 
     @staticmethod
     def sig_to_name(tup):
+        return _cached_conversion(_names_by_sig, tup, State._format_name)
+
+    @staticmethod
+    def _format_name(tup):
         def grouper(iterable, n, fillvalue=None):
             "Collect data into fixed-length chunks or blocks"
             # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx
@@ -126,6 +173,10 @@ class State(object):
 
     @staticmethod
     def name_to_sig(name):
+        return _cached_conversion(_sigs_by_name, name, State._parse_name)
+
+    @staticmethod
+    def _parse_name(name):
         # got to split manually, python regex doesn't support repeated captures
         segments = [n.strip() for n in name.split('.')]
         first_matches = [re_name_and_index.match(seg) for seg in segments[:-1]]
@@ -141,7 +192,12 @@ class State(object):
 
     @property
     def name(self):
-        return State.sig_to_name(self.sig)
+        cached = self._name
+        if cached is not None and cached[0] is self.sig:
+            return cached[1]
+        name = State.sig_to_name(self.sig)
+        self._name = (self.sig, name)
+        return name
 
     @name.setter
     def name(self, val):
@@ -157,7 +213,8 @@ class State(object):
     @property
     def __attrs(self):
         # doesn't consider parent state, parents can be different!
-        return (self.sig, self.on_enter, self.on_exit, self.kind)
+        return (self.sig, self.on_enter, self.on_exit, self.kind,
+                self.history, self.final)
 
     def __eq__(self, other):
         def check_states(a, b):
@@ -174,15 +231,71 @@ class State(object):
                 and check_states(self, other))
 
 
-class Initial(Event):
+class SlimState(State):
+    """
+        Base class for states that don't need any attributes other than the
+        ones managed by HSM (*states*, *parent*, *sig*, *kind*, *on_enter*,
+        *on_exit*, *history* and *final*), which are kept in slots.
+        Per-instance __dict__ is allocated only if some other attribute is
+        assigned. Every HSM instance holds its own copies of states, so this
+        matters for applications running many machines. Subclasses must
+        declare empty __slots__ too, otherwise their attributes end up in
+        __dict__.
+    """
+    __slots__ = ('states', 'parent', 'sig', 'kind', 'on_enter', 'on_exit',
+                 'history', 'final', 'id', '_name')
+
+    def __getstate__(self):
+        return _get_slim_state(self)
+
+    def __setstate__(self, state):
+        _set_slim_state(self, state)
+
+
+class Initial(SlimEvent):
     """Used for defining initial transitions of composite states."""
-    pass
+    __slots__ = ()
+
+
+class Completion(SlimEvent):
+    """
+        Used for defining completion transitions. Composite state completes
+        when one of its final substates is entered, orthogonal state
+        completes when all of its sub-machines have completed. Completion
+        transition of the state is performed right after that, in the same
+        run-to-completion step. Event's data is the name of completed state.
+        Completion events aren't dispatched on the event bus.
+    """
+    __slots__ = ()
 
 
 # transitions
 
 do_nothing = lambda evt, hsm: None  # action does nothing by default
 always_true = lambda evt, hsm: True  # make guard always pass by default
+event_data = lambda evt, hsm: evt.data  # default key for Choice transitions
+
+
+def pure(func):
+    """
+        Marks guard or Choice key function as pure: its result depends only
+        on event and machine's data, which don't change while machine is
+        choosing transitions for an event. Pure functions are evaluated at
+        most once per event, even if many orthogonal regions use them. Can
+        be used as a decorator.
+
+        Parameters
+        ----------
+        func : function/callable
+            guard or key function, it must be hashable and accept new
+            attributes
+
+        Returns
+        -------
+        func : the same function
+    """
+    func.pure = True
+    return func
 
 
 def _make_tran(Which, target, action=None, guard=None):
@@ -193,6 +306,36 @@ _Transition = namedtuple('Transition', 'target, action, guard')
 _Local = namedtuple('LocalTransition', 'target, action, guard')
 _Internal = namedtuple('InternalTransition', 'target, action, guard')
 _Choice = namedtuple('ChoiceTransition', 'switch, default, key, action')
+# regular transition made by Choice transition for the chosen target, keeps
+# the original _Choice in *choice*
+_Chosen = namedtuple('ChosenTransition', 'target, action, guard, choice')
+# ordered guarded transitions for one event, made from lists in trans map
+_Chain = namedtuple('TransitionChain', 'branches')
+_Junction = namedtuple('Junction', 'segments')
+# fork's target is the orthogonal state containing *targets*, and join's
+# *mask* has bits of *sources* set, both are filled in by parse
+_Fork = namedtuple('ForkTransition', 'target, action, guard, targets')
+_Join = namedtuple('JoinTransition', 'target, action, guard, sources, mask')
+
+
+class _Sequence(namedtuple('Sequence', 'functions')):
+    """Action of compound transition, calls actions of all segments."""
+    __slots__ = ()
+
+    def __call__(self, evt, hsm):
+        for func in self.functions:
+            func(evt, hsm)
+
+
+class _AllOf(namedtuple('AllOf', 'functions')):
+    """Guard of compound transition, passes if guards of all segments do."""
+    __slots__ = ()
+
+    def __call__(self, evt, hsm):
+        for func in self.functions:
+            if not func(evt, hsm):
+                return False
+        return True
 
 
 def Transition(target, action=None, guard=None):
@@ -201,9 +344,9 @@ def Transition(target, action=None, guard=None):
 
         Parameters
         ----------
-        target : str
+        target : str or Junction
             name of the target state (in case of InternalTransition target
-            is fixed to None)
+            is fixed to None), or junction that chooses the target state
         action : function/callable (optional)
             function to call when performing the transition, it must take
             two parameters: event instance and reference to HSM instance
@@ -234,6 +377,82 @@ def InternalTransition(action=None, guard=None):
     return _make_tran(_Internal, None, action, guard)
 
 
+def Junction(segments):
+    """
+        Static junction pseudostate.
+
+        Junction can be the target of regular and local transitions, and
+        chains several transition segments into compound transitions. It
+        isn't a state: when machine is parsed, every transition to junction
+        is replaced with compound transitions, one for every outgoing
+        segment, so choosing the target costs a single transition at run
+        time. Compound transition has the target of the last segment, its
+        guard passes if guards of all segments pass (all guards are checked
+        before any action is performed) and its action calls actions of all
+        segments in order. Segments are tried in order like lists of
+        transitions, and if none of them passes, the transition isn't taken.
+        The same junction can be the target of many transitions.
+
+        Parameters
+        ----------
+        segments : list
+            regular transitions leaving the junction, their targets can be
+            states or other junctions
+    """
+    return _Junction(tuple(segments))
+
+
+def Fork(targets, action=None, guard=None):
+    """
+        Fork transition.
+
+        Enters orthogonal state and puts several of its sub-machines directly
+        into given target substates, instead of following their initial
+        transitions. Sub-machines without a target are entered as usual.
+        Targets must be in different sub-machines of the same orthogonal
+        state.
+
+        Parameters
+        ----------
+        targets : list
+            names of target states, like 'work[0].running' (see State.name)
+        action : function/callable (optional)
+            function to call when performing the transition
+        guard : function/callable (optional)
+            function that evaluates to True/False, deciding whether to take
+            this transition
+    """
+    return _Fork(None, action or do_nothing, guard or always_true,
+                 tuple(targets))
+
+
+def Join(sources, target, action=None, guard=None):
+    """
+        Join transition.
+
+        Taken only if all of the *sources* states are active, it leaves all
+        of the sub-machines of orthogonal state at once. Sources must be in
+        different sub-machines of the same orthogonal state, and join must
+        be declared by that orthogonal state (or one of its parents). Like
+        other transitions of a parent state, it's considered only if none
+        of the active substates responds to the event.
+
+        Parameters
+        ----------
+        sources : list
+            names of source states, like 'work[0].done' (see State.name)
+        target : str
+            name of the target state
+        action : function/callable (optional)
+            function to call when performing the transition
+        guard : function/callable (optional)
+            function that evaluates to True/False, deciding whether to take
+            this transition
+    """
+    return _Join(target, action or do_nothing, guard or always_true,
+                 tuple(sources), None)
+
+
 def ChoiceTransition(switch, default=None, key=None, action=None):
     """
         Choice transition.
@@ -258,11 +477,11 @@ def ChoiceTransition(switch, default=None, key=None, action=None):
         action : func (optional)
             action to be performed when transition is performed
     """
-    default_key = lambda evt, hsm: evt.data
-    return _Choice(switch, default, key or default_key, action or do_nothing)
+    return _Choice(switch, default, key or event_data, action or do_nothing)
 
 
-class Action(namedtuple('Action', 'name, function, item')):
+class Action(namedtuple('Action',
+                        'name, function, item, kind, state, event')):
     """
         Action's purpose is to adapt different functions into common
         interface required when executing transitions.
@@ -280,6 +499,15 @@ class Action(namedtuple('Action', 'name, function, item')):
             and HSM instance
         item : State or Transition
             original object whose function is wrapped
+        kind : str
+            'entry' or 'exit' for state actions, 'transition' for
+            transition actions
+        state : State
+            state that is entered or exited, or whose transition is
+            performed (one transition object can be shared by many states)
+        event : Event subclass
+            event type of transition action (one transition object can be
+            used for many event types), None for entry and exit actions
     """
     def __call__(self, event, hsm):
         """Invokes the wrapped function"""
@@ -289,6 +517,11 @@ class Action(namedtuple('Action', 'name, function, item')):
         return self.name
 
 
+class HSMData(object):
+    """Empty object used as a shared data between all states of HSM."""
+    pass
+
+
 class HSM(object):
     def __init__(self, states_map, transitions_map, skip_validation=False):
         """
@@ -305,17 +538,104 @@ class HSM(object):
                 corresponding event-transition map
         """
         top, flattened, trans = parse(states_map, transitions_map)
+        self._setup(top, flattened, trans)
+        if not skip_validation:
+            self._validate(states_map, self.trans, self.flattened)
+
+    def _setup(self, top, flattened, trans, event_set=None):
+        """Initializes instance from already parsed machine structure."""
         self.flattened = flattened
         self.root = top
         self.trans = trans
-        if not skip_validation:
-            self._validate(states_map, self.trans, self.flattened)
+        # event types that each state has transitions for
+        self._state_events = dict(
+            (st, tuple(evt for evt in trans.get(st.sig, {})
+                       if evt != Initial and evt != Completion))
+            for st in flattened)
+        # states that have completion transitions
+        self._completing = frozenset(
+            st for st in flattened if Completion in trans.get(st.sig, {}))
+        # maps orthogonal states to number of their sub-machines that are
+        # in final states, updated as final states are entered and exited
+        self._completed_regions = {}
+        # states that completed and whose completion transitions are to be
+        # performed in current run-to-completion step
+        self._completions = []
+        # dense ids of states (their positions in flattened list, i.e. parse
+        # order) and of event types that states respond to, and
+        # reverse tables mapping ids to sigs and event types; states are
+        # already numbered by parse, but not the ones loaded from artifacts
+        for i, st in enumerate(flattened):
+            st.id = i
+        self.sigs = [st.sig for st in flattened]
+        self._name_ids = dict((st.name, i) for i, st in enumerate(flattened))
+        self.event_types = sorted(
+            set(evt for st in flattened for evt in self._state_events[st]),
+            key=lambda evt: (evt.__name__, evt.__module__))
+        self.event_ids = dict((evt, i)
+                              for i, evt in enumerate(self.event_types))
+        # for every event type, dict mapping ids of states whose subtrees
+        # respond to it to their transitions, states that don't respond
+        # themselves (but some substate does) have None; other states are
+        # left out, so tables grow with the number of transitions rather
+        # than with states times event types
+        self._columns = [{} for evt in self.event_types]
+        for st, events in get_subtree_events(flattened, trans).items():
+            own = self._state_events[st]
+            for evt in events:
+                self._columns[self.event_ids[evt]][st.id] = (
+                    trans[st.sig][evt] if evt in own else None)
+        # every fork's target substates of orthogonal state's sub-machines,
+        # forks without target are invalid and are reported by validation
+        forks = set(tr for outgoing in trans.values()
+                    for tr in outgoing.values()
+                    if isinstance(tr, _Fork) and tr.target is not None)
+        self._fork_plans = dict((tr, fork_plan(tr, flattened))
+                                for tr in forks)
+        # bits of states in *_active_mask*, which is maintained only if
+        # machine has joins
+        has_joins = any(isinstance(tr, _Join) for outgoing in trans.values()
+                        for tr in outgoing.values())
+        self._state_bits = (dict((st, 1 << st.id) for st in flattened)
+                            if has_joins else None)
+        self._active_mask = 0
+        # maps states with history to sets of their substates (at any level)
+        self._history_scope = dict((st, frozenset(flatten(st.states)))
+                                   for st in flattened if st.history)
+        # maps states with history to sorted tuples of indices of substates
+        # that were active when state was last exited
+        self._history = {}
+        # entry sequences restoring deep history, by (state, indices)
+        self._history_entries = {}
+        # maps event types handled by any of the currently active states to
+        # number of active states that handle them
+        self._handled_counts = {}
+        self._narrow_subscriptions = False
+        # computed on start unless it was restored from precompiled artifact
+        self.event_set = event_set
         # empty object which can be used as a shared data between all states
-        self.data = type('HSM_data', (object,), {})()
+        self.data = HSMData()
         self._running = False
-
-
-    def start(self, eventbus):
+        # set by codegen.compile_machine
+        self._compiled = None
+        # assign profiling.Profiler instance to enable profiling
+        self.profiler = None
+        # assign metrics.LatencyRecorder instance to record processing times
+        self.latency = None
+        # assign counters.Counters instance to count states and transitions
+        self.counters = None
+        # assign tracing.TransitionTrace instance to keep recent transitions
+        self.trace = None
+
+    @classmethod
+    def _from_parsed(cls, top, flattened, trans, event_set=None):
+        """Creates instance without parsing and validating the structure."""
+        hsm = cls.__new__(cls)
+        hsm._setup(top, flattened, trans, event_set)
+        return hsm
+
+
+    def start(self, eventbus, narrow_subscriptions=False, restore=None):
         """
             Starts the machine (starts responding to events).
 
@@ -324,23 +644,60 @@ class HSM(object):
             eventbus : EventBus
                 event bus on which to attach event listeners; it must support
                 event queuing in order for HSM to function correctly
+            narrow_subscriptions : bool (optional)
+                if True, machine will be registered only for event types that
+                currently active states have transitions for, instead of all
+                events in machine's event_set; subscriptions are updated as
+                states are entered and exited
+            restore : dict (optional)
+                snapshot returned by *snapshot* method of machine with the
+                same structure; machine starts in snapshot's states with
+                snapshot's data, without performing any entry actions
 
             Raises
             ------
             RuntimeError : when called again after it's already started
-            ValueError : when states_map or transitions_map are not valid
+            ValueError : when states_map or transitions_map are not valid, or
+                *restore* snapshot has states that machine doesn't have
         """
         if self._running:
             raise RuntimeError("Machine is already running")
 
+        if restore is not None:
+            sigs = set(restore['states'])
+            restored = set(st for st in self.flattened if st.sig in sigs)
+            if len(restored) != len(sigs):
+                raise ValueError("Snapshot has states that machine doesn't "
+                                 "have")
+
         self.eb = eventbus
 
-        self.event_set = get_events(self.flattened, self.trans)
-        [self.eb.register(evt, self._handle_event) for evt in self.event_set]
+        if self.event_set is None:
+            self.event_set = get_events(self.flattened, self.trans)
+        self._narrow_subscriptions = narrow_subscriptions
+        if not narrow_subscriptions:
+            [self.eb.register(evt, self._handle_event)
+             for evt in self.event_set]
 
         self._running = True
 
+        self._handled_counts = {}
+        if restore is not None:
+            self.current_state_set = restored
+            self._update_handled([], restored)
+            self._completed_regions = {}
+            self._update_completion([], restored)
+            self._completions = []
+            self._active_mask = 0
+            self._update_mask([], restored)
+            self.data = restore['data']
+            by_sig = dict((st.sig, st) for st in self.flattened)
+            self._history = dict((by_sig[sig], indices) for sig, indices
+                                 in restore.get('history', {}).items())
+            return
+
         self.current_state_set = set([self.root])
+        self._update_handled([], [self.root])
 
         # kick-start the machine
         # it has to be done by dispatching unique event (to make sure this
@@ -356,8 +713,15 @@ class HSM(object):
             actions = entry_sequence(self.root, self.trans,
                                      self.flattened, self)
             self._perform_actions(actions, Initial())
-            self.current_state_set = set(act.item for act in actions
-                                         if isinstance(act.item, State))
+            entered = set(act.item for act in actions
+                          if isinstance(act.item, State))
+            self._update_handled([], entered - self.current_state_set)
+            self._completed_regions = {}
+            self._update_completion([], entered)
+            self._active_mask = 0
+            self._update_mask([], entered)
+            self.current_state_set = entered
+            self._handle_completions()
 
         self.eb.register(KickStart, kick_start)
         self.eb.dispatch(KickStart())
@@ -374,16 +738,82 @@ class HSM(object):
         """
         if not self._running:
             return
-        [self.eb.unregister(evt, self._handle_event) for evt in self.event_set]
+        if self._narrow_subscriptions:
+            registered = self._handled_counts.keys()
+        else:
+            registered = self.event_set
+        [self.eb.unregister(evt, self._handle_event) for evt in registered]
         self._running = False
         _log.debug('HSM stopped')
 
+    def snapshot(self):
+        """
+            Returns dict with signatures of active states, machine's data
+            and recorded history, that can be passed to *start* method to
+            resume the machine later. Data isn't copied.
+        """
+        return {
+            'states': sorted(st.sig for st in self.current_state_set),
+            'data': self.data,
+            'history': dict((st.sig, indices)
+                            for st, indices in self._history.items()),
+        }
+
+    def is_in(self, name):
+        """
+            Returns True if state with given name (as in *State.name*, e.g.
+            'left[0].right') is active. Unknown names give False, malformed
+            ones raise ValueError.
+        """
+        i = self._name_ids.get(name)
+        if i is None:
+            # name can differ from State.name in whitespace
+            i = self._name_ids.get(State.sig_to_name(State.name_to_sig(name)))
+        return i is not None and self.flattened[i] in self.current_state_set
+
+    def _record_history(self, state):
+        """Records active substates of *state* which is being exited."""
+        if state.history == 'shallow':
+            active = [sub for sub in state.states
+                      if sub in self.current_state_set]
+        else:
+            scope = self._history_scope[state]
+            active = [sub for sub in self.current_state_set if sub in scope]
+        self._history[state] = tuple(sorted(sub.id
+                                            for sub in active))
+
+    def _history_sequence(self, state, trans_map, flat_states):
+        """
+            Returns list of Actions entering *state* and restoring its
+            recorded history, or None if state wasn't exited yet.
+        """
+        indices = self._history.get(state)
+        if indices is None:
+            return None
+        if state.history == 'shallow':
+            # restored substate is entered as usual, can't be cached
+            return history_sequence(state, indices, trans_map, flat_states,
+                                    self)
+        key = (state, indices)
+        actions = self._history_entries.get(key)
+        if actions is None:
+            actions = history_sequence(state, indices, trans_map,
+                                       flat_states, self)
+            self._history_entries[key] = actions
+        return actions
+
     def _perform_actions(self, actions, event):
-            _log.debug("Performing actions for event {0}: {1}".format(
-                event.__class__.__name__,
-                ', '.join(["'{0}'".format(act.name) for act in actions])
-            ))
-            [act(event, self) for act in actions]
+            if _log.isEnabledFor(logging.DEBUG):
+                _log.debug("Performing actions for event {0}: {1}".format(
+                    event.__class__.__name__,
+                    ', '.join(["'{0}'".format(act.name) for act in actions])
+                ))
+            if self.counters is not None:
+                self.counters.count(actions)
+            if self.profiler is None:
+                [act(event, self) for act in actions]
+            else:
+                self.profiler.perform(actions, event, self)
 
     def _handle_event(self, event):
         """
@@ -391,17 +821,133 @@ class HSM(object):
             it if none of the states in HSM's current state set is interested
             in that event (or guards don't pass).
         """
+        if event.__class__ not in self._handled_counts:
+            return  # none of the active states has transition for it
+
+        if self.latency is None and self.trace is None:
+            self._process_event(event)
+            return
+
+        source_set = self.current_state_set
+        start = clock()
+        self._process_event(event)
+        if self.latency is not None:
+            self.latency.record(event.__class__, clock() - start)
+        if self.trace is not None:
+            self.trace.record(event.__class__, source_set,
+                              self.current_state_set)
+
+    def _process_event(self, event):
+        """Performs transition for event handled by some active state."""
+        profiler = self.profiler
+        if profiler is None:
+            if (self._compiled is not None and self.counters is None
+                    and self._compiled.handle(event)):
+                return
+        else:
+            start = profiler.clock()
+
         exits, entries, new_state_set = get_merged_sequences(
-            self.current_state_set, event, self.trans, self.flattened, self)
+            self.current_state_set, event, self.trans, self.flattened, self,
+            self._columns[self.event_ids[event.__class__]])
+
+        if profiler is not None:
+            profiler.add_path_computation(event, profiler.clock() - start)
 
+        self._take(exits, entries, new_state_set, event)
+        if self._completions:
+            self._handle_completions()
+
+    def _take(self, exits, entries, new_state_set, event):
+        """Performs actions and moves machine to *new_state_set*."""
         assert new_state_set, "New state set cannot possibly be empty"
 
         actions = exits + entries
         self._perform_actions(actions, event)
 
+        exited = [act.item for act in exits if isinstance(act.item, State)]
+        entered = [act.item for act in entries if isinstance(act.item, State)]
+        self._update_handled(exited, entered)
+        self._update_completion(exited, entered)
+        self._update_mask(exited, entered)
         self.current_state_set = new_state_set
-        _log.debug("HSM is now in states: {0}".format(
-            ', '.join(st.name for st in self.current_state_set)))
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("HSM is now in states: {0}".format(
+                ', '.join(st.name for st in self.current_state_set)))
+
+    def _update_mask(self, exited, entered):
+        """Updates bitmask of active states used for checking joins."""
+        bits = self._state_bits
+        if bits is None:
+            return
+        mask = self._active_mask
+        for state in exited:
+            mask &= ~bits[state]
+        for state in entered:
+            mask |= bits[state]
+        self._active_mask = mask
+
+    def _update_completion(self, exited, entered):
+        """
+            Updates numbers of completed sub-machines of orthogonal states
+            after *exited* states were exited and *entered* states entered,
+            and queues completion of states that have completed.
+        """
+        counts = self._completed_regions
+        for state in exited:
+            if state.final:
+                owner = state.parent.parent
+                if owner is not None and owner.kind == 'orthogonal':
+                    counts[owner] -= 1
+        for state in entered:
+            if not state.final:
+                continue
+            region = state.parent
+            if region in self._completing:
+                self._completions.append(region)
+            owner = region.parent
+            if owner is not None and owner.kind == 'orthogonal':
+                counts[owner] = counts.get(owner, 0) + 1
+                if (counts[owner] == len(owner.states)
+                        and owner in self._completing):
+                    self._completions.append(owner)
+
+    def _handle_completions(self):
+        """Performs completion transitions of states that have completed."""
+        while self._completions:
+            state = self._completions.pop(0)
+            if state not in self.current_state_set:
+                continue  # already left by previous completion transition
+            event = Completion(state.name)
+            exits, entries, new_state_set = get_completion_sequences(
+                state, event, self.current_state_set, self.trans,
+                self.flattened, self)
+            if exits or entries:
+                self._take(exits, entries, new_state_set, event)
+
+    def _update_handled(self, exited, entered):
+        """
+            Updates the set of event types handled by currently active states
+            after *exited* states were exited and *entered* states entered.
+        """
+        counts = self._handled_counts
+        # entries are counted first so that event types handled by both
+        # exited and entered states don't get unsubscribed and subscribed
+        for state in entered:
+            for evt in self._state_events[state]:
+                if evt in counts:
+                    counts[evt] += 1
+                else:
+                    counts[evt] = 1
+                    if self._narrow_subscriptions:
+                        self.eb.register(evt, self._handle_event)
+        for state in exited:
+            for evt in self._state_events[state]:
+                counts[evt] -= 1
+                if not counts[evt]:
+                    del counts[evt]
+                    if self._narrow_subscriptions:
+                        self.eb.unregister(evt, self._handle_event)
 
     def _validate(self, original_states, trans, flat):
         """
@@ -417,6 +963,10 @@ class HSM(object):
                 * there are no composite states with missing or invalid initial
                   transitions
                 * no invalid local transitions
+                * history is used only by composite states
+                * final states are leaf states without outgoing transitions
+                * forks and joins connect different sub-machines of one
+                  orthogonal state
 
             Raises
             ------
@@ -459,3 +1009,12 @@ class HSM(object):
 
         inv_choice = find_invalid_choice_transitions(flat, trans)
         chk("Invalid choice transitions", inv_choice)
+
+        inv_history = find_invalid_history_states(flat)
+        chk("Invalid history states", inv_history)
+
+        inv_final = find_invalid_final_states(flat, trans)
+        chk("Invalid final states", inv_final)
+
+        inv_forks = find_invalid_forks_and_joins(flat, trans)
+        chk("Invalid fork and join transitions", inv_forks)
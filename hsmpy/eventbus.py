@@ -1,18 +1,75 @@
 import logging
+from timeit import default_timer as clock
 
 _log = logging.getLogger(__name__)
 
 
+def _get_slim_state(obj):
+    """
+        Returns (dict, slots) state of object whose attributes are kept in
+        __slots__, dict is None if object's per-instance __dict__ was never
+        allocated (and it isn't left allocated by this call).
+    """
+    attrs = obj.__dict__
+    if not attrs:
+        # reading __dict__ allocates it, don't keep the empty one around
+        del obj.__dict__
+        attrs = None
+    slots = {}
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            if hasattr(obj, name):
+                slots[name] = getattr(obj, name)
+    return (attrs, slots)
+
+
+def _set_slim_state(obj, state):
+    """Restores state returned by *_get_slim_state*."""
+    attrs, slots = state
+    if attrs:
+        obj.__dict__.update(attrs)
+    for name, value in slots.items():
+        setattr(obj, name, value)
+
+
 class Event(object):
     def __init__(self, data=None):
         self.data = data
 
 
+class SlimEvent(Event):
+    """
+        Base class for events that don't need any attributes other than
+        *data*, which is kept in a slot. Per-instance __dict__ is allocated
+        only if some other attribute is assigned, so instances are smaller
+        and cheaper to create. Subclasses must declare empty __slots__ too,
+        otherwise their *data* ends up in __dict__:
+
+            class Tick(SlimEvent):
+                __slots__ = ()
+    """
+    __slots__ = ('data',)
+
+    def __getstate__(self):
+        return _get_slim_state(self)
+
+    def __setstate__(self, state):
+        _set_slim_state(self, state)
+
+
 class EventBus(object):
     def __init__(self):
         self.listeners = {}
         self.queue = []
         self.dispatch_in_progress = False
+        # metrics.LatencyRecorder instances, assign them before dispatching
+        self.latency = None  # from dispatch call until event is processed
+        self.wait_latency = None  # time event spent in queue
+        # dispatch times of queued events (None when not recording latency)
+        self._queued_at = []
+        # eventlog.EventLogWriter instance, records events dispatched from
+        # outside of event handling
+        self.event_log = None
 
     def register(self, event_type, callback):
         if not issubclass(event_type, Event):
@@ -43,13 +100,12 @@ class EventBus(object):
         _log.debug(self._get_stats())
 
     def dispatch(self, event):
-        if not isinstance(event, Event):
-            raise TypeError("Must subclass Event")
-
-        # TODO: check for infinite dispatch loops
-
-        # add event to queue
-        self.queue += [event]
+        """
+            Queues the event and, unless an event is already being handled,
+            handles all queued events (including the ones dispatched while
+            handling them).
+        """
+        self.post(event)
 
         # if dispatch is currently in progress just leave event on queue
         # it will be served by currently running method
@@ -60,22 +116,85 @@ class EventBus(object):
 
         _log.debug("Event {0} added to queue, starting "
                    "dispatch".format(event.__class__.__name__))
+        self.process()
 
-        # lock to prevent other calls
-        self.dispatch_in_progress = True
+    def post(self, event):
+        """
+            Queues the event without handling it, it will be handled by the
+            next *dispatch* or *process* call.
+        """
+        if not isinstance(event, Event):
+            raise TypeError("Must subclass Event")
 
-        while self.queue:
-            event = self.queue.pop(0)
-            # gather all callbacks registered for event
-            callbacks = [cb for cb in self.listeners.get(event.__class__, [])]
-            _log.debug("Invoking {0} callbacks for {1}".format(
-                len(callbacks), event.__class__.__name__))
-            # perform gathered calls
-            [cb(event) for cb in callbacks]
+        # TODO: check for infinite dispatch loops
 
-        # unlock
-        self.dispatch_in_progress = False
-        _log.debug("Dispatch done".format(event.__class__.__name__))
+        if self.event_log is not None and not self.dispatch_in_progress:
+            self.event_log.record(event)
+
+        # add event to queue
+        self.queue += [event]
+        recording = self.latency is not None or self.wait_latency is not None
+        self._queued_at += [clock() if recording else None]
+
+    def process(self, max_events=None, max_seconds=None):
+        """
+            Handles queued events, in the order they were queued, until the
+            queue is empty or the budget is spent. Budget is checked only
+            between events, handling of an event (all callbacks registered
+            for it) is never interrupted. Events that are left over stay
+            queued.
+
+            Returns number of events remaining in the queue.
+
+            Parameters
+            ----------
+            max_events : int (optional)
+                maximal number of events to handle
+            max_seconds : float (optional)
+                time after which no more events are handled, at least one
+                event is handled regardless, so that the queue always moves
+
+            Raises
+            ------
+            RuntimeError : when called while an event is being handled
+        """
+        if self.dispatch_in_progress:
+            raise RuntimeError("Cannot process events while an event is "
+                               "being handled")
+        deadline = None if max_seconds is None else clock() + max_seconds
+
+        # lock to prevent other calls
+        self.dispatch_in_progress = True
+        handled = 0
+        try:
+            while self.queue:
+                if max_events is not None and handled >= max_events:
+                    break
+                if deadline is not None and handled and clock() >= deadline:
+                    break
+                self._handle_next()
+                handled += 1
+        finally:
+            # unlock
+            self.dispatch_in_progress = False
+        _log.debug("Dispatch done, {0} events left in queue".format(
+            len(self.queue)))
+        return len(self.queue)
+
+    def _handle_next(self):
+        event = self.queue.pop(0)
+        # None unless recorders were assigned when event was queued
+        queued_at = self._queued_at.pop(0)
+        if self.wait_latency is not None and queued_at is not None:
+            self.wait_latency.record(event.__class__, clock() - queued_at)
+        # gather all callbacks registered for event
+        callbacks = [cb for cb in self.listeners.get(event.__class__, [])]
+        _log.debug("Invoking {0} callbacks for {1}".format(
+            len(callbacks), event.__class__.__name__))
+        # perform gathered calls
+        [cb(event) for cb in callbacks]
+        if self.latency is not None and queued_at is not None:
+            self.latency.record(event.__class__, clock() - queued_at)
 
     def _get_stats(self):
         groups = [(evt.__name__, len(grp))
@@ -0,0 +1,241 @@
+"""
+    Binary event log recording and replay.
+
+    EventLogWriter appends events into a compact binary log. It's enabled by
+    assigning it to EventBus instance, after the machines using the bus are
+    started:
+
+        bus.event_log = EventLogWriter('events.log')
+
+    From then on every event passed to *dispatch* from outside of event
+    handling is recorded. Events dispatched by actions while an event is
+    being handled are not recorded, replaying the recorded events causes them
+    to be dispatched again. Writer's *checkpoint* method records the current
+    configuration of a machine, so that replay can verify it arrives at the
+    same states.
+
+    *replay* dispatches recorded events to a fresh machine as fast as it can,
+    *read* is a generator over log's records. Log is read through a memory
+    mapped file, one record at a time, so it doesn't need to fit in memory.
+
+    Log consists of a header followed by records, each record being a kind
+    byte, length of the body and the body:
+
+        * event type, introduces type id and 'module:name' reference of the
+          event class, written before the first event of that type
+        * event, type id, timestamp and event's *data* encoded by the codec
+        * checkpoint, number of events recorded so far and names of active
+          states
+
+    Only event's type and *data* are recorded, when replaying events are
+    created without calling their constructor. Event classes must be defined
+    at module level.
+"""
+
+import json
+import mmap
+import time
+import struct
+import cPickle as pickle
+from artifact import get_ref, resolve_ref
+from eventbus import EventBus
+
+
+MAGIC = 'HSMPYLOG'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8sH')
+_RECORD = struct.Struct('<BI')  # kind, length of the body
+_TYPE = struct.Struct('<H')  # type id, followed by reference
+_EVENT = struct.Struct('<Hd')  # type id and timestamp, followed by payload
+_CHECKPOINT = struct.Struct('<Q')  # event count, followed by state names
+
+_KIND_TYPE = 1
+_KIND_EVENT = 2
+_KIND_CHECKPOINT = 3
+
+
+class PickleCodec(object):
+    """Encodes event data with pickle, default codec."""
+    def encode(self, data):
+        return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, payload):
+        return pickle.loads(payload)
+
+
+class JSONCodec(object):
+    """Encodes event data as JSON, for data made of plain types."""
+    def encode(self, data):
+        return json.dumps(data, separators=(',', ':'))
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+def _config_names(hsm):
+    return sorted(st.name for st in hsm.current_state_set)
+
+
+class EventLogWriter(object):
+    def __init__(self, path, codec=None, clock=time.time, event_types=None):
+        """
+            Constructor, creates new log file (or truncates existing one).
+
+            Parameters
+            ----------
+            path : str
+                path of the log file
+            codec : object (optional)
+                object with *encode(data)* and *decode(payload)* methods used
+                for event data, PickleCodec by default
+            clock : function (optional)
+                function returning current time in seconds
+            event_types : set (optional)
+                if given, only events of these types are recorded
+        """
+        self.codec = codec or PickleCodec()
+        self.clock = clock
+        self.event_types = event_types
+        self.count = 0
+        self._type_ids = {}
+        self._fp = open(path, 'wb')
+        self._fp.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+
+    def _write(self, kind, body):
+        self._fp.write(_RECORD.pack(kind, len(body)) + body)
+
+    def _type_id(self, event_type):
+        type_id = self._type_ids.get(event_type)
+        if type_id is None:
+            type_id = len(self._type_ids)
+            self._write(_KIND_TYPE,
+                        _TYPE.pack(type_id) + get_ref(event_type))
+            self._type_ids[event_type] = type_id
+        return type_id
+
+    def record(self, event):
+        """
+            Appends event to the log.
+
+            Raises
+            ------
+            ValueError : if event's class isn't defined at module level
+        """
+        event_type = event.__class__
+        if self.event_types is not None and event_type not in self.event_types:
+            return
+        header = _EVENT.pack(self._type_id(event_type), self.clock())
+        self._write(_KIND_EVENT, header + self.codec.encode(event.data))
+        self.count += 1
+
+    def checkpoint(self, hsm):
+        """Appends current configuration of *hsm* to the log."""
+        self._write(_KIND_CHECKPOINT, _CHECKPOINT.pack(self.count)
+                    + '\n'.join(_config_names(hsm)))
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read(path, codec=None):
+    """
+        Generator yielding records from the log, in the order they were
+        written. Records are tuples:
+
+            * ('event', timestamp, event_instance)
+            * ('checkpoint', event_count, state_names_list)
+
+        Raises
+        ------
+        ValueError : if file is not an event log, or has unsupported version
+    """
+    codec = codec or PickleCodec()
+    with open(path, 'rb') as fp:
+        size = len(fp.read(_HEADER.size))
+        if size < _HEADER.size:
+            raise ValueError("'{0}' is not an event log".format(path))
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError("'{0}' is not an event log".format(path))
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported event log version {0}".format(
+                version))
+        types = {}
+        offset = _HEADER.size
+        end = len(mm)
+        while offset + _RECORD.size <= end:
+            kind, length = _RECORD.unpack_from(mm, offset)
+            start = offset + _RECORD.size
+            offset = start + length
+            if offset > end:
+                break  # last record wasn't completely written
+            if kind == _KIND_EVENT:
+                type_id, timestamp = _EVENT.unpack_from(mm, start)
+                event_type = types[type_id]
+                event = event_type.__new__(event_type)
+                event.data = codec.decode(mm[start + _EVENT.size:offset])
+                yield ('event', timestamp, event)
+            elif kind == _KIND_CHECKPOINT:
+                count, = _CHECKPOINT.unpack_from(mm, start)
+                names = mm[start + _CHECKPOINT.size:offset]
+                yield ('checkpoint', count, names.split('\n') if names else [])
+            elif kind == _KIND_TYPE:
+                type_id, = _TYPE.unpack_from(mm, start)
+                types[type_id] = resolve_ref(mm[start + _TYPE.size:offset])
+            else:
+                raise ValueError("Unknown record kind {0} at offset "
+                                 "{1}".format(kind, start - _RECORD.size))
+    finally:
+        mm.close()
+
+
+def replay(path, hsm, codec=None, check=True):
+    """
+        Dispatches all events from the log to the machine, starting it with
+        a new EventBus if it isn't running already. Returns number of
+        dispatched events.
+
+        Parameters
+        ----------
+        path : str
+            path of the log file
+        hsm : HSM
+            machine to dispatch events to
+        codec : object (optional)
+            codec that the log was written with
+        check : bool (optional)
+            if True, machine's configuration is compared with checkpoints
+            recorded in the log
+
+        Raises
+        ------
+        ValueError : if machine's configuration differs from a checkpoint
+    """
+    if not hsm._running:
+        hsm.start(EventBus())
+    dispatch = hsm.eb.dispatch
+    count = 0
+    for kind, value, item in read(path, codec):
+        if kind == 'event':
+            dispatch(item)
+            count += 1
+        elif check:
+            actual = _config_names(hsm)
+            if actual != item:
+                raise ValueError(
+                    "Configuration after {0} events differs from checkpoint, "
+                    "expected: {1}, actual: {2}".format(
+                        value, ', '.join(item), ', '.join(actual)))
+    return count
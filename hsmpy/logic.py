@@ -4,23 +4,55 @@ from copy import copy
 import elements as e
 
 
-exit_act = lambda st: e.Action('{0}-exit'.format(st.name), st._exit, st)
-entry_act  = lambda st: e.Action('{0}-entry'.format(st.name), st._enter, st)
+exit_act = lambda st: e.Action('{0}-exit'.format(st.name), st._exit, st,
+                               'exit', st, None)
+entry_act  = lambda st: e.Action('{0}-entry'.format(st.name), st._enter, st,
+                                 'entry', st, None)
 tran_act = lambda st, evt, tran: e.Action('{0}-{1}'.format(st.name,
                                           evt.__class__.__name__),
-                                          tran.action, tran)
+                                          tran.action, tran, 'transition', st,
+                                          evt.__class__)
 
 
-def get_merged_sequences(state_set, event, trans_map, flat_states, hsm):
+def get_merged_sequences(state_set, event, trans_map, flat_states, hsm,
+                         column=None):
     """ Main function that performs transition from given *state_set* on given
         *event* instance. Returns tuple
             (exit_actions_list, entry_actions_list, new_state_set)
+
+        If *column* (HSM's dict mapping state ids to transitions for event's
+        type) is given, it's used instead of *trans_map* for finding
+        transitions, and subtrees of states that aren't in it (nobody there
+        can respond to event) are skipped.
     """
     # build tree of active states from current state set,
     # propagate event through tree and get responses
     # and get exit and entry sequence for each response
     tree = tree_from_state_set(state_set)
-    resps = get_responses(tree, event, trans_map, hsm)
+    # results of pure guards and keys, shared by all regions
+    memo = {}
+    resps = get_responses(tree, event, trans_map, hsm, memo, column)
+    return merge_responses(resps, state_set, event, trans_map, flat_states,
+                           hsm)
+
+
+def get_completion_sequences(state, event, state_set, trans_map, flat_states,
+                             hsm):
+    """ Performs completion transition of active *state* on completion
+        *event*. Returns tuple like *get_merged_sequences*, with empty action
+        lists if transition's guard doesn't pass.
+    """
+    node_tuple = find_node(tree_from_state_set(state_set), state)
+    tran = trans_map[state.sig][e.Completion]
+    resps = respond(node_tuple, tran, event, hsm)
+    return merge_responses(resps, state_set, event, trans_map, flat_states,
+                           hsm)
+
+
+def merge_responses(resps, state_set, event, trans_map, flat_states, hsm):
+    """ Returns tuple (exit_actions_list, entry_actions_list, new_state_set)
+        for responses *resps* in given *state_set*.
+    """
     seqs = [get_response_sequence(resp, event, trans_map, flat_states, hsm)
             for resp in resps]
 
@@ -42,10 +74,11 @@ def get_merged_sequences(state_set, event, trans_map, flat_states, hsm):
 
 
 
-def join_paths(paths):
+def join_paths(paths, key=None):
     """ Joins multiple paths with common nodes into single path (up to the
         differing node). In order to join all paths into one tree, all *paths*
-        should all have a common root state.
+        should all have a common root state. Sibling nodes are sorted, by
+        *key* function of node tuple if given.
     """
     nodes = {}
     # put all subpaths with common root state under same dict key
@@ -59,19 +92,63 @@ def join_paths(paths):
         if tail:
             nodes[state] += [tail]
     # turn each dict key-value pair into (common_state, subbranches) tuple
-    return sorted([(el, join_paths(subs)) for el, subs in nodes.items()])
+    return sorted([(el, join_paths(subs, key)) for el, subs in nodes.items()],
+                  key=key)
+
+
+def find_node(tree_roots, state):
+    """Returns node tuple (state, subnodes) of *state* in the tree."""
+    for node_tuple in tree_roots:
+        if node_tuple[0] is state:
+            return node_tuple
+        found = find_node(node_tuple[1], state)
+        if found is not None:
+            return found
+    return None
+
+
+def _parse_order(node_tuple):
+    state_id = node_tuple[0].id
+    if state_id is None:
+        raise ValueError("state {0} wasn't numbered by parse".format(
+            node_tuple[0].name))
+    return state_id
 
 
 def tree_from_state_set(state_set):
     """ Reconstructs the tree out of states in *state_set* by joining paths
-        from each state to the root.
+        from each state to the root. Sibling nodes are in parse order (see
+        *parse*).
     """
-    return join_paths([get_path_from_root(st) for st in state_set])
+    return join_paths([get_path_from_root(st) for st in state_set],
+                      _parse_order)
 
 
-def get_responses(tree_roots, event, trans_map, hsm):
+def evaluate(func, event, hsm, memo=None):
+    """ Calls guard or Choice key *func*. If *memo* dict is given, results
+        of functions marked as pure (see elements.pure) are kept in it and
+        reused by later calls, including guards of junction segments that
+        make up compound guards.
+    """
+    if memo is not None and type(func) is e._AllOf:
+        return all(evaluate(f, event, hsm, memo) for f in func.functions)
+    if memo is None or not getattr(func, 'pure', False):
+        return func(event, hsm)
+    try:
+        return memo[func]
+    except KeyError:
+        result = memo[func] = func(event, hsm)
+        return result
+
+
+def get_responses(tree_roots, event, trans_map, hsm, memo=None, column=None):
     """ Returns list of tuples (responding_node, transition).
         *responding_node* is a tuple (state, subnodes).
+
+        Optional *memo* dict is used for evaluating pure guards and keys only
+        once. Optional *column* is used for finding transitions by state ids
+        and skipping subtrees that can't respond (see
+        *get_merged_sequences*).
     """
     if isinstance(event, e.Initial):
         raise TypeError("You shouldn't ever dispatch Initial event")
@@ -80,24 +157,53 @@ def get_responses(tree_roots, event, trans_map, hsm):
     # go all the way to the leaf states to find deepest states that respond
     for node_tuple in tree_roots:
         state, subtrees = node_tuple
-        sub_resps = get_responses(subtrees, event, trans_map, hsm)
+        if column is not None:
+            tran = column.get(state.id, False)
+            if tran is False:
+                continue  # nobody in this subtree can respond
+        else:
+            tran = trans_map.get(state.sig, {}).get(event.__class__)
+        sub_resps = get_responses(subtrees, event, trans_map, hsm, memo,
+                                  column)
         # see if at least one subbranch responded
         if sub_resps:
             resps += sub_resps
             continue
         # maybe this state can respond since its substates didn't
-        tran = trans_map.get(state.sig, {}).get(event.__class__)
-        if tran and isinstance(tran, e._Choice):
-            key = tran.key(event, hsm)
-            target = tran.switch.get(key, tran.default)
-            if target:
-                # make a regular transition to keep rest of the code simple
-                resps += [ (node_tuple, e.Transition(target, tran.action)) ]
-        elif tran and tran.guard(event, hsm):
-            resps += [ (node_tuple, tran) ]
+        if tran:
+            resps += respond(node_tuple, tran, event, hsm, memo)
     return resps
 
 
+def respond(node_tuple, tran, event, hsm, memo=None):
+    """ Returns list with response tuple (node_tuple, transition) if state
+        of *node_tuple* responds to *event* with transition *tran*, or empty
+        list if guards don't pass.
+    """
+    if isinstance(tran, e._Choice):
+        key = evaluate(tran.key, event, hsm, memo)
+        target = tran.switch.get(key, tran.default)
+        if target:
+            # make a regular transition to keep rest of the code simple
+            chosen = e._Chosen(target, tran.action, e.always_true, tran)
+            return [ (node_tuple, chosen) ]
+    elif isinstance(tran, e._Chain):
+        # first branch whose guard passes is taken, chain ends with the
+        # first unguarded branch
+        for branch in tran.branches:
+            if (branch.guard is e.always_true
+                    or evaluate(branch.guard, event, hsm, memo)):
+                return [ (node_tuple, branch) ]
+    elif isinstance(tran, e._Join):
+        # all sources must be active
+        if (hsm._active_mask & tran.mask == tran.mask
+                and evaluate(tran.guard, event, hsm, memo)):
+            return [ (node_tuple, tran) ]
+    elif evaluate(tran.guard, event, hsm, memo):
+        return [ (node_tuple, tran) ]
+    return []
+
+
 def postorder(nodes):
     """ Returns flattened states of the tree gathered by post-order traversal
         of each node in *nodes*, where node is tuples (state, subnodes).
@@ -141,19 +247,70 @@ def get_response_sequence(response, event, trans_map, flat_states, hsm):
         states_to_exit.append(parent)
         states_to_enter.insert(0, parent)
 
+    # history is recorded before entry sequence is built, so that state
+    # which is exited and entered again restores what was just active
+    if hsm is not None:
+        [hsm._record_history(st) for st in states_to_exit if st.history]
+
+    if isinstance(transition, e._Fork):
+        # orthogonal state is entered with some of its sub-machines going
+        # straight to fork's targets
+        plan = (hsm._fork_plans[transition] if hsm is not None
+                else fork_plan(transition, flat_states))
+        target_entries = fork_sequence(plan, trans_map, flat_states, hsm)
+    else:
+        target_entries = entry_sequence(target_state, trans_map, flat_states,
+                                        hsm)[1:]
+
     exits = [exit_act(st) for st in states_to_exit]
     entries = ([transition_action]
                + [entry_act(st) for st in states_to_enter]
-               + entry_sequence(target_state, trans_map, flat_states, hsm)[1:])
+               + target_entries)
 
     return (exits, entries)
 
 
+def fork_plan(tran, flat_states):
+    """
+        Returns tuple of (sub-machine, path) tuples, one for every sub-machine
+        of orthogonal state targeted by fork transition *tran*. *path* is the
+        list of states from sub-machine's top state to fork's target in it,
+        or None if fork doesn't have target in that sub-machine.
+    """
+    owner = get_state_by_sig(tran.target, flat_states)
+    depth = len(get_path_from_root(owner))
+    paths = [get_path_from_root(get_state_by_sig(sig, flat_states))[depth:]
+             for sig in tran.targets]
+    by_region = dict((path[0], path) for path in paths)
+    return tuple((region, by_region.get(region)) for region in owner.states)
+
+
+def fork_sequence(plan, trans_map, flat_states, hsm):
+    """
+        Returns list of Actions entering sub-machines of orthogonal state
+        according to *plan* returned by *fork_plan*. Orthogonal state itself
+        isn't entered.
+    """
+    actions = []
+    for region, path in plan:
+        if path is None:
+            actions += entry_sequence(region, trans_map, flat_states, hsm)
+        else:
+            actions += ([entry_act(st) for st in path[:-1]]
+                        + entry_sequence(path[-1], trans_map, flat_states,
+                                         hsm))
+    return actions
+
+
 def entry_sequence(state, trans_map, flat_states, hsm):
     """Returns list of Actions to be performed when entering state."""
     if state.kind == 'leaf':
         return [entry_act(state)]
     if state.kind == 'composite':
+        if state.history is not None and hsm is not None:
+            restored = hsm._history_sequence(state, trans_map, flat_states)
+            if restored is not None:
+                return restored
         init_tran = trans_map[state.sig][e.Initial]
         if isinstance(init_tran, e._Choice):
             key = init_tran.key(e.Initial(), hsm)
@@ -183,6 +340,24 @@ def entry_sequence(state, trans_map, flat_states, hsm):
     assert False, "this cannot happen"
 
 
+def history_sequence(state, indices, trans_map, flat_states, hsm):
+    """
+        Returns list of Actions to be performed when entering state whose
+        history was recorded. *indices* are positions (in *flat_states*) of
+        substates that were active: direct substates for shallow history,
+        which are then entered as usual, and substates at all levels for deep
+        history, which are entered directly.
+    """
+    restored = [flat_states[i] for i in indices]
+    if state.history == 'shallow':
+        return [entry_act(state)] + [
+            act for st in restored
+            for act in entry_sequence(st, trans_map, flat_states, hsm)]
+    # indices are sorted and flat_states is in pre-order, so parents are
+    # entered before their children
+    return [entry_act(state)] + [entry_act(st) for st in restored]
+
+
 
 
 def flatten(container):
@@ -241,6 +416,10 @@ def get_incoming_transitions(target_state_sig, trans_dict,
         if isinstance(tran, e._Choice):
             return (tran.default == target_state_sig or
                     any(v == target_state_sig for v in tran.switch.values()))
+        if isinstance(tran, e._Chain):
+            return any(targets_match(branch) for branch in tran.branches)
+        if isinstance(tran, e._Fork):
+            return target_state_sig in tran.targets
         return tran.target == target_state_sig
 
     for source_state_sig, outgoing_trans in trans_dict.items():
@@ -299,11 +478,165 @@ def get_events(flat_state_list, trans_dict):
         return ls + [subsub for sub in ls for subsub in get_subclasses(sub)]
 
     events = [evt for outgoing in trans_dict.values()
-              for evt in outgoing.keys() if evt != e.Initial]
+              for evt in outgoing.keys()
+              if evt != e.Initial and evt != e.Completion]
     events += [sub for evt in events for sub in get_subclasses(evt)]
     return set(events)
 
 
+def get_subtree_events(flat_state_list, trans_dict):
+    """
+        Returns dict mapping each state **instance** to frozenset of event
+        types that the state or any of its substates has transitions for.
+    """
+    subtree_events = {}
+
+    def visit(state):
+        events = set(evt for evt in trans_dict.get(state.sig, {})
+                     if evt != e.Initial and evt != e.Completion)
+        for sub in state.states:
+            events |= visit(sub)
+        subtree_events[state] = frozenset(events)
+        return events
+
+    [visit(st) for st in flat_state_list if st.parent is None]
+    return subtree_events
+
+
+def get_branches(tran):
+    """
+        Returns tuple of transitions that transition chain *tran* consists
+        of, or tuple containing just *tran* if it's any other transition.
+    """
+    return tran.branches if isinstance(tran, e._Chain) else (tran,)
+
+
+def make_chain(transitions):
+    """
+        Returns transition chain made of list of transitions. Branches that
+        follow the first unguarded branch can never be taken and are dropped.
+
+        Raises
+        ------
+        ValueError : if list is empty or contains transitions other than
+            regular, local and internal transitions
+    """
+    if not transitions:
+        raise ValueError("List of transitions cannot be empty")
+    branches = []
+    for tran in transitions:
+        if not isinstance(tran, (e._Transition, e._Local, e._Internal)):
+            raise ValueError("List of transitions can contain only regular, "
+                             "local and internal transitions")
+        branches += [tran]
+        if tran.guard is e.always_true:
+            break
+    return e._Chain(tuple(branches))
+
+
+def _combine(Which, functions, neutral):
+    """
+        Returns function calling all *functions* through *Which* wrapper,
+        leaving out *neutral* ones.
+    """
+    flat = []
+    for func in functions:
+        if isinstance(func, Which):
+            flat += func.functions
+        elif func is not neutral:
+            flat += [func]
+    if not flat:
+        return neutral
+    if len(flat) == 1:
+        return flat[0]
+    return Which(tuple(flat))
+
+
+def join_segments(first, second):
+    """
+        Returns compound transition made of transition *first* pointing to a
+        junction and segment *second* leaving that junction. It has the kind
+        of the *first* transition.
+    """
+    action = _combine(e._Sequence, [first.action, second.action],
+                      e.do_nothing)
+    guard = _combine(e._AllOf, [first.guard, second.guard], e.always_true)
+    return first._make((second.target, action, guard))
+
+
+def resolve_junction(tran):
+    """
+        Returns list of compound transitions that replace transition *tran*
+        pointing to a junction, one for every path through the junction (and
+        junctions it leads to).
+
+        Raises
+        ------
+        ValueError : if junction has no segments, or has segments other than
+            regular transitions
+    """
+    if not isinstance(tran.target, e._Junction):
+        return [tran]
+    if not tran.target.segments:
+        raise ValueError("Junction must have at least one segment")
+    compound = []
+    for segment in tran.target.segments:
+        if not isinstance(segment, e._Transition):
+            raise ValueError("Junction segments must be regular transitions")
+        compound += [join_segments(tran, resolved)
+                     for resolved in resolve_junction(segment)]
+    return compound
+
+
+def get_fork_owner(states):
+    """
+        Returns the closest common parent state **instance** of given state
+        **instances**, or None if it isn't an orthogonal state.
+    """
+    owner = reduce(get_common_parent, states)
+    return owner if owner.kind == 'orthogonal' else None
+
+
+def resolve_forks_and_joins(trans_dict, flat_states):
+    """
+        Returns trans dict in which fork transitions have their targets set to
+        orthogonal states containing their targets, and join transitions have
+        masks with bits of their sources (states are numbered by their
+        position in *flat_states*) set. Those are left None if some of the
+        states don't exist.
+    """
+    index = dict((st.sig, i) for i, st in enumerate(flat_states))
+
+    def resolve(tran):
+        if isinstance(tran, e._Fork):
+            if tran.targets and all(sig in index for sig in tran.targets):
+                owner = get_fork_owner([flat_states[index[sig]]
+                                        for sig in tran.targets])
+                if owner is not None:
+                    return tran._replace(target=owner.sig)
+        elif isinstance(tran, e._Join):
+            if tran.sources and all(sig in index for sig in tran.sources):
+                return tran._replace(mask=sum(1 << index[sig]
+                                              for sig in set(tran.sources)))
+        return tran
+
+    def resolve_map(outgoing):
+        resolved = dict((evt, resolve(tran)) for evt, tran in outgoing.items())
+        # outgoing dicts shared by instances of sub-machine templates don't
+        # contain forks and joins, and stay shared
+        if all(resolved[evt] is tran for evt, tran in outgoing.items()):
+            return outgoing
+        return resolved
+
+    return dict((src_sig, resolve_map(outgoing))
+                for src_sig, outgoing in trans_dict.items())
+
+
+def _name_to_sig(name):
+    """Returns sig of state with given name, sigs are left as they are."""
+    return e.State.name_to_sig(name) if isinstance(name, str) else name
+
+
 def add_prefix(name, prefix):
     """Adds prefix to name"""
     prefix = prefix or ()
@@ -314,11 +647,40 @@ def add_prefix(name, prefix):
     raise ValueError("Invalid state name '{0}'".format(name))
 
 
-def rename_transitions(trans_dict, prefix):
-    """Renames source state sigs and outgoing transition targets"""
+def rename_transitions(trans_dict, prefix, share=False):
+    """
+        Renames source state sigs and outgoing transition targets.
+        Transitions that don't have targets are kept as they are. If *share*
+        is True, outgoing evt -> tran dicts that don't contain any targets
+        are kept too, instead of being copied.
+    """
 
     def rename_targets(tran):
         """Returns new transition with prefix prepended to target state sig"""
+        chain = tran if isinstance(tran, e._Chain) else None
+        if chain is not None:
+            tran = list(chain.branches)
+        elif isinstance(getattr(tran, 'target', None), e._Junction):
+            tran = resolve_junction(tran)
+            if len(tran) == 1:
+                tran = tran[0]
+        if isinstance(tran, list):
+            # branches made of junctions are spliced into the chain
+            renamed = [branch for item in tran
+                       for branch in get_branches(rename_targets(item))]
+            if chain is not None and len(renamed) == len(tran) and all(
+                    new is old for new, old in zip(renamed, tran)):
+                return chain  # no branch has a target
+            return make_chain(renamed)
+        if isinstance(tran, e._Fork):
+            return tran._replace(targets=tuple(
+                add_prefix(_name_to_sig(name), prefix)
+                for name in tran.targets))
+        if isinstance(tran, e._Join):
+            return tran._replace(
+                target=add_prefix(tran.target, prefix),
+                sources=tuple(add_prefix(_name_to_sig(name), prefix)
+                              for name in tran.sources))
         if isinstance(tran, e._Choice):
             if tran.default is None:
                 new_default = None
@@ -334,18 +696,59 @@ def rename_transitions(trans_dict, prefix):
 
     def rename_trans_map(trans_map):
         """Renames transition targets in evt -> tran sub-dictionary"""
-        return dict((evt, rename_targets(tr)) for evt, tr in trans_map.items())
+        renamed = dict((evt, rename_targets(tr))
+                       for evt, tr in trans_map.items())
+        if share and all(renamed[evt] is tr for evt, tr in trans_map.items()):
+            return trans_map
+        return renamed
 
     return dict((add_prefix(src_sig, prefix), rename_trans_map(outgoing_map))
                 for src_sig, outgoing_map in trans_dict.items())
 
 
-def reformat(states_dict, trans_dict, prefix=None):
+def instantiate(template, prefix):
+    """
+        Returns tuple (states, trans_dict) of sub-machine made from
+        *template*, a tuple (states, trans_dict) returned by *reformat*
+        without prefix. States are copied and prefix is prepended to their
+        sigs and to transition sources and targets. Transitions without
+        targets, and outgoing dicts made only of those, are shared by all
+        instances of the template.
+    """
+    def clone(state, parent_state):
+        new_state = copy(state)
+        new_state.sig = prefix + state.sig
+        new_state.parent = parent_state
+        new_state.states = [clone(sub, new_state) for sub in state.states]
+        return new_state
+
+    states, trans_dict = template
+    return ([clone(st, None) for st in states],
+            rename_transitions(trans_dict, prefix, share=True))
+
+
+def reformat(states_dict, trans_dict, prefix=None, templates=None):
     """
         Renames states and transition targets.
         Extracts trans dicts from tuples that define orthogonal submachines
         and appends them all to one main trans_dict.
+
+        Sub-machine used in several orthogonal states (the same states and
+        trans dict objects) is reformatted only once, as a template that
+        is instantiated for every occurrence. Templates are kept in
+        *templates* dict, by ids of sub-machine's dicts.
     """
+    templates = {} if templates is None else templates
+
+    def get_template(sdict, tdict):
+        """Returns template of sub-machine, reformatting it if needed"""
+        key = (id(sdict), id(tdict))
+        if key not in templates:
+            # dicts are kept too, so that their ids can't be reused
+            templates[key] = (reformat(sdict, tdict, None, templates),
+                              sdict, tdict)
+        return templates[key][0]
+
     def fix(state_sig, val, parent_state=None):
         """Recursively rename and convert to state instance if needed"""
         if isinstance(val, e.State):
@@ -367,8 +770,9 @@ def reformat(states_dict, trans_dict, prefix=None):
             new_state.kind = 'orthogonal'
             ch_prefix = lambda i: add_prefix(state_sig, prefix) + (i,)
             # get renamed states and renamed trans for every submachine
-            subs, trans = zip(*[reformat(sdict, tdict, ch_prefix(i))
-                                for i, (sdict, tdict) in enumerate(children)])
+            subs, trans = zip(*[
+                instantiate(get_template(sdict, tdict), ch_prefix(i))
+                for i, (sdict, tdict) in enumerate(children)])
             # subs is tuple of lists with one element (top state of submachine
             # assumes that validation has passed), converto into list of
             # submachines
@@ -378,7 +782,7 @@ def reformat(states_dict, trans_dict, prefix=None):
         elif isinstance(children, dict):
             new_state.kind = 'composite'
             # trans are the same, so {} for nested states
-            subs, trans = reformat(children, {}, prefix)
+            subs, trans = reformat(children, {}, prefix, templates)
             trans = dict(trans)
         else:
             raise ValueError("Invalid element")  # TODO: move to validation
@@ -388,7 +792,9 @@ def reformat(states_dict, trans_dict, prefix=None):
         new_state.states = subs
         return (new_state, trans)
 
-    fixed = [fix(sn, val) for sn, val in states_dict.items()]
+    # siblings are ordered by name, so that order of states (and their ids)
+    # doesn't depend on dict iteration order
+    fixed = [fix(sn, val) for sn, val in sorted(states_dict.items())]
 
     fixed_states = [st for st, _ in fixed]
     fixed_trans = dict([kv for _, dct in fixed for kv in dct.items()])
@@ -408,10 +814,21 @@ def parse(states_dict, trans_dict):
             * in case of orthogonal sub-machine state, whose elements are
               tuples (states, transitions), extracts transitions and appends
               them to main trans_dict
+            * lists of transitions are turned into transition chains
+            * transitions to junctions are replaced with compound transitions
+            * orthogonal states targeted by forks and masks of joins' sources
+              are computed
+            * states are numbered (*id* attribute) in parse order: depth
+              first, composite state's children ordered by name and
+              sub-machines of orthogonal state in the order of the list
 
         Returns tuple (top_state, flattened_state_list, full_trans_dict).
     """
     renamed_states, renamed_trans = reformat(states_dict, trans_dict)
     top_state = renamed_states[0]
     flattened = flatten(renamed_states)
-    return (top_state, flattened, renamed_trans)
+    # parse order of states, used for ordering active states
+    for i, st in enumerate(flattened):
+        st.id = i
+    resolved_trans = resolve_forks_and_joins(renamed_trans, flattened)
+    return (top_state, flattened, resolved_trans)
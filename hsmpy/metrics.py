@@ -0,0 +1,166 @@
+"""
+    Low-overhead latency histograms.
+
+    Histogram has fixed log-linear buckets (similar to HDR histograms): values
+    are recorded in nanoseconds, every power of two is split into 8 buckets,
+    so reported percentiles are within 12.5% of the real value. Recording is
+    a bit of integer arithmetic and one list increment, cheap enough to be
+    left enabled in production.
+
+    LatencyRecorder keeps one histogram per event type. Recorders can be
+    assigned to HSM and EventBus instances:
+
+        hsm.latency = LatencyRecorder('door')  # processing in _handle_event
+        bus.latency = LatencyRecorder('bus')  # from dispatch call until all
+                                              # listeners processed the event
+        bus.wait_latency = LatencyRecorder('bus-wait')  # time spent in queue
+
+    and periodically collected with *snapshot*, which by default also resets
+    them.
+"""
+
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# values below this are recorded exactly, one bucket per nanosecond
+_LINEAR_LIMIT = SUB_BUCKETS * 2
+# largest recordable value is 2**MAX_BITS ns (about 18 minutes), larger
+# values are recorded into the last bucket
+MAX_BITS = 40
+
+
+def bucket_index(ns):
+    """Returns index of the bucket for value *ns* (int, nanoseconds)."""
+    if ns < _LINEAR_LIMIT:
+        return ns if ns > 0 else 0
+    shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift << SUB_BUCKET_BITS) + (ns >> shift)
+
+
+def bucket_bounds(index):
+    """Returns tuple (lowest, highest) values (ns) recorded in bucket."""
+    if index < _LINEAR_LIMIT:
+        return (index, index)
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    low = (index - (shift << SUB_BUCKET_BITS)) << shift
+    return (low, low + (1 << shift) - 1)
+
+
+_MAX_VALUE = 1 << MAX_BITS
+N_BUCKETS = bucket_index(_MAX_VALUE - 1) + 1
+
+
+class Histogram(object):
+    """Histogram of latencies, recorded in seconds."""
+    __slots__ = ('counts', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ns = int(seconds * 1e9)
+        # same as bucket_index, inlined since it's called for every event
+        if ns < _LINEAR_LIMIT:
+            index = ns if ns > 0 else 0
+        elif ns < _MAX_VALUE:
+            shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+            index = (shift << SUB_BUCKET_BITS) + (ns >> shift)
+        else:
+            index = N_BUCKETS - 1
+        self.counts[index] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Adds values recorded by *other* histogram to this one."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def copy(self):
+        hist = Histogram()
+        hist.merge(self)
+        return hist
+
+    def reset(self):
+        self.counts = [0] * N_BUCKETS
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    @property
+    def mean(self):
+        count = self.count
+        return self.total / count if count else 0.0
+
+    def percentile(self, p):
+        """
+            Returns value (seconds) below which *p* percent of recorded values
+            fall, or 0 if nothing was recorded. Value is the midpoint of the
+            bucket, but never larger than the maximal recorded value.
+        """
+        count = self.count
+        if not count:
+            return 0.0
+        rank = max(1, int(round(p / 100.0 * count)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                if index == N_BUCKETS - 1:
+                    return self.max  # last bucket also holds larger values
+                low, high = bucket_bounds(index)
+                return min((low + high) / 2.0 / 1e9, self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 99, 99.9)):
+        """Returns dict with count, mean, max and given percentiles."""
+        result = {'count': self.count, 'mean': self.mean, 'max': self.max}
+        for p in percentiles:
+            result['p{0}'.format(p)] = self.percentile(p)
+        return result
+
+
+class LatencyRecorder(object):
+    def __init__(self, name):
+        """
+            Constructor
+
+            Parameters
+            ----------
+            name : str
+                name of the recorder, identifies machine or bus in reports
+        """
+        self.name = name
+        # maps event type to Histogram
+        self.histograms = {}
+
+    def record(self, event_type, seconds):
+        hist = self.histograms.get(event_type)
+        if hist is None:
+            hist = self.histograms[event_type] = Histogram()
+        hist.record(seconds)
+
+    def snapshot(self, reset=True):
+        """
+            Returns dict mapping event types to copies of their histograms.
+            Unless *reset* is False recorded data is cleared.
+        """
+        if reset:
+            histograms, self.histograms = self.histograms, {}
+            return histograms
+        return dict((evt, hist.copy())
+                    for evt, hist in self.histograms.items())
+
+    def report(self, reset=True, percentiles=(50, 99, 99.9)):
+        """
+            Returns dict mapping event type names to summaries (as returned
+            by Histogram.summary) for this recorder.
+        """
+        return dict((evt.__name__, hist.summary(percentiles))
+                    for evt, hist in self.snapshot(reset).items())
@@ -0,0 +1,132 @@
+"""
+    Opt-in profiling of HSM event handling.
+
+    Profiler is enabled by assigning it to HSM instance:
+
+        hsm.profiler = Profiler()
+
+    From then on every entry, exit and transition action performed by that
+    HSM is timed separately, as is the time spent in hsmpy computing which
+    actions to perform (*get_merged_sequences*). When *profiler* attribute
+    is None (default) nothing is timed.
+
+    Profiling measures the interpreter, machines compiled by codegen backend
+    handle events with the interpreter while profiler is set.
+"""
+
+from timeit import default_timer
+import elements as e
+
+
+PATH_COMPUTATION = 'get_merged_sequences'
+
+
+def _action_name(kind, state, act_event):
+    if kind == 'path':
+        return PATH_COMPUTATION
+    if kind == 'transition':
+        return '{0}-{1}'.format(state.name, act_event.__name__)
+    return '{0}-{1}'.format(state.name, kind)
+
+
+class Profiler(object):
+    def __init__(self, name='hsm', clock=default_timer):
+        """
+            Constructor
+
+            Parameters
+            ----------
+            name : str (optional)
+                name of the profiled machine, used as the root frame in
+                folded stacks export
+            clock : function (optional)
+                function returning current time in seconds
+        """
+        self.name = name
+        self.clock = clock
+        # maps (event_type, kind, state, item_id, action_event) to [count,
+        # total, max], where event_type is type of handled event, kind is
+        # action's kind (or 'path' for path computation, which has no state,
+        # item and action_event), item_id is identity of state or transition
+        # whose action was performed (transitions aren't hashable, they are
+        # alive as long as hsm is) and action_event is event type of
+        # transition action (Initial for initial transitions); event types
+        # and states are kept rather than their names, which aren't unique
+        self.stats = {}
+
+    def _add(self, key, elapsed):
+        entry = self.stats.get(key)
+        if entry is None:
+            self.stats[key] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+
+    def perform(self, actions, event, hsm):
+        """Performs actions, timing each one."""
+        clock = self.clock
+        evt_type = event.__class__
+        for act in actions:
+            item = act.item
+            if type(item) is e._Chosen:
+                # made on the fly by the Choice transition
+                item = item.choice
+            start = clock()
+            act(event, hsm)
+            self._add((evt_type, act.kind, act.state, id(item), act.event),
+                      clock() - start)
+
+    def add_path_computation(self, event, elapsed):
+        """Records time spent computing actions to perform for event."""
+        self._add((event.__class__, 'path', None, None, None), elapsed)
+
+    def report(self, by_event=False):
+        """
+            Returns list of dicts with keys 'name', 'kind', 'count', 'total'
+            and 'max' (times are in seconds), sorted by total time, longest
+            first. *kind* is one of 'entry', 'exit', 'transition' or 'path'
+            (time spent in hsmpy's own path computation).
+
+            Timings are aggregated per action (state entry/exit or
+            transition), unless *by_event* is True in which case they're
+            kept separate for every event type and dicts have additional
+            'event' key.
+        """
+        merged = {}
+        for key, (count, total, max_) in self.stats.items():
+            if not by_event:
+                key = (None,) + key[1:]
+            entry = merged.setdefault(key, [0, 0.0, 0.0])
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], max_)
+
+        rows = []
+        for (evt_type, kind, state, _, act_event), (count, total, max_) in (
+                merged.items()):
+            row = {'name': _action_name(kind, state, act_event), 'kind': kind,
+                   'count': count, 'total': total, 'max': max_}
+            if by_event:
+                row['event'] = evt_type.__name__
+            rows += [row]
+        return sorted(rows, key=lambda row: row['total'], reverse=True)
+
+    def folded(self):
+        """
+            Returns string with profiling data in folded stacks format used
+            by flamegraph tools, one 'machine;event;action microseconds' line
+            per action.
+        """
+        lines = ['{0};{1};{2} {3}'.format(
+                     self.name, evt_type.__name__,
+                     _action_name(kind, state, act_event),
+                     int(round(total * 1e6)))
+                 for (evt_type, kind, state, _, act_event), (_, total, _) in
+                 self.stats.items()]
+        return '\n'.join(sorted(lines))
+
+    def reset(self):
+        """Clears all collected data."""
+        self.stats = {}
@@ -0,0 +1,175 @@
+"""
+    Cooperative scheduler for machines sharing one stream of events.
+
+    With a shared EventBus all events go through one FIFO queue, so a machine
+    that keeps dispatching events to itself delays every other machine.
+    Scheduler gives every machine its own queue instead:
+
+        sched = Scheduler()
+        sched.add(door_hsm, name='door', weight=2)
+        sched.add(lamp_hsm, name='lamp', quota=100)
+        sched.dispatch(Open())
+        while sched.tick():
+            ...
+
+    Dispatched events (including the ones dispatched by machines' actions)
+    are put into queues of all machines listening for them. *tick* visits
+    machines in weighted round-robin order: in each round a machine handles
+    up to *weight* events from its queue, until queues are empty or machine
+    has handled its *quota* of events for the tick. Every event is handled
+    by a machine in one go, the same run-to-completion guarantee that
+    EventBus gives.
+
+    Time events spend in queues is recorded into per-machine histograms.
+"""
+
+from collections import deque
+from timeit import default_timer as clock
+from metrics import Histogram
+
+
+class _Port(object):
+    """Event bus interface given to a single machine."""
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.listeners = {}
+        self.dispatch_in_progress = False
+        # while machine is being started events are handled immediately
+        self.direct = True
+
+    def register(self, event_type, callback):
+        self.listeners[event_type] = callback
+
+    def unregister(self, event_type, callback):
+        del self.listeners[event_type]
+
+    def dispatch(self, event):
+        if self.direct and not self.dispatch_in_progress:
+            self.handle(event)
+        else:
+            self.scheduler.dispatch(event)
+
+    def handle(self, event):
+        callback = self.listeners.get(event.__class__)
+        if callback is None:
+            return
+        self.dispatch_in_progress = True
+        try:
+            callback(event)
+        finally:
+            self.dispatch_in_progress = False
+
+
+class _Entry(object):
+    def __init__(self, name, hsm, port, weight, quota):
+        self.name = name
+        self.hsm = hsm
+        self.port = port
+        self.weight = weight
+        self.quota = quota
+        # (event, time_queued) tuples
+        self.queue = deque()
+        self.handled = 0
+        self.wait = Histogram()
+
+
+class Scheduler(object):
+    def __init__(self, clock=clock):
+        """
+            Constructor
+
+            Parameters
+            ----------
+            clock : function (optional)
+                function returning current time in seconds
+        """
+        self.clock = clock
+        self._entries = []
+
+    def add(self, hsm, name=None, weight=1, quota=None):
+        """
+            Starts the machine and adds it to the scheduler.
+
+            Parameters
+            ----------
+            hsm : HSM
+                machine to add, it mustn't be started
+            name : str (optional)
+                name of the machine in stats, defaults to its position
+            weight : int (optional)
+                number of events machine handles in every round
+            quota : int (optional)
+                maximal number of events machine handles in one tick, no
+                limit by default
+        """
+        if weight < 1:
+            raise ValueError("Weight must be positive")
+        port = _Port(self)
+        name = str(len(self._entries)) if name is None else name
+        entry = _Entry(name, hsm, port, weight, quota)
+        self._entries += [entry]
+        hsm.start(port)
+        port.direct = False
+
+    def dispatch(self, event):
+        """Queues event for every machine that listens for it."""
+        now = self.clock()
+        for entry in self._entries:
+            if event.__class__ in entry.port.listeners:
+                entry.queue.append((event, now))
+
+    def _handle_next(self, entry):
+        event, queued_at = entry.queue.popleft()
+        entry.wait.record(self.clock() - queued_at)
+        entry.port.handle(event)
+        entry.handled += 1
+
+    def tick(self, max_events=None):
+        """
+            Handles queued events in weighted round-robin order until the
+            queues are empty, machines with queued events have used up their
+            quotas, or *max_events* are handled. Returns number of events
+            remaining in the queues.
+        """
+        handled_now = dict((id(entry), 0) for entry in self._entries)
+        total = 0
+        progress = True
+        while progress:
+            progress = False
+            for entry in self._entries:
+                for _ in range(entry.weight):
+                    if not entry.queue:
+                        break
+                    if (entry.quota is not None
+                            and handled_now[id(entry)] >= entry.quota):
+                        break
+                    if max_events is not None and total >= max_events:
+                        return self.pending()
+                    self._handle_next(entry)
+                    handled_now[id(entry)] += 1
+                    total += 1
+                    progress = True
+        return self.pending()
+
+    def pending(self):
+        """Returns number of queued events."""
+        return sum(len(entry.queue) for entry in self._entries)
+
+    def stats(self, reset=False):
+        """
+            Returns dict mapping machine names to dicts with keys 'queued',
+            'handled' and 'wait' (summary of the queue wait histogram, see
+            metrics.Histogram.summary). If *reset* is True counters and
+            histograms are cleared.
+        """
+        result = {}
+        for entry in self._entries:
+            result[entry.name] = {
+                'queued': len(entry.queue),
+                'handled': entry.handled,
+                'wait': entry.wait.summary(),
+            }
+            if reset:
+                entry.handled = 0
+                entry.wait.reset()
+        return result
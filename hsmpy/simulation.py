@@ -0,0 +1,116 @@
+"""
+    Streaming simulation runner for offline event streams.
+
+    Runner drives one machine per entity through a (possibly endless) stream
+    of (key, event) pairs:
+
+        runner = Runner(lambda key: HSM(states, trans), max_machines=1000)
+        for key, event, old_leaves, new_leaves in runner.run(stream):
+            ...
+
+    Machines are created on the first event for their key. Instead of sharing
+    an EventBus, every machine gets its own minimal bus that only queues
+    events dispatched by its actions. When there are more than *max_machines*
+    machines, the least recently used one is evicted: its snapshot is put into
+    the *store* and the machine is restored from it when its key shows up
+    again. Memory use therefore depends on the number of live machines and
+    the store (which can be kept on disk, eg. with shelve module), not on the
+    length of the stream.
+"""
+
+from collections import OrderedDict, deque
+
+
+class _MachineBus(object):
+    """
+        Event bus serving a single machine, events dispatched while an event
+        is being handled are queued and handled after it.
+    """
+    def __init__(self):
+        self.listeners = {}
+        self.queue = deque()
+        self.dispatch_in_progress = False
+
+    def register(self, event_type, callback):
+        self.listeners[event_type] = callback
+
+    def unregister(self, event_type, callback):
+        del self.listeners[event_type]
+
+    def dispatch(self, event):
+        self.queue.append(event)
+        if self.dispatch_in_progress:
+            return
+        self.dispatch_in_progress = True
+        try:
+            while self.queue:
+                event = self.queue.popleft()
+                callback = self.listeners.get(event.__class__)
+                if callback is not None:
+                    callback(event)
+        finally:
+            self.dispatch_in_progress = False
+
+
+def _leaf_names(state_set):
+    return tuple(sorted(st.name for st in state_set if st.kind == 'leaf'))
+
+
+class Runner(object):
+    def __init__(self, make_hsm, max_machines=10000, store=None):
+        """
+            Constructor
+
+            Parameters
+            ----------
+            make_hsm : function
+                function taking entity key and returning new HSM instance
+                (not started) for it
+            max_machines : int (optional)
+                maximal number of machines kept in memory
+            store : dict-like (optional)
+                mapping in which snapshots of evicted machines are kept,
+                dict by default; keys must be usable as its keys
+        """
+        if max_machines < 1:
+            raise ValueError("max_machines must be positive")
+        self.make_hsm = make_hsm
+        self.max_machines = max_machines
+        self.store = {} if store is None else store
+        # live machines, least recently used first
+        self.machines = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns running machine for *key*, creating or restoring it."""
+        hsm = self.machines.pop(key, None)
+        if hsm is None:
+            if len(self.machines) >= self.max_machines:
+                self._evict()
+            hsm = self.make_hsm(key)
+            snapshot = self.store.pop(key, None)
+            hsm.start(_MachineBus(), restore=snapshot)
+        self.machines[key] = hsm
+        return hsm
+
+    def _evict(self):
+        key, hsm = self.machines.popitem(last=False)
+        self.store[key] = hsm.snapshot()
+        hsm.stop()
+        self.evictions += 1
+
+    def run(self, stream):
+        """
+            Generator that dispatches every event from *stream* of
+            (key, event) tuples to the machine for its key, and yields
+            (key, event, old_leaves, new_leaves) tuple every time an event
+            changes machine's configuration; *old_leaves* and *new_leaves*
+            are sorted tuples of names of active leaf states.
+        """
+        for key, event in stream:
+            hsm = self.get(key)
+            old_set = hsm.current_state_set
+            hsm.eb.dispatch(event)
+            new_set = hsm.current_state_set
+            if new_set is not old_set and new_set != old_set:
+                yield (key, event, _leaf_names(old_set), _leaf_names(new_set))
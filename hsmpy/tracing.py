@@ -0,0 +1,121 @@
+"""
+    Bounded trace of recent transitions for post-mortem debugging.
+
+    Trace is enabled by assigning it to HSM instance:
+
+        hsm.trace = TransitionTrace(hsm, size=1024)
+
+    For every event that machine handles it records event type id, the state
+    configuration (tuple of ids of active leaf states) before and after
+    handling the event, and a timestamp. Records are kept in preallocated
+    arrays and lists used as a ring buffer, so only the last *size* events
+    are kept and recording doesn't format any strings or grow any
+    containers. Configuration tuple is made only when machine's
+    configuration changes, otherwise the previous one is reused. Ids are
+    translated back into names only when the trace is dumped.
+"""
+
+import time
+from array import array
+
+
+class TransitionTrace(object):
+    def __init__(self, hsm, size=1024, clock=time.time):
+        """
+            Constructor
+
+            Parameters
+            ----------
+            hsm : HSM
+                traced machine, used for numbering its event types and
+                looking up states by their ids
+            size : int (optional)
+                number of most recent events that are kept
+            clock : function (optional)
+                function returning current time in seconds
+        """
+        if size < 1:
+            raise ValueError("Trace size must be positive")
+        self.size = size
+        self.clock = clock
+        # event types are numbered up front, subclasses of handled types
+        # that are dispatched later get next free numbers
+        self.events = sorted(set(evt for outgoing in hsm.trans.values()
+                                 for evt in outgoing),
+                             key=lambda evt: evt.__name__)
+        self._event_ids = dict((evt, i) for i, evt in enumerate(self.events))
+        self._states = list(hsm.flattened)
+        self._last_set = None
+        self._last_config = None
+        self._event = array('i', [0]) * size
+        # configurations, tuples of sorted ids of active leaf states
+        self._source = [None] * size
+        self._target = [None] * size
+        self._time = array('d', [0.0]) * size
+        # total number of recorded events, next record goes to
+        # position count % size
+        self.count = 0
+
+    def _event_id(self, event_type):
+        evt_id = self._event_ids.get(event_type)
+        if evt_id is None:
+            evt_id = self._event_ids[event_type] = len(self.events)
+            self.events.append(event_type)
+        return evt_id
+
+    def _config(self, state_set):
+        # machine keeps the same set object until it takes a transition, and
+        # source of every event is usually the target of previous one
+        if state_set is self._last_set:
+            return self._last_config
+        if state_set == self._last_set:
+            # e.g. after internal transition, configuration is the same
+            self._last_set = state_set
+            return self._last_config
+        config = tuple(sorted(st.id for st in state_set
+                              if st.kind == 'leaf'))
+        self._last_set = state_set
+        self._last_config = config
+        return config
+
+    def record(self, event_type, source_set, target_set):
+        """Records that event of *event_type* changed source configuration."""
+        pos = self.count % self.size
+        self._event[pos] = self._event_id(event_type)
+        self._source[pos] = self._config(source_set)
+        self._target[pos] = self._config(target_set)
+        self._time[pos] = self.clock()
+        self.count += 1
+
+    def clear(self):
+        """Removes all records, numbering of events is kept."""
+        self.count = 0
+        self._source[:] = self._target[:] = [None] * self.size
+
+    def _config_names(self, config):
+        return sorted(self._states[i].name for i in config)
+
+    def records(self):
+        """
+            Returns list of kept records, oldest first. Each record is a tuple
+            (timestamp, event_name, source_leaves, target_leaves) where
+            *source_leaves* and *target_leaves* are sorted lists of names of
+            active leaf states, which identify the configuration.
+        """
+        first = max(0, self.count - self.size)
+        result = []
+        for n in range(first, self.count):
+            pos = n % self.size
+            result += [(self._time[pos],
+                        self.events[self._event[pos]].__name__,
+                        self._config_names(self._source[pos]),
+                        self._config_names(self._target[pos]))]
+        return result
+
+    def dump(self):
+        """Returns kept records formatted as string, one line per record."""
+        fmt = lambda names: ', '.join(names)
+        return '\n'.join(
+            '{0:.6f} {1}: {2} -> {3}'.format(ts, evt_name, fmt(source),
+                                             fmt(target))
+            for ts, evt_name, source, target in self.records())
@@ -17,7 +17,7 @@ def find_nonexistent_transition_sources(flat_state_list, trans_dict):
         Returns list of keys (state **instances**) found in transition map that
         don't have corresponding state in the states map.
     """
-    state_names = [st.sig for st in flat_state_list]
+    state_names = set(st.sig for st in flat_state_list)
     return [name for name in trans_dict.keys() if name not in state_names]
 
 
@@ -26,12 +26,14 @@ def find_nonexistent_transition_targets(flat_state_list, trans_dict):
         Returns list of state signatures found in transition map that don't
         have corresponding state in the states map.
     """
-    state_names = [st.sig for st in flat_state_list]
+    state_names = set(st.sig for st in flat_state_list)
     return [tran.target
             for dct in trans_dict.values()  # transitions dict for state
-            for tran in dct.values()  # transition in state's transitions dict
+            for tr in dct.values()  # transition in state's transitions dict
+            for tran in l.get_branches(tr)  # every branch of chain
             if (not isinstance(tran, e._Internal)  # don't have targets
                 and not isinstance(tran, e._Choice)  # handled separately
+                and not isinstance(tran, e._Fork)  # handled separately
                 and tran.target not in state_names)]  # no corresponding state
 
 
@@ -53,23 +55,27 @@ def find_invalid_initial_transitions(flat_state_list, trans_dict):
         each problematic initial transition found.
 
         Initial transition is invalid if it's a self-loop, is defined as
-        LocalTransition or InternalTransition, has a target which is not a
-        child of the state, is a ChoiceTransition without default state, or has
-        a guard.
+        LocalTransition, InternalTransition or list of transitions, has a
+        target which is not a child of the state, is a ChoiceTransition
+        without default state, or has a guard.
     """
     # missing initial transition are handled separately so they're excluded
     without = find_missing_initial_transitions(flat_state_list, trans_dict)
     composites = [st for st in flat_state_list
                   if st.kind == 'composite' and st not in without]
+    get_state = dict((st.sig, st) for st in flat_state_list).get
 
     def report(state):
         init_tran = trans_dict[state.sig][e.Initial]
         msg = None
 
-        get_state = lambda sig: l.get_state_by_sig(sig, flat_state_list)
         is_child = lambda sg: state in l.get_path_from_root(get_state(sg))[:-1]
 
-        if isinstance(init_tran, e._Local):
+        if isinstance(init_tran, e._Chain):
+            msg = 'cannot use list of transitions for initial'
+        elif isinstance(init_tran, (e._Fork, e._Join)):
+            msg = 'cannot use fork or join for initial'
+        elif isinstance(init_tran, e._Local):
             msg = 'cannot use LocalTransition for initial'
         elif isinstance(init_tran, e._Internal):
             msg = 'cannot use InternalTransition for initial'
@@ -95,7 +101,8 @@ def find_invalid_initial_transitions(flat_state_list, trans_dict):
             msg = 'initial transition cannot have a guard'
         return (state, msg) if msg else None
 
-    return [report(st) for st in composites if report(st) is not None]
+    reports = [report(st) for st in composites]
+    return [rep for rep in reports if rep is not None]
 
 
 def find_invalid_local_transitions(flat_state_list, trans_dict):
@@ -109,15 +116,16 @@ def find_invalid_local_transitions(flat_state_list, trans_dict):
                                                       trans_dict)
     bad_targets = find_nonexistent_transition_targets(flat_state_list,
                                                       trans_dict)
-    bad_state_sigs = bad_sources + bad_targets
+    bad_state_sigs = set(bad_sources + bad_targets)
 
-    get_by_sig = lambda sig: l.get_state_by_sig(sig, flat_state_list)
+    get_by_sig = dict((st.sig, st) for st in flat_state_list).get
     common_parent = lambda sig_a, sig_b: l.get_common_parent(
         get_by_sig(sig_a), get_by_sig(sig_b)).sig
 
     return [(st_sig, evt, tran.target)
             for st_sig, outgoing in trans_dict.items()
-            for evt, tran in outgoing.items()
+            for evt, tr in outgoing.items()
+            for tran in l.get_branches(tr)
             if st_sig not in bad_state_sigs and
             isinstance(tran, e._Local) and (
             st_sig == tran.target or  # loop
@@ -132,7 +140,7 @@ def find_invalid_choice_transitions(flat_state_list, trans_dict):
         if switch dict is unspecified, empty or contains value which is not a
         valid state name.
     """
-    state_sigs = [st.sig for st in flat_state_list]
+    state_sigs = set(st.sig for st in flat_state_list)
     choice_trans = [(tran, src_sig, evt)
                     for src_sig, dct in trans_dict.items()
                     for evt, tran in dct.items()
@@ -147,35 +155,134 @@ def find_invalid_choice_transitions(flat_state_list, trans_dict):
             or not default_ok(tran)]  # default target points to invalid state
 
 
+def find_invalid_history_states(flat_state_list):
+    """
+        Returns list of tuples (state_instance, string_describing_problem) for
+        each state that declares history but isn't a composite state, or
+        declares unknown kind of history.
+    """
+    found = []
+    for st in flat_state_list:
+        if st.history is None:
+            continue
+        if st.history not in ('shallow', 'deep'):
+            found += [(st, "history must be 'shallow' or 'deep'")]
+        elif st.kind != 'composite':
+            found += [(st, 'only composite states can have history')]
+    return found
+
+
+def find_invalid_final_states(flat_state_list, trans_dict):
+    """
+        Returns list of tuples (state_instance, string_describing_problem) for
+        each final state that isn't a leaf state, is the top state, or has
+        outgoing transitions.
+    """
+    found = []
+    for st in flat_state_list:
+        if not st.final:
+            continue
+        if st.kind != 'leaf':
+            found += [(st, 'only leaf states can be final')]
+        elif st.parent is None:
+            found += [(st, 'top state cannot be final')]
+        elif trans_dict.get(st.sig):
+            found += [(st, 'final state cannot have outgoing transitions')]
+    return found
+
+
+def find_invalid_forks_and_joins(flat_state_list, trans_dict):
+    """
+        Returns list of 3-tuples (state_sig, event_type, string_describing_
+        problem) for each problematic fork or join transition found.
+
+        Fork or join is invalid if it has less than two targets (sources),
+        some of them don't exist, or they aren't in different sub-machines of
+        the same orthogonal state. Fork targets cannot be inside orthogonal
+        states nested in sub-machines, and join must be declared by the
+        orthogonal state containing its sources or one of its parents.
+    """
+    get_state = lambda sig: l.get_state_by_sig(sig, flat_state_list)
+
+    def check_states(sigs, owner_sig):
+        if len(set(sigs)) < 2:
+            return 'needs at least two states'
+        states = [get_state(sig) for sig in sigs]
+        if None in states:
+            return 'points to nonexistent state'
+        owner = l.get_fork_owner(states)
+        if owner is None or owner.sig != owner_sig:
+            return 'states must be in the same orthogonal state'
+        depth = len(l.get_path_from_root(owner))
+        paths = [l.get_path_from_root(st)[depth:] for st in states]
+        if len(set(path[0] for path in paths)) < len(paths):
+            return 'states must be in different sub-machines'
+        return None
+
+    def report(src_sig, tran):
+        if isinstance(tran, e._Fork):
+            msg = check_states(tran.targets, tran.target)
+            if msg is None:
+                owner = get_state(tran.target)
+                depth = len(l.get_path_from_root(owner))
+                paths = [l.get_path_from_root(get_state(sig))[depth:-1]
+                         for sig in tran.targets]
+                if any(st.kind == 'orthogonal' for p in paths for st in p):
+                    msg = 'targets cannot be in nested orthogonal states'
+            return msg
+        states = [get_state(sig) for sig in tran.sources]
+        owner = (l.get_fork_owner(states)
+                 if states and None not in states else None)
+        msg = check_states(tran.sources, owner and owner.sig)
+        source = get_state(src_sig)
+        if (msg is None and source is not None
+                and source not in l.get_path_from_root(owner)):
+            msg = 'must be declared by orthogonal state or its parent'
+        return msg
+
+    found = [(src_sig, evt, report(src_sig, tran))
+             for src_sig, outgoing in trans_dict.items()
+             for evt, tran in outgoing.items()
+             if isinstance(tran, (e._Fork, e._Join))]
+    return [item for item in found if item[2] is not None]
+
+
 def find_unreachable_states(top_state, flat_state_list, trans_dict):
     """
         Returns list of state **instances** that are unreachable.
 
-        It checks if state can be reached by recursively following all
-        transitions going out from given state instance *top_state*. Any state
-        that wasn't visited cannot be reached by any means.
+        It checks if state can be reached by following all transitions going
+        out from given state instance *top_state*. Any state that wasn't
+        visited cannot be reached by any means.
     """
-    def visit(state, visited=set()):  # instantiating should be ok in this case
-        if state in visited:
-            return set()
-        visited.add(state)
+    by_sig = dict((st.sig, st) for st in flat_state_list)
+
+    # iterative depth-first search, following chains of transitions through
+    # large machines would exceed the recursion limit
+    reachable = set()
+    to_visit = [top_state]
+    while to_visit:
+        state = to_visit.pop()
+        if state in reachable:
+            continue
+        reachable.add(state)
         # if orthogonal is reachable, its states are automatically reachable
         if state.kind == 'orthogonal':
-            [visit(st, visited) for st in state.states]
+            to_visit += state.states
         # all state's parents are reachable
         # visit transition targets going out of every parent state
-        for parent in l.get_path_from_root(state):
-            visit(parent, visited)
+        to_visit += l.get_path_from_root(state)
         # visit transition targets going out of current state
-        for tran in trans_dict.get(state.sig, {}).values():
+        outgoing = trans_dict.get(state.sig, {}).values()
+        for tran in [br for tr in outgoing for br in l.get_branches(tr)]:
             if isinstance(tran, e._Choice):
-                to_visit = [l.get_state_by_sig(sig, flat_state_list)
-                            for sig in tran.switch.values() + [tran.default]]
+                targets = tran.switch.values() + [tran.default]
+            elif isinstance(tran, e._Fork):
+                targets = tran.targets
             else:
-                to_visit = [l.get_state_by_sig(tran.target, flat_state_list)]
-            # nonexistent states (None values in list) are checked elsewhere
-            [visit(st, visited) for st in to_visit if st is not None]
-        return visited
+                targets = [tran.target]
+            # nonexistent states (None values) are checked elsewhere
+            to_visit += [st for st in map(by_sig.get, targets)
+                         if st is not None]
 
-    reachable = visit(top_state)
     return [st for st in flat_state_list if st not in reachable]
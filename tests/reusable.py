@@ -1,4 +1,6 @@
-from hsmpy import Event, State, Initial, T, Internal, Local, Choice
+import gc
+from hsmpy import (HSM, EventBus, Event, State, Initial, T, Internal, Local,
+                   Choice)
 
 
 def get_callback(key):
@@ -25,6 +27,54 @@ class MockHSM(object):
         self.data = Dump()
 
 
+class FakeClock(object):
+    """Each call advances time by one second."""
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+def start_hsm(states, trans):
+    """Returns HSM made of given states and transitions, started."""
+    hsm = HSM(states, trans)
+    hsm.start(EventBus())
+    return hsm
+
+
+def active_names(hsm):
+    """Returns set of names of all active states."""
+    return set(st.name for st in hsm.current_state_set)
+
+
+def active_leaves(hsm):
+    """Returns sorted list of names of active leaf states."""
+    return sorted(st.name for st in hsm.current_state_set
+                  if st.kind == 'leaf')
+
+
+def active_leaf(hsm):
+    """Returns name of the only active leaf state."""
+    [name] = active_leaves(hsm)
+    return name
+
+
+def allocated_dict(obj):
+    """
+        Returns object's per-instance __dict__, or None if it wasn't
+        allocated. Unlike reading *obj.__dict__* this doesn't allocate it.
+    """
+    # referents of an instance are its type, __dict__ and slot values
+    slot_values = [getattr(obj, name, None) for cls in type(obj).__mro__
+                   for name in cls.__dict__.get('__slots__', ())]
+    for ref in gc.get_referents(obj):
+        if type(ref) is dict and not any(ref is val for val in slot_values):
+            return ref
+    return None
+
+
 class LoggingState(State):
     """Utility state that logs entries and exits into hsm.data._log dict."""
     def __init__(self, states=None, log_id=None):
@@ -2,7 +2,7 @@ from hsmpy import (HSM, State, EventBus, Event, Initial, T, Internal, Choice,
                    Local)
 from hsmpy.logic import get_path_from_root, get_state_by_sig
 from reusable import (make_miro_machine, LoggingState, get_callback,
-                      A, B, C, D, E, G, I)
+                      A, B, C, D, E, F, G, H, I, TERMINATE)
 
 
 def assert_curr_state(hsm, leaf_name):
@@ -1002,3 +1002,81 @@ class Test_Choice_transitions:
             'top_enter': 4,
             'A_enter': 2,
         }
+
+
+
+class Test_dropping_events_not_handled_by_active_states:
+
+    def setup_class(self):
+        states, trans = make_miro_machine(use_logging=True)
+        self.hsm = HSM(states, trans)
+        self.eb = EventBus()
+        self.calls = []
+
+    def setup_method(self, method):
+        import hsmpy.elements
+        self.calls[:] = []
+        original = hsmpy.elements.get_merged_sequences
+
+        def counting(*args):
+            self.calls.append(args[1].__class__)
+            return original(*args)
+        hsmpy.elements.get_merged_sequences = counting
+        self.original = original
+
+    def teardown_method(self, method):
+        import hsmpy.elements
+        hsmpy.elements.get_merged_sequences = self.original
+
+    def test_handled_events_after_start(self):
+        self.hsm.start(self.eb)
+        assert_curr_state(self.hsm, 's211')
+        # top, s, s2, s21, s211 are active
+        assert set(self.hsm._handled_counts) == set(
+            [E, TERMINATE, I, C, F, A, B, G, D, H])
+        assert self.hsm._handled_counts[I] == 2  # s and s2
+        assert self.hsm._handled_counts[D] == 1  # s211
+
+    def test_unhandled_event_is_dropped(self):
+        class Unhandled(Event):
+            pass
+        self.eb.register(Unhandled, self.hsm._handle_event)
+        self.eb.dispatch(Unhandled())
+        assert self.calls == []
+
+    def test_handled_events_follow_configuration(self):
+        self.eb.dispatch(TERMINATE())
+        assert_curr_state(self.hsm, 'final')
+        assert self.calls == [TERMINATE]
+        assert self.hsm._handled_counts == {}
+        self.eb.dispatch(A())
+        self.eb.dispatch(I())
+        assert self.calls == [TERMINATE]
+        assert_curr_state(self.hsm, 'final')
+
+
+class Test_narrow_subscriptions:
+
+    def setup_class(self):
+        states, trans = make_miro_machine(use_logging=True)
+        self.hsm = HSM(states, trans)
+        self.eb = EventBus()
+
+    def test_subscribed_only_to_handled_events(self):
+        self.hsm.start(self.eb, narrow_subscriptions=True)
+        assert_curr_state(self.hsm, 's211')
+        assert set(self.eb.listeners) == set(self.hsm._handled_counts)
+
+    def test_subscriptions_follow_configuration(self):
+        self.eb.dispatch(C())
+        assert_curr_state(self.hsm, 's11')
+        # s, s1 and s11 are active
+        assert set(self.eb.listeners) == set(
+            [E, TERMINATE, I, A, B, C, D, F, G, H])
+        self.eb.dispatch(TERMINATE())
+        assert_curr_state(self.hsm, 'final')
+        assert self.eb.listeners == {}
+
+    def test_stop_unregisters(self):
+        self.hsm.stop()
+        assert self.eb.listeners == {}
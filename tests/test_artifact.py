@@ -0,0 +1,139 @@
+import pytest
+from StringIO import StringIO
+from hsmpy import HSM, EventBus
+from hsmpy import artifact
+from hsmpy.logic import get_state_by_sig
+from reusable import (make_nested_machine, make_submachines_machine,
+                      make_miro_machine, LoggingState,
+                      active_names, A, B, AB_ex, TERMINATE)
+
+
+def roundtrip(hsm):
+    fp = StringIO()
+    artifact.dump(hsm, fp)
+    fp.seek(0)
+    return artifact.load(fp)
+
+
+class Test_references:
+
+    def test_module_level_objects(self):
+        assert artifact.get_ref(LoggingState) == 'tests.reusable:LoggingState'
+        assert artifact.resolve_ref('tests.reusable:LoggingState') is (
+            LoggingState)
+
+    def test_module_level_lambda(self):
+        from hsmpy import elements
+        ref = artifact.get_ref(elements.do_nothing)
+        assert ref == 'hsmpy.elements:do_nothing'
+        assert artifact.resolve_ref(ref) is elements.do_nothing
+
+    def test_nested_function(self):
+        def nested(evt, hsm):
+            pass
+        with pytest.raises(ValueError):
+            artifact.get_ref(nested)
+
+    def test_missing_attribute(self):
+        with pytest.raises(LookupError):
+            artifact.resolve_ref('tests.reusable:NoSuchThing')
+
+
+class Test_roundtrip:
+
+    @pytest.mark.parametrize('make_machine', [
+        make_nested_machine,
+        make_submachines_machine,
+    ])
+    def test_same_structure(self, make_machine):
+        states, trans = make_machine(use_logging=True)
+        hsm = HSM(states, trans)
+        loaded = roundtrip(hsm)
+        assert loaded.flattened == hsm.flattened
+        assert [st.name for st in loaded.flattened] == [
+            st.name for st in hsm.flattened]
+        assert loaded.root == hsm.root
+        assert loaded.trans == hsm.trans
+        # parent links point to the new instances
+        for st in loaded.flattened:
+            if st.parent is not None:
+                assert any(st.parent is other for other in loaded.flattened)
+                assert any(st is sub for sub in st.parent.states)
+
+    def test_event_set_is_restored(self):
+        states, trans = make_nested_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        hsm.start(EventBus())
+        loaded = roundtrip(hsm)
+        assert loaded.event_set == hsm.event_set
+
+    def test_state_attributes_are_restored(self):
+        states, trans = make_nested_machine(use_logging=True)
+        hsm = HSM(states, trans)
+        get_state_by_sig(('B',), hsm.flattened)._log_id = 'custom'
+        loaded = roundtrip(hsm)
+        state = get_state_by_sig(('B',), loaded.flattened)
+        assert isinstance(state, LoggingState)
+        assert state._log_id == 'custom'
+
+    def test_id_and_cached_name_are_not_pickled(self):
+        states, trans = make_nested_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        state = get_state_by_sig(('B',), hsm.flattened)
+        state.name  # caches name
+        state.custom = 'value'
+        index_of = dict((id(st), i) for i, st in enumerate(hsm.flattened))
+        extra = artifact._pack_state(state, index_of)[-1]
+        assert extra == {'custom': 'value'}
+        loaded = get_state_by_sig(('B',), roundtrip(hsm).flattened)
+        assert loaded.id == state.id
+        assert loaded.name == 'B'
+
+    def test_closures_cannot_be_dumped(self):
+        states, trans = make_miro_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        with pytest.raises(ValueError):
+            artifact.dumps(hsm)
+
+    def test_wrong_version(self, monkeypatch):
+        states, trans = make_nested_machine(use_logging=False)
+        data = artifact.dumps(HSM(states, trans))
+        monkeypatch.setattr(artifact, 'FORMAT_VERSION', 0)
+        with pytest.raises(ValueError):
+            artifact.loads(data)
+
+
+class Test_loaded_machine_behavior:
+
+    def test_nested_machine(self):
+        states, trans = make_nested_machine(use_logging=True)
+        hsm = roundtrip(HSM(states, trans))
+        eb = EventBus()
+        hsm.start(eb)
+        assert active_names(hsm) == set(['top', 'A', 'B', 'C'])
+        eb.dispatch(A())
+        assert hsm.data._log == {
+            'top_enter': 1,
+            'A_enter': 2, 'B_enter': 2, 'C_enter': 2,
+            'A_exit': 1, 'B_exit': 1, 'C_exit': 1,
+        }
+
+    def test_submachines_machine(self):
+        states, trans = make_submachines_machine(use_logging=True)
+        original = HSM(states, trans)
+        loaded = roundtrip(original)
+        eb = EventBus()
+        original.start(eb)
+        loaded.start(eb)
+        for evt in [A(), B(), TERMINATE(), A(), A(), AB_ex()]:
+            eb.dispatch(evt)
+            assert active_names(loaded) == active_names(original)
+        assert loaded.data._log == original.data._log
+
+    def test_loaded_states_are_independent(self):
+        states, trans = make_nested_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        first = roundtrip(hsm)
+        second = roundtrip(hsm)
+        assert not set(map(id, first.flattened)) & set(
+            map(id, second.flattened))
@@ -0,0 +1,36 @@
+from hsmpy import HSM
+from benchmarks import run, machines, memory
+
+
+class Test_benchmark_suite:
+
+    def test_machines_are_valid(self):
+        for name, make_machine in machines.MACHINES:
+            hsm, events = run.make_hsm(make_machine)
+            assert events
+
+    def test_run_and_compare(self):
+        results = run.run(n_events=20, repeat=1,
+                          names=['nested', 'orthogonal'])
+        assert set(results['results']) == set(['nested', 'orthogonal'])
+        nested = results['results']['nested']
+        assert 'dispatch_codegen' in nested
+        assert nested['dispatch']['events_per_second'] > 0
+        assert (nested['dispatch']['latency_p50_us']
+                <= nested['dispatch']['latency_p99_us'])
+        # code generation doesn't support orthogonal states
+        assert 'dispatch_codegen' not in results['results']['orthogonal']
+
+        rows = run.compare(results, results)
+        assert rows
+        assert all(ratio in (1.0, None) for _, _, _, ratio in rows)
+
+    def test_memory_covers_whole_instance(self):
+        states, trans, _, _ = machines.wide()
+        hsm = HSM(states, trans)
+        size = memory.hsm_size(hsm)
+        assert size > sum(memory.instance_size(st) for st in hsm.flattened)
+        hsm._table = [None] * 1000
+        assert memory.hsm_size(hsm) > size + 1000 * 4
+        # classes and functions are shared, and aren't counted
+        assert memory.deep_size(HSM) == 0
@@ -0,0 +1,116 @@
+import os
+import random
+import pytest
+from hsmpy import HSM, EventBus
+from hsmpy import codegen
+from reusable import (make_miro_machine, make_nested_machine,
+                      make_choice_machine, make_submachines_machine,
+                      A, B, C, D, E, F, G, H, I, TERMINATE, AB_ex, AC_ex,
+                      BC_ex, AB_loc, AC_loc, BC_loc, BA_ex, CA_ex, CB_ex,
+                      BA_loc, CA_loc, CB_loc, active_names)
+
+
+def make_tracing_hsm(make_machine, compiled, cache_dir=None):
+    """Returns HSM whose states append their entries and exits to a list."""
+    states, trans = make_machine(use_logging=False)
+    hsm = HSM(states, trans)
+    hsm.data.trace = []
+    hsm.data.foo = 3
+
+    def tracer(st, suffix):
+        def func(evt, hsm):
+            hsm.data.trace.append('{0}-{1}'.format(st.name, suffix))
+        return func
+
+    for st in hsm.flattened:
+        st.on_enter = tracer(st, 'entry')
+        st.on_exit = tracer(st, 'exit')
+    if compiled:
+        codegen.compile_machine(hsm, cache_dir)
+    return hsm
+
+
+miro_events = [A, B, C, D, E, F, G, H, I, TERMINATE]
+nested_events = [A, B, C, AB_ex, AC_ex, BC_ex, AB_loc, AC_loc, BC_loc, BA_ex,
+                 CA_ex, CB_ex, BA_loc, CA_loc, CB_loc]
+
+
+@pytest.mark.parametrize(('make_machine', 'events', 'data'), [
+    (make_miro_machine, miro_events, [None]),
+    (make_nested_machine, nested_events, [None]),
+    (make_choice_machine, [A], range(-1, 8) + [10, 20, 30, 40, 50, 60]),
+])
+@pytest.mark.parametrize('seed', range(5))
+def test_same_behavior_as_interpreter(make_machine, events, data, seed):
+    interpreted = make_tracing_hsm(make_machine, compiled=False)
+    compiled = make_tracing_hsm(make_machine, compiled=True)
+    interpreted.start(EventBus())
+    compiled.start(EventBus())
+    rnd = random.Random(seed)
+    for _ in range(100):
+        Event, value = rnd.choice(events), rnd.choice(data)
+        interpreted.eb.dispatch(Event(value))
+        compiled.eb.dispatch(Event(value))
+        assert compiled.data.trace == interpreted.data.trace
+        assert active_names(compiled) == active_names(interpreted)
+        assert compiled.data.foo == interpreted.data.foo
+
+
+class Test_generated_source:
+
+    def test_miro_machine(self):
+        hsm = make_tracing_hsm(make_miro_machine, compiled=False)
+        source = codegen.generate_source(hsm)
+        assert 'TABLE = {' in source
+        # guarded transitions are compiled as conditions
+        assert 'if g' in source
+        compile(source, '<test>', 'exec')
+
+    def test_choice_falls_back_to_interpreter(self):
+        hsm = make_tracing_hsm(make_choice_machine, compiled=False)
+        ns = {}
+        exec codegen.generate_source(hsm) in ns
+        assert ns['TABLE']
+        assert all(func is None for func in ns['TABLE'].values())
+
+    def test_orthogonal_not_supported(self):
+        states, trans = make_submachines_machine(use_logging=False)
+        with pytest.raises(ValueError):
+            codegen.compile_machine(HSM(states, trans))
+
+
+class Test_disk_cache:
+
+    def test_cached_code_is_reused(self, tmpdir):
+        cache_dir = str(tmpdir)
+        first = make_tracing_hsm(make_miro_machine, True, cache_dir)
+        cached = os.listdir(cache_dir)
+        assert len(cached) == 1
+        mtime = os.path.getmtime(os.path.join(cache_dir, cached[0]))
+
+        second = make_tracing_hsm(make_miro_machine, True, cache_dir)
+        assert os.listdir(cache_dir) == cached
+        assert os.path.getmtime(os.path.join(cache_dir, cached[0])) == mtime
+
+        first.start(EventBus())
+        second.start(EventBus())
+        for Event in [G, I, A, D, D, C, TERMINATE]:
+            first.eb.dispatch(Event())
+            second.eb.dispatch(Event())
+        assert first.data.trace == second.data.trace
+        assert active_names(first) == set(['top', 'final'])
+        assert active_names(second) == set(['top', 'final'])
+
+    def test_other_interpreters_use_different_entries(self, tmpdir,
+                                                      monkeypatch):
+        cache_dir = str(tmpdir)
+        make_tracing_hsm(make_miro_machine, True, cache_dir)
+        monkeypatch.setattr(codegen.imp, 'get_magic', lambda: 'other')
+        make_tracing_hsm(make_miro_machine, True, cache_dir)
+        assert len(os.listdir(cache_dir)) == 2
+
+    def test_different_machines_use_different_entries(self, tmpdir):
+        cache_dir = str(tmpdir)
+        make_tracing_hsm(make_miro_machine, True, cache_dir)
+        make_tracing_hsm(make_nested_machine, True, cache_dir)
+        assert len(os.listdir(cache_dir)) == 2
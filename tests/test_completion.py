@@ -0,0 +1,129 @@
+import pytest
+from hsmpy import HSM, State, Event, Initial, T, Completion
+from hsmpy import artifact, codegen
+from reusable import start_hsm, active_leaves
+
+
+class A(Event): pass
+class B(Event): pass
+class Step(Event): pass
+class Reset(Event): pass
+
+
+def make_region(event):
+    """Sub-machine that reaches its final state on *event*."""
+    states = {
+        'top': State({
+            'running': State(),
+            'done': State(final=True),
+        })
+    }
+    trans = {
+        'top': {Initial: T('running')},
+        'running': {event: T('done')},
+    }
+    return (states, trans)
+
+
+def make_machine(log):
+    """
+        Machine with composite 'job' state and orthogonal 'work' state,
+        both have completion transitions:
+
+            top[job[first, end(final)], work[2 regions], finished]
+    """
+    def logged(name):
+        return lambda evt, hsm: log.append((name, evt.data))
+
+    states = {
+        'top': State({
+            'job': State({
+                'first': State(),
+                'end': State(final=True),
+            }),
+            'work': State([make_region(A), make_region(B)]),
+            'finished': State(on_enter=logged('finished')),
+        })
+    }
+    trans = {
+        'top': {
+            Initial: T('job'),
+            Reset: T('job'),
+        },
+        'job': {
+            Initial: T('first'),
+            Completion: T('work', action=logged('job-completed')),
+        },
+        'first': {Step: T('end')},
+        'work': {
+            Completion: T('finished', action=logged('work-completed')),
+        },
+    }
+    return (states, trans)
+
+
+class Test_completion:
+
+    def test_composite_completes_in_same_step(self):
+        log = []
+        hsm = start_hsm(*make_machine(log))
+        hsm.eb.dispatch(Step())
+        assert log == [('job-completed', 'job')]
+        assert active_leaves(hsm) == ['work[0].running', 'work[1].running']
+
+    def test_orthogonal_completes_when_all_regions_are_done(self):
+        log = []
+        hsm = start_hsm(*make_machine(log))
+        hsm.eb.dispatch(Step())
+        hsm.eb.dispatch(A())
+        assert active_leaves(hsm) == ['work[0].done', 'work[1].running']
+        assert len(log) == 1
+        hsm.eb.dispatch(B())
+        assert log[1:] == [('work-completed', 'work'), ('finished', 'work')]
+        assert active_leaves(hsm) == ['finished']
+
+    def test_completed_regions_are_counted(self):
+        log = []
+        hsm = start_hsm(*make_machine(log))
+        hsm.eb.dispatch(Step())
+        work = [st for st in hsm.flattened if st.name == 'work'][0]
+        hsm.eb.dispatch(A())
+        assert hsm._completed_regions[work] == 1
+        hsm.eb.dispatch(Reset())  # leaves 'work' with one region done
+        assert hsm._completed_regions[work] == 0
+        hsm.eb.dispatch(Step())
+        hsm.eb.dispatch(B())
+        assert active_leaves(hsm) == ['work[0].running', 'work[1].done']
+        hsm.eb.dispatch(A())
+        assert active_leaves(hsm) == ['finished']
+
+    def test_completion_isnt_dispatched_on_bus(self):
+        log = []
+        hsm = start_hsm(*make_machine(log))
+        assert Completion not in hsm.event_set
+        hsm.eb.dispatch(Completion('job'))
+        assert active_leaves(hsm) == ['first']
+
+    @pytest.mark.parametrize('name', [
+        'job',  # composite
+        'first',  # has outgoing transitions
+    ])
+    def test_invalid_final_states(self, name):
+        states, trans = make_machine([])
+        job = states['top'].states['job']
+        if name == 'job':
+            job.final = True
+        else:
+            job.states['first'].final = True
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans)
+        assert 'Invalid final states' in str(exc.value)
+
+    def test_artifact(self):
+        hsm = artifact.loads(artifact.dumps(HSM(*make_region(A))))
+        done = [st for st in hsm.flattened if st.name == 'done'][0]
+        assert done.final
+
+    def test_codegen_isnt_supported(self):
+        with pytest.raises(ValueError):
+            codegen.compile_machine(HSM(*make_region(A)))
@@ -0,0 +1,144 @@
+from hsmpy import (HSM, State, Event, EventBus, Initial, T, Internal, Choice,
+                   codegen)
+from hsmpy.counters import Counters
+from reusable import make_nested_machine, make_choice_machine, A, AB_ex, BC_loc
+
+
+def make_counted(make_machine=make_nested_machine):
+    states, trans = make_machine(use_logging=False)
+    hsm = HSM(states, trans)
+    hsm.counters = Counters(hsm)
+    return hsm
+
+
+def by_source_and_event(report):
+    return dict(((tr['source'], tr['event']), tr)
+                for tr in report['transitions'])
+
+
+class Test_counters:
+
+    def test_disabled_by_default(self):
+        states, trans = make_nested_machine(use_logging=False)
+        assert HSM(states, trans).counters is None
+
+    def test_every_state_and_transition_has_counter(self):
+        hsm = make_counted()
+        counters = hsm.counters
+        n_trans = sum(len(outgoing) for outgoing in hsm.trans.values())
+        assert len(counters.entries) == len(hsm.flattened)
+        assert len(counters.exits) == len(hsm.flattened)
+        assert len(counters.taken) == n_trans
+        report = counters.report()
+        assert [st['state'] for st in report['states']] == [
+            st.name for st in hsm.flattened]
+        assert len(report['transitions']) == n_trans
+
+    def test_start_counts_entries_and_initial_transitions(self):
+        hsm = make_counted()
+        hsm.start(EventBus())
+        report = hsm.counters.report()
+        entries = dict((st['state'], st['entries']) for st in report['states'])
+        assert entries == {'top': 1, 'A': 1, 'B': 1, 'C': 1}
+        assert all(st['exits'] == 0 for st in report['states'])
+        trans = by_source_and_event(report)
+        assert trans[('A', 'Initial')]['count'] == 1
+        assert trans[('A', 'Initial')]['target'] == 'B'
+        assert sorted(hsm.counters.unvisited()) == []
+
+    def test_dispatch_counts_transitions_exits_and_entries(self):
+        hsm = make_counted()
+        hsm.start(EventBus())
+        hsm.counters.reset()
+        hsm.eb.dispatch(AB_ex())
+        hsm.eb.dispatch(AB_ex())
+        hsm.eb.dispatch(BC_loc())
+        report = hsm.counters.report()
+        trans = by_source_and_event(report)
+        assert trans[('A', 'AB_ex')]['count'] == 2
+        assert trans[('A', 'AB_ex')]['kind'] == 'Transition'
+        assert trans[('B', 'BC_loc')]['count'] == 1
+        assert trans[('B', 'BC_loc')]['kind'] == 'LocalTransition'
+        states = dict((st['state'], st) for st in report['states'])
+        # external transition from parent to child exits the parent too
+        assert states['A']['exits'] == 2
+        assert states['A']['entries'] == 2
+        assert states['C']['exits'] == 3
+        assert states['C']['entries'] == 3
+        assert states['top']['exits'] == 0
+
+    def test_hot_and_dead_transitions(self):
+        hsm = make_counted()
+        hsm.start(EventBus())
+        hsm.counters.reset()
+        [hsm.eb.dispatch(AB_ex()) for _ in range(3)]
+        hsm.eb.dispatch(BC_loc())
+        hot = hsm.counters.hot(2)
+        assert [(tr['source'], tr['event'], tr['count']) for tr in hot] == [
+            ('A', 'AB_ex', 3), ('B', 'Initial', 3)]
+        dead = [(tr['source'], tr['event']) for tr in hsm.counters.dead()]
+        assert ('A', 'AB_ex') not in dead
+        assert ('A', 'A') in dead
+        assert len(dead) == len(hsm.counters.transitions) - 3
+
+    def test_choice_transitions(self):
+        hsm = make_counted(make_choice_machine)
+        hsm.data.foo = 3
+        hsm.start(EventBus())
+        hsm.counters.reset()
+        hsm.eb.dispatch(A(2))
+        trans = by_source_and_event(hsm.counters.report())
+        # machine is in C, which responds with transition to B
+        assert trans[('C', 'A')]['count'] == 1
+        assert trans[('C', 'A')]['kind'] == 'ChoiceTransition'
+        assert trans[('C', 'A')]['target'] is None
+        assert trans[('B', 'Initial')]['count'] == 1
+        assert sum(hsm.counters.taken) == 2
+
+    def test_choice_transitions_for_events_with_same_name(self):
+        # same name, different modules
+        first = type('Go', (Event,), {'__module__': 'first'})
+        second = type('Go', (Event,), {'__module__': 'second'})
+        states = {'top': State({'a': State(), 'b': State()})}
+        trans = {
+            'top': {Initial: T('a')},
+            'a': {
+                first: Choice({1: 'b'}, default='a'),
+                second: Choice({1: 'b'}, default='a'),
+            },
+        }
+        hsm = HSM(states, trans)
+        hsm.counters = Counters(hsm)
+        hsm.start(EventBus())
+        # default target, machine stays in 'a'
+        [hsm.eb.dispatch(evt) for evt in [first(2), first(2), second(2)]]
+        counts = dict((evt, hsm.counters.taken[i]) for i, (_, evt, _)
+                      in enumerate(hsm.counters.transitions))
+        assert counts[first] == 2
+        assert counts[second] == 1
+
+    def test_transition_shared_by_event_types(self):
+        class X(Event): pass
+        class Y(Event): pass
+        tran = Internal()
+        states = {'top': State({'a': State()})}
+        trans = {
+            'top': {Initial: T('a')},
+            'a': {X: tran, Y: tran},
+        }
+        hsm = HSM(states, trans)
+        hsm.counters = Counters(hsm)
+        hsm.start(EventBus())
+        [hsm.eb.dispatch(evt) for evt in [X(), X(), Y()]]
+        counts = by_source_and_event(hsm.counters.report())
+        assert counts[('a', 'X')]['count'] == 2
+        assert counts[('a', 'Y')]['count'] == 1
+
+    def test_compiled_machine_is_counted(self, tmpdir):
+        hsm = make_counted()
+        codegen.compile_machine(hsm, cache_dir=str(tmpdir))
+        hsm.start(EventBus())
+        hsm.counters.reset()
+        hsm.eb.dispatch(AB_ex())
+        trans = by_source_and_event(hsm.counters.report())
+        assert trans[('A', 'AB_ex')]['count'] == 1
@@ -213,3 +213,57 @@ class Test_callback_order:
         self.eb.dispatch(E1())
         assert self.log_before == [1, 2, 3, 4, 5, 6]
         assert self.log_after == [1, 2, 3, 4, 5, 6]
+
+
+class Test_budgeted_processing:
+    def setup_method(self, method):
+        self.eb = EventBus()
+        self.handled = []
+
+        def chatty(evt):
+            self.handled += [evt.data]
+            if evt.data < 10:
+                self.eb.dispatch(PingEvent(evt.data + 1))  # follow-up event
+
+        self.eb.register(PingEvent, chatty)
+
+    def test_post_only_queues(self):
+        self.eb.post(PingEvent(0))
+        assert self.handled == []
+        assert len(self.eb.queue) == 1
+
+    def test_max_events(self):
+        self.eb.post(PingEvent(0))
+        assert self.eb.process(max_events=3) == 1
+        assert self.handled == [0, 1, 2]
+        assert self.eb.process(max_events=5) == 1
+        assert self.handled == range(8)
+        assert self.eb.process() == 0
+        assert self.handled == range(11)
+        assert not self.eb.dispatch_in_progress
+
+    def test_max_seconds(self):
+        self.eb.post(PingEvent(0))
+        # at least one event is handled even with exhausted budget
+        assert self.eb.process(max_seconds=0) == 1
+        assert self.handled == [0]
+        assert self.eb.process(max_seconds=60) == 0
+        assert self.handled == range(11)
+
+    def test_cannot_process_while_handling(self):
+        errors = []
+
+        def nested(evt):
+            try:
+                self.eb.process()
+            except RuntimeError:
+                errors.append(evt)
+
+        self.eb.register(AnotherEvent, nested)
+        self.eb.dispatch(AnotherEvent())
+        assert len(errors) == 1
+
+    def test_dispatch_processes_posted_events(self):
+        self.eb.post(PingEvent(8))
+        self.eb.dispatch(PingEvent(10))
+        assert self.handled == [8, 10, 9, 10]  # queue is FIFO
@@ -0,0 +1,94 @@
+import pytest
+from hsmpy import HSM, EventBus, Event
+from hsmpy.eventlog import EventLogWriter, JSONCodec, read, replay
+from reusable import make_miro_machine, A, C, D, E, G, I
+
+
+def make_started():
+    states, trans = make_miro_machine(use_logging=False)
+    hsm = HSM(states, trans)
+    hsm.start(EventBus())
+    return hsm
+
+
+def record(path, events, **kwargs):
+    """Dispatches events to a new machine, recording them into log."""
+    hsm = make_started()
+    with EventLogWriter(path, **kwargs) as log:
+        hsm.eb.event_log = log
+        for evt in events:
+            hsm.eb.dispatch(evt)
+            log.checkpoint(hsm)
+    return hsm
+
+
+class Ping(Event):
+    pass
+
+
+class Test_event_log:
+
+    def test_read_records(self, tmpdir):
+        path = str(tmpdir.join('events.log'))
+        record(path, [C(1), I('foo')])
+        records = list(read(path))
+        assert [rec[0] for rec in records] == ['event', 'checkpoint',
+                                               'event', 'checkpoint']
+        _, _, evt = records[0]
+        assert type(evt) is C and evt.data == 1
+        _, _, evt = records[2]
+        assert type(evt) is I and evt.data == 'foo'
+        assert records[1][1:] == (1, ['s', 's1', 's11', 'top'])
+        assert records[3][1] == 2
+
+    def test_replay_reaches_same_configurations(self, tmpdir):
+        path = str(tmpdir.join('events.log'))
+        events = [C(), E(), D(), D(), G(), C(), A()]
+        original = record(path, events)
+        hsm = HSM(*make_miro_machine(use_logging=False))
+        assert replay(path, hsm) == len(events)
+        names = lambda machine: set(st.name
+                                    for st in machine.current_state_set)
+        assert names(hsm) == names(original)
+        assert hsm.data.foo == original.data.foo
+
+    def test_replay_detects_different_configuration(self, tmpdir):
+        path = str(tmpdir.join('events.log'))
+        record(path, [C(), E()])
+        states, trans = make_miro_machine(use_logging=False)
+        del trans['s2'][C]  # machine now stays in s211
+        with pytest.raises(ValueError) as exc:
+            replay(path, HSM(states, trans, skip_validation=True))
+        assert 'after 1 events' in str(exc.value)
+        replay(path, HSM(states, trans, skip_validation=True), check=False)
+
+    def test_codec_and_event_types(self, tmpdir):
+        path = str(tmpdir.join('events.log'))
+        record(path, [C({'a': [1, 2]}), E(), I()], codec=JSONCodec(),
+               event_types=set([C, I]))
+        events = [rec[2] for rec in read(path, JSONCodec())
+                  if rec[0] == 'event']
+        assert [type(evt) for evt in events] == [C, I]
+        assert events[0].data == {'a': [1, 2]}
+
+    def test_events_dispatched_while_handling_are_not_recorded(self, tmpdir):
+        path = str(tmpdir.join('events.log'))
+        eb = EventBus()
+        eb.register(Ping, lambda evt: eb.dispatch(C()))
+        with EventLogWriter(path) as log:
+            eb.event_log = log
+            eb.dispatch(Ping())
+        assert [type(rec[2]) for rec in read(path)] == [Ping]
+
+    def test_incomplete_last_record_is_ignored(self, tmpdir):
+        path = str(tmpdir.join('events.log'))
+        record(path, [C(), E()])
+        data = open(path, 'rb').read()
+        open(path, 'wb').write(data[:-3])
+        assert len(list(read(path))) == 3
+
+    def test_not_an_event_log(self, tmpdir):
+        path = tmpdir.join('other.log')
+        path.write('not a log at all')
+        with pytest.raises(ValueError):
+            list(read(str(path)))
@@ -0,0 +1,141 @@
+import pytest
+from hsmpy import HSM, State, Event, EventBus, Initial, T, Fork, Join
+from hsmpy import artifact
+from reusable import start_hsm, active_leaves
+
+
+class Go(Event): pass
+class Next(Event): pass
+class Done(Event): pass
+
+
+def make_region(name):
+    """Sub-machine with two states, *name*1 and *name*2."""
+    first, second = name + '1', name + '2'
+    states = {
+        'top': State({
+            first: State(),
+            second: State(),
+        })
+    }
+    trans = {
+        'top': {Initial: T(first)},
+        first: {Next: T(second)},
+    }
+    return (states, trans)
+
+
+def make_machine():
+    """
+        Machine with orthogonal state 'work' with three sub-machines:
+
+            top[idle, work[a[a1, a2], b[b1, b2], c[c1, c2]], finished]
+    """
+    states = {
+        'top': State({
+            'idle': State(),
+            'work': State([make_region('a'), make_region('b'),
+                           make_region('c')]),
+            'finished': State(),
+        })
+    }
+    trans = {
+        'top': {Initial: T('idle')},
+        'idle': {
+            Go: Fork(['work[0].a2', 'work[1].b2']),
+            Next: T('work'),
+        },
+        'work': {
+            Done: Join(['work[0].a2', 'work[1].b2'], 'finished'),
+        },
+    }
+    return (states, trans)
+
+
+class Test_fork:
+
+    def test_parse_finds_orthogonal_state(self):
+        hsm = HSM(*make_machine())
+        fork = hsm.trans[('idle',)][Go]
+        assert fork.target == ('work',)
+        assert fork.targets == (('work', 0, 'a2'), ('work', 1, 'b2'))
+
+    def test_enters_targets_directly(self):
+        hsm = start_hsm(*make_machine())
+        hsm.eb.dispatch(Go())
+        assert active_leaves(hsm) == ['work[0].a2', 'work[1].b2', 'work[2].c1']
+
+    def test_plan_is_precomputed(self):
+        hsm = HSM(*make_machine())
+        work = [st for st in hsm.flattened if st.name == 'work'][0]
+        plan = hsm._fork_plans[hsm.trans[('idle',)][Go]]
+        assert [region for region, _ in plan] == work.states
+        assert [path and [st.name for st in path] for _, path in plan] == [
+            ['work[0].top', 'work[0].a2'],
+            ['work[1].top', 'work[1].b2'],
+            None,
+        ]
+
+
+class Test_join:
+
+    def test_parse_computes_mask(self):
+        hsm = HSM(*make_machine())
+        join = hsm.trans[('work',)][Done]
+        names = [st.name for i, st in enumerate(hsm.flattened)
+                 if join.mask & (1 << i)]
+        assert sorted(names) == ['work[0].a2', 'work[1].b2']
+
+    def test_taken_only_when_all_sources_are_active(self):
+        hsm = start_hsm(*make_machine())
+        hsm.eb.dispatch(Next())  # enter 'work' through initial transitions
+        hsm.eb.dispatch(Done())
+        assert active_leaves(hsm) == ['work[0].a1', 'work[1].b1', 'work[2].c1']
+        hsm.eb.dispatch(Next())  # every sub-machine moves to second state
+        hsm.eb.dispatch(Done())
+        assert active_leaves(hsm) == ['finished']
+        assert hsm._active_mask == sum(
+            1 << i for i, st in enumerate(hsm.flattened)
+            if st.name in ['top', 'finished'])
+
+    def test_fork_then_join(self):
+        hsm = start_hsm(*make_machine())
+        hsm.eb.dispatch(Go())
+        hsm.eb.dispatch(Done())
+        assert active_leaves(hsm) == ['finished']
+
+    def test_artifact(self):
+        hsm = artifact.loads(artifact.dumps(HSM(*make_machine())))
+        hsm.start(EventBus())
+        hsm.eb.dispatch(Go())
+        assert active_leaves(hsm) == ['work[0].a2', 'work[1].b2', 'work[2].c1']
+        hsm.eb.dispatch(Done())
+        assert active_leaves(hsm) == ['finished']
+
+
+class Test_validation:
+
+    @pytest.mark.parametrize('tran', [
+        Fork(['work[0].a2']),  # single target
+        Fork(['work[0].a1', 'work[0].a2']),  # same sub-machine
+        Fork(['work[0].a2', 'work[1].nope']),  # nonexistent
+        Fork(['work[0].a2', 'finished']),  # not in orthogonal state
+    ])
+    def test_invalid_forks(self, tran):
+        states, trans = make_machine()
+        trans['idle'][Go] = tran
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans)
+        assert 'Invalid fork and join transitions' in str(exc.value)
+
+    @pytest.mark.parametrize(('source', 'tran'), [
+        ('work', Join(['work[0].a2', 'work[0].a1'], 'finished')),
+        ('work', Join(['work[0].a2', 'nope'], 'finished')),
+        ('idle', Join(['work[0].a2', 'work[1].b2'], 'finished')),
+    ])
+    def test_invalid_joins(self, source, tran):
+        states, trans = make_machine()
+        trans[source][Done] = tran
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans)
+        assert 'Invalid fork and join transitions' in str(exc.value)
@@ -0,0 +1,119 @@
+import random
+import pytest
+from hsmpy import HSM, EventBus, artifact
+from benchmarks.generator import generate
+
+
+def describe(states, trans):
+    """Returns layout description that doesn't depend on object identity."""
+    def state_desc(val):
+        if isinstance(val, list):
+            return [describe(s, t) for s, t in val]
+        return sorted((name, state_desc(sub.states))
+                      for name, sub in val.items())
+
+    def tran_desc(tran):
+        return (type(tran).__name__,) + tuple(
+            getattr(f, '__name__', f) for f in tran)
+
+    return (state_desc(states),
+            sorted((src, evt.__name__, tran_desc(tran))
+                   for src, outgoing in trans.items()
+                   for evt, tran in outgoing.items()))
+
+
+class Test_generate:
+
+    @pytest.mark.parametrize('seed', range(10))
+    def test_generated_machine_is_valid(self, seed):
+        states, trans, events = generate(depth=4, fanout=3, regions=2,
+                                         orthogonal_ratio=0.3, seed=seed)
+        HSM(states, trans)  # would raise ValueError if invalid
+
+    def test_same_seed_gives_same_machine(self):
+        first = generate(seed=5)
+        second = generate(seed=5)
+        assert describe(*first[:2]) == describe(*second[:2])
+        assert ([evt.__name__ for evt in first[2]]
+                == [evt.__name__ for evt in second[2]])
+
+    def test_different_seed_gives_different_machine(self):
+        assert describe(*generate(seed=1)[:2]) != describe(
+            *generate(seed=2)[:2])
+
+    def test_size(self):
+        states, trans, _ = generate(depth=4, fanout=5, orthogonal_ratio=0)
+        hsm = HSM(states, trans)
+        assert len(hsm.flattened) == 1 + 5 + 25 + 125
+        assert not any(st.kind == 'orthogonal' for st in hsm.flattened)
+
+    def test_orthogonal_regions(self):
+        states, trans, _ = generate(depth=3, fanout=2, regions=4,
+                                    orthogonal_ratio=1.0)
+        hsm = HSM(states, trans)
+        orthogonal = [st for st in hsm.flattened if st.kind == 'orthogonal']
+        assert len(orthogonal) == 2
+        assert all(len(st.states) == 4 for st in orthogonal)
+
+    def test_transition_mix(self):
+        states, trans, _ = generate(depth=4, fanout=3, transition_density=4,
+                                    local_ratio=0, internal_ratio=1.0,
+                                    guard_ratio=1.0, n_events=20)
+        names = [type(tran).__name__ for outgoing in trans.values()
+                 for tran in outgoing.values()]
+        # apart from initial transitions and transitions that make all
+        # states reachable, all are guarded internal transitions
+        assert names.count('InternalTransition') == 40 * 4
+        assert set(names) == set(['Transition', 'InternalTransition'])
+
+    def test_too_few_events(self):
+        with pytest.raises(ValueError):
+            generate(fanout=3, n_events=3)
+
+    @pytest.mark.parametrize('seed', range(3))
+    def test_dispatching_random_events(self, seed):
+        states, trans, events = generate(depth=4, fanout=3,
+                                         orthogonal_ratio=0.2, seed=seed)
+        hsm = HSM(states, trans)
+        eb = EventBus()
+        hsm.start(eb)
+        rnd = random.Random(seed)
+        for _ in range(200):
+            eb.dispatch(rnd.choice(events)(rnd.choice([None, 1, 2])))
+            leaves = [st for st in hsm.current_state_set
+                      if st.kind == 'leaf']
+            assert leaves
+            for st in hsm.current_state_set:
+                assert st.parent is None or st.parent in hsm.current_state_set
+
+    def test_artifact_round_trip(self):
+        states, trans, events = generate(depth=4, fanout=3,
+                                         orthogonal_ratio=0.2, seed=1)
+        machines = [HSM(states, trans)]
+        machines += [artifact.loads(artifact.dumps(machines[0]))]
+        rnd = random.Random(1)
+        stream = [rnd.choice(events)(rnd.choice([None, 1, 2]))
+                  for _ in range(100)]
+        configs = []
+        for hsm in machines:
+            eb = EventBus()
+            hsm.start(eb)
+            for evt in stream:
+                eb.dispatch(evt)
+            configs += [sorted(st.sig for st in hsm.current_state_set)]
+        assert configs[0] == configs[1]
+
+    def test_event_types_are_reused(self):
+        assert generate(seed=3)[2] == generate(seed=3)[2]
+
+    def test_large_machine(self):
+        states, trans, events = generate(depth=5, fanout=10,
+                                         orthogonal_ratio=0.01, n_events=12)
+        hsm = HSM(states, trans)  # validation mustn't hit recursion limit
+        assert len(hsm.flattened) > 10 ** 4
+        eb = EventBus()
+        hsm.start(eb)
+        rnd = random.Random(0)
+        for _ in range(100):
+            eb.dispatch(rnd.choice(events)(rnd.choice([None, 1, 2])))
+        assert any(st.kind == 'leaf' for st in hsm.current_state_set)
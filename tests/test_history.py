@@ -0,0 +1,158 @@
+import pytest
+from hsmpy import HSM, State, Event, EventBus, Initial, T
+from hsmpy import artifact
+from reusable import start_hsm, active_leaves
+
+
+class Next(Event): pass
+class Switch(Event): pass
+class Leave(Event): pass
+class Back(Event): pass
+class Reset(Event): pass
+
+
+def make_panel_machine(history, log):
+    """
+        Machine with 'panel' composite state having given history:
+
+            top[panel[a[a1, a2], b], outside]
+    """
+    def logged(name):
+        return lambda evt, hsm: log.append(name)
+
+    def S(name, states=None, **kwargs):
+        return State(states, on_enter=logged(name), **kwargs)
+
+    states = {
+        'top': S('top', {
+            'panel': S('panel', {
+                'a': S('a', {
+                    'a1': S('a1'),
+                    'a2': S('a2'),
+                }),
+                'b': S('b'),
+            }, history=history),
+            'outside': S('outside'),
+        })
+    }
+    trans = {
+        'top': {Initial: T('panel')},
+        'panel': {
+            Initial: T('a'),
+            Leave: T('outside'),
+            Reset: T('panel'),
+        },
+        'a': {
+            Initial: T('a1', action=logged('a-Initial')),
+            Switch: T('b'),
+        },
+        'a1': {Next: T('a2')},
+        'outside': {Back: T('panel')},
+    }
+    return (states, trans)
+
+
+class Test_history:
+
+    @pytest.mark.parametrize('history', [None, 'shallow', 'deep'])
+    def test_first_entry_follows_initial_transitions(self, history):
+        log = []
+        hsm = start_hsm(*make_panel_machine(history, log))
+        assert log == ['top', 'panel', 'a', 'a-Initial', 'a1']
+        assert active_leaves(hsm) == ['a1']
+
+    @pytest.mark.parametrize(('history', 'exp_log', 'exp_leaves'), [
+        (None, ['panel', 'a', 'a-Initial', 'a1'], ['a1']),
+        ('shallow', ['panel', 'a', 'a-Initial', 'a1'], ['a1']),
+        ('deep', ['panel', 'a', 'a2'], ['a2']),
+    ])
+    def test_reentry(self, history, exp_log, exp_leaves):
+        log = []
+        hsm = start_hsm(*make_panel_machine(history, log))
+        hsm.eb.dispatch(Next())
+        hsm.eb.dispatch(Leave())
+        assert active_leaves(hsm) == ['outside']
+        del log[:]
+        hsm.eb.dispatch(Back())
+        assert log == exp_log
+        assert active_leaves(hsm) == exp_leaves
+
+    @pytest.mark.parametrize(('history', 'exp_leaves'), [
+        (None, ['a1']),
+        ('shallow', ['b']),
+        ('deep', ['b']),
+    ])
+    def test_shallow_history_restores_direct_substate(self, history,
+                                                      exp_leaves):
+        log = []
+        hsm = start_hsm(*make_panel_machine(history, log))
+        hsm.eb.dispatch(Switch())
+        hsm.eb.dispatch(Leave())
+        hsm.eb.dispatch(Back())
+        assert active_leaves(hsm) == exp_leaves
+
+    @pytest.mark.parametrize(('history', 'exp_leaves'), [
+        (None, ['a1']),
+        ('shallow', ['a1']),
+        ('deep', ['a2']),
+    ])
+    def test_self_transition_restores_what_was_active(self, history,
+                                                      exp_leaves):
+        log = []
+        hsm = start_hsm(*make_panel_machine(history, log))
+        hsm.eb.dispatch(Next())
+        hsm.eb.dispatch(Reset())
+        assert active_leaves(hsm) == exp_leaves
+
+    def test_deep_history_entry_sequence_is_cached(self):
+        log = []
+        hsm = start_hsm(*make_panel_machine('deep', log))
+        hsm.eb.dispatch(Next())
+        for _ in range(3):
+            hsm.eb.dispatch(Leave())
+            hsm.eb.dispatch(Back())
+        assert active_leaves(hsm) == ['a2']
+        assert len(hsm._history_entries) == 1
+
+    def test_snapshot_keeps_history(self):
+        log = []
+        hsm = start_hsm(*make_panel_machine('deep', log))
+        hsm.eb.dispatch(Next())
+        hsm.eb.dispatch(Leave())
+        restored = HSM(*make_panel_machine('deep', []))
+        restored.start(EventBus(), restore=hsm.snapshot())
+        restored.eb.dispatch(Back())
+        assert active_leaves(restored) == ['a2']
+
+    @pytest.mark.parametrize(('name', 'history'), [
+        ('a1', 'deep'),  # leaf
+        ('panel', 'full'),  # unknown kind
+    ])
+    def test_invalid_history(self, name, history):
+        states, trans = make_panel_machine(None, [])
+        panel = states['top'].states['panel']
+        if name == 'panel':
+            panel.history = history
+        else:
+            panel.states['a'].states[name].history = history
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans)
+        assert 'Invalid history states' in str(exc.value)
+
+
+class Test_history_artifact:
+
+    def test_history_is_kept(self):
+        states = {
+            'top': State({
+                'panel': State({'a': State(), 'b': State()}, history='deep'),
+            })
+        }
+        trans = {
+            'top': {Initial: T('panel')},
+            'panel': {Initial: T('a')},
+            'a': {Next: T('b')},
+        }
+        hsm = artifact.loads(artifact.dumps(HSM(states, trans)))
+        panel = [st for st in hsm.flattened if st.name == 'panel'][0]
+        assert panel.history == 'deep'
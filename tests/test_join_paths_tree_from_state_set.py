@@ -1,3 +1,4 @@
+import pytest
 from hsmpy import HSM
 from hsmpy.logic import join_paths, tree_from_state_set, get_state_by_sig
 from reusable import make_miro_machine, make_submachines_machine
@@ -208,3 +209,47 @@ class Test_tree_from_state_set:
                 ])
             ]),
         ]
+
+    def test_siblings_are_in_parse_order(self):
+        states, trans = make_submachines_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        assert [st.id for st in hsm.flattened] == range(len(hsm.flattened))
+
+        def ids(tree_tuples):
+            return [(st.id, ids(subs)) for st, subs in tree_tuples]
+
+        def is_ordered(tree):
+            keys = [i for i, _ in tree]
+            return (keys == sorted(keys) and
+                    all(is_ordered(subs) for _, subs in tree))
+
+        # every state of the machine, in reverse parse order
+        tree = tree_from_state_set(set(hsm.flattened[::-1]))
+        assert is_ordered(ids(tree))
+
+    def test_children_of_composite_states_are_ordered_by_name(self):
+        states, trans = make_miro_machine(use_logging=False)
+        hsm = HSM(states, trans)
+
+        def check(st):
+            names = [sub.name for sub in st.states]
+            if st.kind == 'composite':
+                assert names == sorted(names)
+            for sub in st.states:
+                check(sub)
+
+        check(hsm.root)
+
+    def test_unnumbered_states_raise(self):
+        states, trans = make_miro_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        leaf = get_state_by_sig(('s211',), hsm.flattened)
+        leaf.id = None
+        with pytest.raises(ValueError):
+            tree_from_state_set(set([leaf]))
+
+    def test_join_paths_with_key(self):
+        paths = [['a', 'b'], ['a', 'c'], ['a', 'd']]
+        key = lambda node: -ord(node[0])
+        assert join_paths(paths, key) == [
+            ('a', [('d', []), ('c', []), ('b', [])])]
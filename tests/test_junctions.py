@@ -0,0 +1,151 @@
+import pytest
+from hsmpy import HSM, State, Event, EventBus, Initial, T, Local, Junction
+from hsmpy import artifact, codegen
+from reusable import active_leaf
+
+
+class Go(Event): pass
+class Back(Event): pass
+
+
+def is_positive(evt, hsm):
+    return evt.data > 0
+
+
+def is_big(evt, hsm):
+    return abs(evt.data) >= 100
+
+
+def is_enabled(evt, hsm):
+    return hsm.data.enabled
+
+
+def log_go(evt, hsm):
+    hsm.data.log.append('go')
+
+
+def log_positive(evt, hsm):
+    hsm.data.log.append('positive')
+
+
+def log_big(evt, hsm):
+    hsm.data.log.append('big')
+
+
+sign = Junction([
+    T(Junction([
+        T('big_positive', guard=is_big, action=log_big),
+        T('small_positive'),
+    ]), guard=is_positive, action=log_positive),
+    T('other'),
+])
+
+
+def make_machine():
+    """
+        Machine with Go transition to nested junctions which choose between
+        three target states.
+    """
+    states = {
+        'top': State({
+            'idle': State(),
+            'values': State({
+                'big_positive': State(),
+                'small_positive': State(),
+                'other': State(),
+            }),
+        })
+    }
+    trans = {
+        'top': {
+            Initial: T('idle'),
+            Back: T('idle'),
+        },
+        'idle': {
+            Go: T(sign, guard=is_enabled, action=log_go),
+        },
+        'values': {
+            Initial: T('other'),
+        },
+    }
+    return (states, trans)
+
+
+def make_started(compiled=False, tmpdir=None):
+    hsm = HSM(*make_machine())
+    if compiled:
+        codegen.compile_machine(hsm, cache_dir=str(tmpdir))
+    hsm.data.log = []
+    hsm.data.enabled = True
+    hsm.start(EventBus())
+    return hsm
+
+
+class Test_junctions:
+
+    def test_resolved_into_compound_transitions(self):
+        hsm = HSM(*make_machine())
+        chain = hsm.trans[('idle',)][Go]
+        assert [tr.target for tr in chain.branches] == [
+            ('big_positive',), ('small_positive',), ('other',)]
+        assert [tr.guard.functions for tr in chain.branches[:2]] == [
+            (is_enabled, is_positive, is_big),
+            (is_enabled, is_positive),
+        ]
+        assert chain.branches[2].guard is is_enabled
+        assert chain.branches[2].action is log_go
+        assert chain.branches[0].action.functions == (log_go, log_positive,
+                                                      log_big)
+
+    @pytest.mark.parametrize('compiled', [False, True])
+    @pytest.mark.parametrize(('data', 'exp_leaf', 'exp_log'), [
+        (500, 'big_positive', ['go', 'positive', 'big']),
+        (5, 'small_positive', ['go', 'positive']),
+        (-500, 'other', ['go']),
+    ])
+    def test_target_is_chosen(self, data, exp_leaf, exp_log, compiled,
+                              tmpdir):
+        hsm = make_started(compiled, tmpdir)
+        hsm.eb.dispatch(Go(data))
+        assert active_leaf(hsm) == exp_leaf
+        assert hsm.data.log == exp_log
+
+    def test_not_taken_when_incoming_guard_fails(self):
+        hsm = make_started()
+        hsm.data.enabled = False
+        hsm.eb.dispatch(Go(5))
+        assert active_leaf(hsm) == 'idle'
+        assert hsm.data.log == []
+
+    def test_local_transition_to_junction(self):
+        states, trans = make_machine()
+        trans['values'][Go] = Local(Junction([T('big_positive')]))
+        hsm = HSM(states, trans)
+        assert hsm.trans[('values',)][Go] == Local(('big_positive',))
+
+    def test_segment_targets_are_validated(self):
+        states, trans = make_machine()
+        trans['values'][Go] = T(Junction([T('nowhere', guard=is_big),
+                                          T('idle')]))
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans)
+        assert 'nowhere' in str(exc.value)
+
+    @pytest.mark.parametrize('segments', [
+        [],
+        [Local('values')],
+    ])
+    def test_invalid_segments(self, segments):
+        states, trans = make_machine()
+        trans['idle'][Go] = T(Junction(segments))
+        with pytest.raises(ValueError):
+            HSM(states, trans)
+
+    def test_artifact(self):
+        hsm = artifact.loads(artifact.dumps(HSM(*make_machine())))
+        hsm.data.log = []
+        hsm.data.enabled = True
+        hsm.start(EventBus())
+        hsm.eb.dispatch(Go(500))
+        assert active_leaf(hsm) == 'big_positive'
+        assert hsm.data.log == ['go', 'positive', 'big']
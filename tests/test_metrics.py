@@ -0,0 +1,158 @@
+import random
+import pytest
+from hsmpy import HSM, EventBus
+from hsmpy.metrics import (Histogram, LatencyRecorder, bucket_index,
+                           bucket_bounds, N_BUCKETS, MAX_BITS)
+from reusable import make_nested_machine, A, B, C, AB_ex, F
+
+
+class Test_buckets:
+
+    @pytest.mark.parametrize('ns', range(0, 40) + [1000, 12345, 999999,
+                                                     2 ** 30 + 17,
+                                                     2 ** MAX_BITS - 1])
+    def test_value_within_bucket_bounds(self, ns):
+        low, high = bucket_bounds(bucket_index(ns))
+        assert low <= ns <= high
+
+    def test_buckets_are_contiguous(self):
+        prev_high = -1
+        for index in range(N_BUCKETS):
+            low, high = bucket_bounds(index)
+            assert low == prev_high + 1
+            prev_high = high
+
+    def test_relative_bucket_width(self):
+        for index in range(16, N_BUCKETS):
+            low, high = bucket_bounds(index)
+            assert (high - low + 1) / float(low) <= 0.125
+
+
+class Test_histogram:
+
+    def test_empty(self):
+        hist = Histogram()
+        assert hist.percentile(50) == 0
+        assert hist.summary()['count'] == 0
+
+    def test_percentiles_are_accurate(self):
+        rnd = random.Random(1)
+        values = [rnd.expovariate(1e4) for _ in range(10000)]
+        hist = Histogram()
+        for val in values:
+            hist.record(val)
+        values.sort()
+        for p in [50, 90, 99, 99.9]:
+            exact = values[int(p / 100.0 * len(values)) - 1]
+            assert abs(hist.percentile(p) - exact) / exact < 0.13
+        assert hist.count == 10000
+        assert hist.max == values[-1]
+        assert hist.percentile(100) <= hist.max
+        assert abs(hist.mean - sum(values) / len(values)) < 1e-9
+
+    def test_huge_values_go_to_last_bucket(self):
+        hist = Histogram()
+        hist.record(1e6)
+        assert hist.counts[-1] == 1
+        assert hist.percentile(50) == 1e6
+
+    def test_merge_and_reset(self):
+        a, b = Histogram(), Histogram()
+        a.record(0.001)
+        b.record(0.002)
+        b.record(0.003)
+        a.merge(b)
+        assert a.count == 3
+        assert a.max == 0.003
+        a.reset()
+        assert a.count == 0
+        assert sum(a.counts) == 0
+
+
+class Test_latency_recorder:
+
+    def test_snapshot_resets(self):
+        rec = LatencyRecorder('test')
+        rec.record(A, 0.001)
+        rec.record(A, 0.002)
+        rec.record(B, 0.003)
+        snap = rec.snapshot(reset=False)
+        assert snap[A].count == 2
+        assert rec.histograms[A].count == 2
+        snap = rec.snapshot()
+        assert snap[B].count == 1
+        assert rec.histograms == {}
+
+    def test_report(self):
+        rec = LatencyRecorder('test')
+        rec.record(A, 0.001)
+        report = rec.report(percentiles=[50])
+        assert set(report) == set(['A'])
+        assert report['A']['count'] == 1
+        assert abs(report['A']['p50'] - 0.001) < 0.001 * 0.13
+
+
+class Test_instrumentation:
+
+    def setup_method(self, method):
+        states, trans = make_nested_machine(use_logging=False)
+        self.hsm = HSM(states, trans)
+        self.eb = EventBus()
+        self.hsm.latency = LatencyRecorder('nested')
+        self.eb.latency = LatencyRecorder('bus')
+        self.eb.wait_latency = LatencyRecorder('bus-wait')
+        self.hsm.start(self.eb)
+
+    def test_records_per_event_type(self):
+        for evt in [A(), A(), AB_ex(), C(), F()]:
+            self.eb.dispatch(evt)
+        hsm_snap = self.hsm.latency.snapshot()
+        assert dict((evt, h.count) for evt, h in hsm_snap.items()) == {
+            A: 2, AB_ex: 1, C: 1}  # F isn't handled, it's dropped
+        bus_snap = self.eb.latency.snapshot()
+        assert bus_snap[A].count == 2
+        assert bus_snap[F].count == 1
+        # end-to-end time includes time spent in HSM
+        assert bus_snap[A].total >= hsm_snap[A].total
+        wait_snap = self.eb.wait_latency.snapshot()
+        assert sum(h.count for h in wait_snap.values()) == 5 + 1  # KickStart
+
+    def test_queued_events_wait(self):
+        self.eb.latency.snapshot()
+        self.eb.wait_latency.snapshot()
+
+        def dispatch_more(evt):
+            self.eb.dispatch(B())
+            self.eb.dispatch(C())
+        self.eb.register(F, dispatch_more)
+        self.eb.dispatch(F())
+        assert self.eb.queue == []
+        assert self.eb._queued_at == []
+        waits = self.eb.wait_latency.snapshot()
+        assert set(waits) == set([F, B, C])
+        assert waits[C].total > 0
+
+    @pytest.mark.parametrize('assign', [True, False])
+    def test_recorders_changed_while_events_are_queued(self, assign):
+        eb = EventBus()
+        eb.register(A, lambda evt: None)
+        if not assign:
+            eb.latency = LatencyRecorder('bus')
+            eb.wait_latency = LatencyRecorder('bus-wait')
+
+        def toggle(evt):
+            eb.dispatch(A())  # queued while recorders are (not) assigned
+            if assign:
+                eb.latency = LatencyRecorder('bus')
+                eb.wait_latency = LatencyRecorder('bus-wait')
+            else:
+                eb.latency = eb.wait_latency = None
+            eb.dispatch(A())
+        eb.register(F, toggle)
+        eb.dispatch(F())
+        assert eb.queue == []
+        assert eb._queued_at == []
+        if assign:
+            # only the event queued after recorders were assigned is timed
+            assert eb.latency.snapshot()[A].count == 1
+            assert eb.wait_latency.snapshot()[A].count == 1
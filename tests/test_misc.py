@@ -1,11 +1,17 @@
+import pickle
 import pytest
+from copy import copy
 from hsmpy.logic import (get_events,
+                         get_subtree_events,
                          flatten,)
-from hsmpy import State, HSM, Event, Initial, Internal, T
-from reusable import (make_miro_machine, make_nested_machine, leaf, composite,
+from hsmpy import elements
+from hsmpy import (State, SlimState, HSM, Event, SlimEvent, EventBus, Initial,
+                   Internal, T)
+from reusable import (make_miro_machine, make_nested_machine,
+                      make_submachines_async_machine, leaf, composite,
                       orthogonal, A, B, C, D, E, F, G, H, I, TERMINATE, AB_ex,
                       AC_ex, BC_ex, AB_loc, AC_loc, BC_loc, BA_ex, CA_ex,
-                      CB_ex, BA_loc, CA_loc, CB_loc)
+                      CB_ex, BA_loc, CA_loc, CB_loc, allocated_dict)
 
 
 class Test_get_events:
@@ -72,6 +78,63 @@ class Test_get_events_with_subclasses:
 
 
 
+class Test_get_subtree_events:
+
+    def test_miro_machine(self):
+        states, trans = make_miro_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        subtree_events = get_subtree_events(hsm.flattened, hsm.trans)
+        names = dict((st.name, evts) for st, evts in subtree_events.items())
+        assert len(subtree_events) == len(hsm.flattened)
+        assert names['top'] == set([A, B, C, D, E, F, G, H, I, TERMINATE])
+        assert names['final'] == set()
+        assert names['s211'] == set([D, H])
+        assert names['s21'] == set([A, B, D, G, H])
+        assert names['s2'] == set([A, B, C, D, F, G, H, I])
+        assert names['s11'] == set([D, G, H])
+
+    def test_submachines(self):
+        states, trans = make_submachines_async_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        subtree_events = get_subtree_events(hsm.flattened, hsm.trans)
+        names = dict((st.name, evts) for st, evts in subtree_events.items())
+        assert names['subs[0].top'] == set([A])
+        assert names['subs[1].top'] == set([B])
+        assert names['subs'] == set([A, B])
+        assert names['top'] == set([A, B])
+
+
+class Test_dense_ids:
+
+    def test_states_and_events_are_numbered(self):
+        states, trans = make_miro_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        assert [st.id for st in hsm.flattened] == range(len(hsm.flattened))
+        assert hsm.sigs == [st.sig for st in hsm.flattened]
+        assert hsm.event_types == [A, B, C, D, E, F, G, H, I, TERMINATE]
+        assert [hsm.event_ids[evt] for evt in hsm.event_types] == range(10)
+
+    def test_columns(self):
+        states, trans = make_miro_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        by_name = dict((st.name, st.id) for st in hsm.flattened)
+        column = hsm._columns[hsm.event_ids[D]]
+        assert column[by_name['s211']] is hsm.trans[('s211',)][D]
+        assert column[by_name['s21']] is None  # s211 responds to D
+        # only states whose subtrees respond are stored
+        assert by_name['final'] not in column
+        assert len(column) < len(hsm.flattened)
+
+    def test_submachines(self):
+        states, trans = make_submachines_async_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        by_name = dict((st.name, st.id) for st in hsm.flattened)
+        column = hsm._columns[hsm.event_ids[B]]
+        assert by_name['subs[0].top'] not in column
+        assert column[by_name['subs[1].top']] is None
+        assert column[by_name['subs']] is None
+
+
 class Test_flatten:
     def test_single_empty(self):
         assert flatten([]) == []
@@ -369,3 +432,151 @@ class Test_state_sig_and_name:
         with pytest.raises(ValueError):
             res = State.name_to_sig(name)
             print res
+
+    def test_name_is_cached_until_sig_changes(self):
+        state = State()
+        state.sig = ('a', 2, 'sub')
+        name = state.name
+        assert name == 'a[2].sub'
+        assert state.name is name
+        state.sig = ('a', 3, 'sub')
+        assert state.name == 'a[3].sub'
+        state.name = 'b'
+        assert state.name == 'b'
+        assert state.sig == ('b',)
+
+    def test_is_in(self):
+        states, trans = make_submachines_async_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        hsm.start(EventBus())
+        for st in hsm.flattened:
+            assert hsm.is_in(st.name) == (st in hsm.current_state_set)
+        assert hsm.is_in('subs[0].top')
+        assert hsm.is_in(' subs [0] . top ')
+        names = dict(hsm._name_ids)
+        assert not any(hsm.is_in('nope{0}'.format(i)) for i in range(10))
+        # unknown names aren't added to machine's index
+        assert hsm._name_ids == names
+        with pytest.raises(ValueError):
+            hsm.is_in('subs[0]')
+
+    def test_conversions_are_cached(self):
+        name = 'cached [1]. conversion'
+        sig = State.name_to_sig(name)
+        assert State.name_to_sig(name) is sig
+        assert State.sig_to_name(sig) is State.sig_to_name(sig)
+
+    def test_conversion_caches_are_bounded(self, monkeypatch):
+        monkeypatch.setattr(elements, '_CONVERSION_CACHE_SIZE', 10)
+        for i in range(25):
+            State.sig_to_name(State.name_to_sig('unknown{0}'.format(i)))
+        assert len(elements._sigs_by_name) <= 10
+        assert len(elements._names_by_sig) <= 10
+        with pytest.raises(ValueError):
+            State.name_to_sig('malformed[0]')
+        assert 'malformed[0]' not in elements._sigs_by_name
+
+
+class SlimTick(SlimEvent):
+    __slots__ = ()
+
+
+class SlimLeaf(SlimState):
+    __slots__ = ()
+
+
+def noop(evt, hsm):
+    pass
+
+
+class Test_slim_elements:
+
+    def test_slim_event_has_no_dict(self):
+        evt = SlimTick(5)
+        assert evt.data == 5
+        assert allocated_dict(evt) is None
+        evt.foo = 1
+        assert allocated_dict(evt) == {'foo': 1}
+
+    def test_regular_event_subclass_has_dict(self):
+        evt = A(5)
+        evt.foo = 1
+        assert evt.data == 5
+        assert evt.foo == 1
+
+    def test_slim_state_has_no_dict(self):
+        st = SlimLeaf()
+        st.name = 'left[0].right'
+        assert st.sig == ('left', 0, 'right')
+        assert allocated_dict(st) is None
+
+    def test_plain_instances_take_attributes(self):
+        evt = Event(3)
+        evt.foo = 1
+        st = State()
+        st.foo = 2
+        assert (evt.data, evt.foo, st.foo) == (3, 1, 2)
+
+    @pytest.mark.parametrize('protocol', [0, 1, 2])
+    def test_pickling(self, protocol):
+        for evt in [Event(3), A(3), SlimTick(3)]:
+            copied = pickle.loads(pickle.dumps(evt, protocol))
+            assert type(copied) is type(evt)
+            assert copied.data == 3
+        slim = SlimTick(3)
+        slim.foo = 1
+        assert pickle.loads(pickle.dumps(slim, protocol)).foo == 1
+        for Cls in [State, SlimLeaf]:
+            # default actions are lambdas, which can't be pickled
+            st = Cls(on_enter=noop, on_exit=noop, final=True)
+            st.name = 'left[0].right'
+            copied = pickle.loads(pickle.dumps(st, protocol))
+            assert copied.sig == ('left', 0, 'right')
+            assert copied.final is True
+
+    def test_copied_slim_state_has_no_dict(self):
+        st = SlimLeaf()
+        assert allocated_dict(copy(st)) is None
+        assert allocated_dict(st) is None
+
+    def test_regular_state_subclass_has_dict(self):
+        class Custom(State):
+            def __init__(self):
+                super(Custom, self).__init__()
+                self.extra = 1
+        assert Custom().extra == 1
+
+    def test_hsm_with_slim_elements(self):
+        states = {
+            'top': SlimLeaf({
+                'left': SlimLeaf(),
+                'right': SlimLeaf(),
+            })
+        }
+        trans = {
+            'top': {
+                Initial: T('left'),
+            },
+            'left': {
+                SlimTick: T('right'),
+            },
+        }
+        hsm = HSM(states, trans)
+        assert all(isinstance(st, SlimLeaf) for st in hsm.flattened)
+        # parsed states are copies with managed attributes set
+        assert not any(st is states['top'] for st in hsm.flattened)
+        assert set(st.name for st in hsm.flattened) == set(
+            ['top', 'left', 'right'])
+        eb = EventBus()
+        hsm.start(eb)
+        eb.dispatch(SlimTick())
+        assert set(st.name for st in hsm.current_state_set) == set(
+            ['top', 'right'])
+
+    def test_hsm_data_is_shared_class(self):
+        states, trans = make_nested_machine(False)
+        first, second = HSM(states, trans), HSM(states, trans)
+        assert first.data is not second.data
+        assert type(first.data) is type(second.data)
+        first.data.foo = 1
+        assert not hasattr(second.data, 'foo')
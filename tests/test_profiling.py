@@ -0,0 +1,91 @@
+from hsmpy import HSM, EventBus, State, Event, Initial, T, Choice
+from hsmpy.profiling import Profiler
+from reusable import make_nested_machine, FakeClock, A, AB_ex
+
+
+def make_profiled(**kwargs):
+    states, trans = make_nested_machine(use_logging=False)
+    hsm = HSM(states, trans)
+    hsm.profiler = Profiler(clock=FakeClock(), **kwargs)
+    hsm.start(EventBus())
+    return hsm
+
+
+class Test_profiler:
+
+    def test_disabled_by_default(self):
+        states, trans = make_nested_machine(use_logging=False)
+        hsm = HSM(states, trans)
+        assert hsm.profiler is None
+        hsm.start(EventBus())
+        hsm.eb.dispatch(A())
+
+    def test_start_is_profiled(self):
+        hsm = make_profiled()
+        names = set(row['name'] for row in hsm.profiler.report())
+        assert names == set(['top-entry', 'top-Initial', 'A-entry',
+                             'A-Initial', 'B-entry', 'B-Initial', 'C-entry'])
+        assert all(row['count'] == 1 for row in hsm.profiler.report())
+
+    def test_actions_and_path_computation(self):
+        hsm = make_profiled()
+        hsm.profiler.reset()
+        hsm.eb.dispatch(AB_ex())
+        hsm.eb.dispatch(AB_ex())
+        report = dict((row['name'], row) for row in hsm.profiler.report())
+        # external transition from parent to child exits the parent too
+        assert set(report) == set(['C-exit', 'B-exit', 'A-exit', 'A-AB_ex',
+                                   'A-entry', 'B-entry', 'B-Initial',
+                                   'C-entry', 'get_merged_sequences'])
+        assert report['get_merged_sequences']['kind'] == 'path'
+        assert report['C-exit']['kind'] == 'exit'
+        assert report['C-entry']['kind'] == 'entry'
+        assert report['A-AB_ex']['kind'] == 'transition'
+        for row in report.values():
+            assert row['count'] == 2
+            assert row['total'] == 2  # fake clock ticks once per action
+            assert row['max'] == 1
+
+    def test_report_by_event(self):
+        hsm = make_profiled()
+        hsm.eb.dispatch(A())
+        rows = hsm.profiler.report(by_event=True)
+        entries = [(row['event'], row['count']) for row in rows
+                   if row['name'] == 'C-entry']
+        assert sorted(entries) == [('A', 1), ('Initial', 1)]
+        merged = [row for row in hsm.profiler.report()
+                  if row['name'] == 'C-entry']
+        assert merged[0]['count'] == 2
+
+    def test_folded_export(self):
+        hsm = make_profiled(name='door')
+        hsm.profiler.reset()
+        hsm.eb.dispatch(AB_ex())
+        lines = hsm.profiler.folded().split('\n')
+        assert 'door;AB_ex;C-exit 1000000' in lines
+        assert 'door;AB_ex;get_merged_sequences 1000000' in lines
+        assert len(lines) == 9
+
+    def test_events_with_same_name_are_kept_apart(self):
+        # same name, different modules
+        first = type('Go', (Event,), {'__module__': 'first'})
+        second = type('Go', (Event,), {'__module__': 'second'})
+        states = {'top': State({'a': State(), 'b': State()})}
+        trans = {
+            'top': {Initial: T('a')},
+            'a': {
+                first: Choice({1: 'b'}, default='a'),
+                second: Choice({1: 'b'}, default='a'),
+            },
+        }
+        hsm = HSM(states, trans)
+        hsm.profiler = Profiler(clock=FakeClock())
+        hsm.start(EventBus())
+        # default target, machine stays in 'a'
+        [hsm.eb.dispatch(evt) for evt in [first(2), first(2), second(2)]]
+        counts = sorted(row['count'] for row in hsm.profiler.report()
+                        if row['name'] == 'a-Go')
+        assert counts == [1, 2]
+        paths = [row for row in hsm.profiler.report(by_event=True)
+                 if row['kind'] == 'path']
+        assert sorted(row['count'] for row in paths) == [1, 2]
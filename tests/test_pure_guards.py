@@ -0,0 +1,87 @@
+import pytest
+from hsmpy import (HSM, State, Event, EventBus, Initial, T, Choice, Junction,
+                   pure)
+from reusable import active_leaves
+
+
+class Go(Event): pass
+
+
+def make_machine(guard, key, regions=3):
+    """
+        Machine with *regions* identical orthogonal submachines, each of
+        them has guarded transition and Choice transition for Go event.
+    """
+    sub_states = {
+        'top': State({
+            'idle': State(),
+            'busy': State(),
+            'done': State(),
+        })
+    }
+    sub_trans = {
+        'top': {Initial: T('idle')},
+        'idle': {Go: T('busy', guard=guard)},
+        'busy': {Go: Choice({True: 'done'}, default='idle', key=key)},
+    }
+    states = {
+        'top': State([(sub_states, sub_trans)] * regions)
+    }
+    return HSM(states, {})
+
+
+def in_all_regions(name):
+    return ['top[{0}].{1}'.format(i, name) for i in range(3)]
+
+
+class Test_pure_guards:
+
+    @pytest.mark.parametrize(('mark', 'exp_calls'), [
+        (False, [3, 6, 9]),
+        (True, [1, 2, 3]),
+    ])
+    def test_evaluated_once_per_event(self, mark, exp_calls):
+        calls = []
+
+        def check(evt, hsm):
+            calls.append(evt)
+            return evt.data
+
+        if mark:
+            pure(check)
+        hsm = make_machine(guard=check, key=check)
+        hsm.start(EventBus())
+        hsm.eb.dispatch(Go(False))
+        assert len(calls) == exp_calls[0]
+        assert active_leaves(hsm) == in_all_regions('idle')
+        hsm.eb.dispatch(Go(True))  # guards
+        assert len(calls) == exp_calls[1]
+        assert active_leaves(hsm) == in_all_regions('busy')
+        hsm.eb.dispatch(Go(True))  # Choice keys
+        assert len(calls) == exp_calls[2]
+        assert active_leaves(hsm) == in_all_regions('done')
+
+    def test_pure_returns_function(self):
+        func = lambda evt, hsm: True
+        assert pure(func) is func
+        assert func.pure
+
+    def test_junction_segment_guards(self):
+        calls = []
+
+        @pure
+        def check(evt, hsm):
+            calls.append(evt)
+            return evt.data
+
+        sub_states = {'top': State({'idle': State(), 'busy': State()})}
+        sub_trans = {
+            'top': {Initial: T('idle')},
+            'idle': {Go: T(Junction([T('busy', guard=check)]),
+                          guard=lambda evt, hsm: True)},
+        }
+        hsm = HSM({'top': State([(sub_states, sub_trans)] * 3)}, {})
+        hsm.start(EventBus())
+        hsm.eb.dispatch(Go(True))
+        assert len(calls) == 1
+        assert active_leaves(hsm) == in_all_regions('busy')
@@ -1,5 +1,6 @@
 from hsmpy.logic import reformat
-from hsmpy import State, Initial, Local
+from hsmpy import HSM, State, EventBus, Initial, Local, Internal
+from hsmpy.counters import Counters
 from reusable import leaf, composite, orthogonal, make_miro_machine, A, T
 
 
@@ -284,3 +285,69 @@ class Test_reformat:
             ])
         ]
         assert states == expected_states
+
+
+class Test_submachine_templates:
+    def make_states(self):
+        sub_states = {
+            'top': State({
+                'a': State(),
+                'b': State(),
+            })
+        }
+        sub_trans = {
+            'top': {Initial: T('a')},
+            'a': {A: T('b')},
+            'b': {A: Internal()},
+        }
+        return {
+            'top': State([(sub_states, sub_trans)] * 3)
+        }
+
+    def test_template_is_reformatted_once(self):
+        templates = {}
+        states, trans = reformat(self.make_states(), {}, templates=templates)
+        assert len(templates) == 1
+        subs = states[0].states
+        assert [st.sig for st in subs] == [('top', i, 'top') for i in range(3)]
+        assert [st.parent for st in subs] == [states[0]] * 3
+        a_states = [sub.states[0] for sub in subs]
+        assert len(set(id(st) for st in a_states)) == 3
+        assert [st.parent for st in a_states] == subs
+        assert sorted(trans) == sorted(
+            ('top', i, name) for i in range(3) for name in ['top', 'a', 'b'])
+        assert trans[('top', 2, 'a')][A] == T(('top', 2, 'b'))
+
+    def test_transitions_without_targets_are_shared(self):
+        states, trans = reformat(self.make_states(), {})
+        internals = set(id(trans[('top', i, 'b')][A]) for i in range(3))
+        assert len(internals) == 1
+        # outgoing dicts made only of transitions without targets too
+        outgoing = set(id(trans[('top', i, 'b')]) for i in range(3))
+        assert len(outgoing) == 1
+        assert len(set(id(trans[('top', i, 'a')]) for i in range(3))) == 3
+
+    def test_shared_transitions_are_counted_per_state(self):
+        hsm = HSM(self.make_states(), {})
+        hsm.counters = Counters(hsm)
+        hsm.start(EventBus())
+        hsm.eb.dispatch(A())  # a -> b in every sub-machine
+        hsm.counters.reset()
+        hsm.eb.dispatch(A())  # shared internal transition of b
+        counts = [(st.name, count) for (st, _, _), count
+                  in zip(hsm.counters.transitions, hsm.counters.taken)
+                  if st.name.endswith('.b')]
+        assert counts == [('top[{0}].b'.format(i), 1) for i in range(3)]
+
+    def test_same_as_separate_submachines(self):
+        templated = reformat(self.make_states(), {})
+        sub = self.make_states()['top'].states[0]
+        separate = reformat({'top': State([copy_sub(sub) for _ in range(3)])},
+                            {})
+        assert templated == separate
+
+
+def copy_sub(sub):
+    """Returns copy of (states, trans) tuple with new dict objects."""
+    states, trans = sub
+    return (dict(states), dict(trans))
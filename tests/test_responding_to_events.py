@@ -108,6 +108,12 @@ def check(hsm, states, Event, exp_resp_states, exp_tran_targets):
     state_set = set([get_state_by_sig(sig, hsm.flattened) for sig in states])
     tree = tree_from_state_set(state_set)
     resps = get_responses(tree, Event(), hsm.trans, None)
+    # pruning subtrees that can't respond mustn't change the result
+    # events that no state handles have no column, nothing responds
+    evt_id = hsm.event_ids.get(Event)
+    column = {} if evt_id is None else hsm._columns[evt_id]
+    assert resps == get_responses(tree, Event(), hsm.trans, None,
+                                  column=column)
 
     if exp_resp_states or exp_tran_targets:
         resp_subtrees, trans = zip(*resps)
@@ -0,0 +1,105 @@
+import pytest
+from hsmpy import HSM, State, Event, Initial, T, Internal
+from hsmpy.scheduler import Scheduler
+from reusable import FakeClock, active_leaf
+
+
+class Ping(Event):
+    pass
+
+
+class Pong(Event):
+    pass
+
+
+def make_chatty(log, name):
+    """Machine that answers every Ping with another Ping."""
+    def answer(evt, hsm):
+        log.append((name, 'Ping'))
+        hsm.eb.dispatch(Ping())
+
+    states = {'top': State({'idle': State()})}
+    trans = {
+        'top': {Initial: T('idle')},
+        'idle': {Ping: Internal(action=answer)},
+    }
+    return HSM(states, trans)
+
+
+def make_toggle(log, name):
+    """Machine that toggles between two states on Pong."""
+    def note(evt, hsm):
+        log.append((name, 'Pong'))
+
+    states = {'top': State({'on': State(), 'off': State()})}
+    trans = {
+        'top': {Initial: T('off')},
+        'off': {Pong: T('on', action=note)},
+        'on': {Pong: T('off', action=note)},
+    }
+    return HSM(states, trans)
+
+
+class Test_scheduler:
+
+    def test_events_go_only_to_listening_machines(self):
+        log = []
+        sched = Scheduler()
+        toggle = make_toggle(log, 'toggle')
+        sched.add(toggle, name='toggle')
+        sched.dispatch(Pong())
+        sched.dispatch(Ping())  # nobody listens
+        assert sched.pending() == 1
+        assert sched.tick() == 0
+        assert active_leaf(toggle) == 'on'
+
+    def test_chatty_machine_doesnt_starve_others(self):
+        log = []
+        sched = Scheduler()
+        sched.add(make_chatty(log, 'chatty'), name='chatty')
+        sched.add(make_toggle(log, 'toggle'), name='toggle')
+        sched.dispatch(Ping())
+        [sched.dispatch(Pong()) for _ in range(3)]
+        # chatty machine always has another Ping queued
+        assert sched.tick(max_events=6) == 1
+        assert log == [('chatty', 'Ping'), ('toggle', 'Pong')] * 3
+
+    def test_weights(self):
+        log = []
+        sched = Scheduler()
+        sched.add(make_chatty(log, 'chatty'), name='chatty', weight=3)
+        sched.add(make_toggle(log, 'toggle'), name='toggle')
+        sched.dispatch(Ping())
+        [sched.dispatch(Pong()) for _ in range(3)]
+        sched.tick(max_events=8)
+        assert log == ([('chatty', 'Ping')] * 3 + [('toggle', 'Pong')]) * 2
+
+    def test_quota_ends_tick(self):
+        log = []
+        sched = Scheduler()
+        sched.add(make_chatty(log, 'chatty'), name='chatty', quota=5)
+        sched.dispatch(Ping())
+        assert sched.tick() == 1
+        assert len(log) == 5
+        assert sched.tick() == 1
+        assert len(log) == 10
+
+    def test_invalid_weight(self):
+        with pytest.raises(ValueError):
+            Scheduler().add(make_toggle([], 'toggle'), weight=0)
+
+    def test_wait_stats(self):
+        log = []
+        sched = Scheduler(clock=FakeClock())
+        sched.add(make_toggle(log, 'toggle'), name='toggle')
+        sched.add(make_toggle(log, 'other'))
+        sched.dispatch(Pong())
+        sched.tick()
+        stats = sched.stats(reset=True)
+        assert set(stats) == set(['toggle', '1'])
+        assert stats['toggle']['handled'] == 1
+        assert stats['toggle']['queued'] == 0
+        assert stats['toggle']['wait']['count'] == 1
+        assert stats['toggle']['wait']['max'] == 1
+        assert stats['1']['wait']['max'] == 2
+        assert sched.stats()['toggle']['handled'] == 0
@@ -0,0 +1,81 @@
+import pytest
+from hsmpy import HSM, EventBus
+from hsmpy.simulation import Runner
+from reusable import make_miro_machine, C, D, I
+
+
+def make_hsm(key):
+    states, trans = make_miro_machine(use_logging=False)
+    return HSM(states, trans)
+
+
+class Test_snapshot:
+
+    def test_restore_without_entry_actions(self):
+        hsm = make_hsm(None)
+        hsm.start(EventBus())
+        hsm.eb.dispatch(C())
+        hsm.eb.dispatch(D())
+        snapshot = hsm.snapshot()
+        assert snapshot['states'] == sorted([('top',), ('s',), ('s1',),
+                                             ('s11',)])
+
+        restored = make_hsm(None)
+        restored.start(EventBus(), restore=snapshot)
+        assert restored.data is hsm.data
+        assert restored.data.foo is True
+        assert (set(st.name for st in restored.current_state_set) ==
+                set(['top', 's', 's1', 's11']))
+        restored.eb.dispatch(C())
+        assert (set(st.name for st in restored.current_state_set) ==
+                set(['top', 's', 's2', 's21', 's211']))
+
+    def test_restore_unknown_states(self):
+        hsm = make_hsm(None)
+        with pytest.raises(ValueError):
+            hsm.start(EventBus(), restore={'states': [('nope',)], 'data': 1})
+        assert not hsm._running
+
+
+class Test_runner:
+
+    def test_yields_configuration_changes(self):
+        runner = Runner(make_hsm)
+        stream = [('a', C()), ('b', I()), ('a', I()), ('b', C()), ('a', C())]
+        changes = [(key, type(evt), old, new)
+                   for key, evt, old, new in runner.run(stream)]
+        assert changes == [
+            ('a', C, ('s211',), ('s11',)),
+            ('b', C, ('s211',), ('s11',)),
+            ('a', C, ('s11',), ('s211',)),
+        ]
+        assert set(runner.machines) == set(['a', 'b'])
+
+    def test_is_lazy(self):
+        runner = Runner(make_hsm)
+
+        def stream():
+            yield ('a', C())
+            raise AssertionError("Consumed more than needed")
+
+        assert next(runner.run(stream()))[0] == 'a'
+
+    def test_evicted_machines_are_restored(self):
+        runner = Runner(make_hsm, max_machines=2)
+        keys = ['k{0}'.format(i) for i in range(5)]
+        list(runner.run((key, C()) for key in keys))
+        assert len(runner.machines) == 2
+        assert runner.evictions == 3
+        assert sorted(runner.store) == ['k0', 'k1', 'k2']
+        # evicted machines continue from where they were
+        changes = list(runner.run([('k0', C()), ('k4', C())]))
+        assert [(key, old, new) for key, _, old, new in changes] == [
+            ('k0', ('s11',), ('s211',)),
+            ('k4', ('s11',), ('s211',)),
+        ]
+        assert 'k0' not in runner.store
+        assert len(runner.machines) == 2
+
+    def test_invalid_max_machines(self):
+        with pytest.raises(ValueError):
+            Runner(make_hsm, max_machines=0)
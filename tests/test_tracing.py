@@ -0,0 +1,66 @@
+import pytest
+from hsmpy import HSM, EventBus, codegen
+from hsmpy.tracing import TransitionTrace
+from reusable import make_miro_machine, FakeClock, C, D, E, I
+
+
+def make_traced(size=1024, compiled=False, tmpdir=None):
+    states, trans = make_miro_machine(use_logging=False)
+    hsm = HSM(states, trans)
+    hsm.trace = TransitionTrace(hsm, size=size, clock=FakeClock())
+    if compiled:
+        codegen.compile_machine(hsm, cache_dir=str(tmpdir))
+    hsm.start(EventBus())
+    return hsm
+
+
+class Test_transition_trace:
+
+    def test_disabled_by_default(self):
+        states, trans = make_miro_machine(use_logging=False)
+        assert HSM(states, trans).trace is None
+
+    def test_invalid_size(self):
+        states, trans = make_miro_machine(use_logging=False)
+        with pytest.raises(ValueError):
+            TransitionTrace(HSM(states, trans), size=0)
+
+    @pytest.mark.parametrize('compiled', [False, True])
+    def test_records_handled_events(self, compiled, tmpdir):
+        hsm = make_traced(compiled=compiled, tmpdir=tmpdir)
+        assert hsm.trace.records() == []
+        hsm.eb.dispatch(C())
+        hsm.eb.dispatch(I())  # internal transition
+        records = hsm.trace.records()
+        assert records == [
+            (1.0, 'C', ['s211'], ['s11']),
+            (2.0, 'I', ['s11'], ['s11']),
+        ]
+
+    def test_keeps_only_last_records(self):
+        hsm = make_traced(size=3)
+        for evt in [C(), E(), C(), E(), D()]:
+            hsm.eb.dispatch(evt)
+        assert hsm.trace.count == 5
+        records = hsm.trace.records()
+        assert [rec[0] for rec in records] == [3.0, 4.0, 5.0]
+        assert [rec[1] for rec in records] == ['C', 'E', 'D']
+        assert records[-1][2:] == (['s11'], ['s11'])
+
+    def test_configurations_are_kept_only_in_ring(self):
+        hsm = make_traced(size=2)
+        for evt in [C(), E(), C(), E(), I()]:
+            hsm.eb.dispatch(evt)
+        trace = hsm.trace
+        assert len(trace._source) == len(trace._target) == 2
+        # configuration tuple is made only when configuration changes, I
+        # (at position 0) follows E (at position 1)
+        assert trace._source[0] is trace._target[1]
+        assert trace._source[0] is trace._target[0]  # internal transition
+
+    def test_dump_and_clear(self):
+        hsm = make_traced()
+        hsm.eb.dispatch(C())
+        assert hsm.trace.dump() == '1.000000 C: s211 -> s11'
+        hsm.trace.clear()
+        assert hsm.trace.records() == []
@@ -0,0 +1,139 @@
+import pytest
+from hsmpy import HSM, State, Event, EventBus, Initial, T, Local, Internal
+from hsmpy import Choice, artifact, codegen
+from hsmpy.counters import Counters
+from reusable import active_leaf
+
+
+class Go(Event): pass
+class Other(Event): pass
+
+
+def is_small(evt, hsm):
+    return evt.data < 10
+
+
+def is_medium(evt, hsm):
+    return evt.data < 100
+
+
+def note(evt, hsm):
+    hsm.data.noted = evt.data
+
+
+def make_machine():
+    """
+        Machine where 'idle' has ordered list of guarded transitions for Go
+        event, parent state 'top' handles Go too but is never asked.
+    """
+    states = {
+        'top': State({
+            'idle': State(),
+            'small': State(),
+            'large': State(),
+        })
+    }
+    trans = {
+        'top': {
+            Initial: T('idle'),
+            Go: T('idle'),
+        },
+        'idle': {
+            Go: [
+                T('small', guard=is_small),
+                Internal(guard=is_medium, action=note),
+                T('large'),
+                T('small'),  # never taken, follows unguarded branch
+            ],
+        },
+        'small': {Other: Local('top')},
+        'large': {Other: T('idle')},
+    }
+    return (states, trans)
+
+
+class Test_transition_lists:
+
+    def test_list_is_compiled_into_chain(self):
+        hsm = HSM(*make_machine(), skip_validation=True)
+        chain = hsm.trans[('idle',)][Go]
+        assert len(chain.branches) == 3
+        assert [tr.target for tr in chain.branches] == [
+            ('small',), None, ('large',)]
+
+    @pytest.mark.parametrize('compiled', [False, True])
+    @pytest.mark.parametrize(('data', 'exp_leaf', 'exp_noted'), [
+        (1, 'small', None),
+        (50, 'idle', 50),
+        (500, 'large', None),
+    ])
+    def test_first_passing_branch_is_taken(self, data, exp_leaf, exp_noted,
+                                           compiled, tmpdir):
+        hsm = HSM(*make_machine(), skip_validation=True)
+        hsm.data.noted = None
+        if compiled:
+            codegen.compile_machine(hsm, cache_dir=str(tmpdir))
+        hsm.start(EventBus())
+        hsm.eb.dispatch(Go(data))
+        assert active_leaf(hsm) == exp_leaf
+        assert hsm.data.noted == exp_noted
+
+    def test_validation_checks_branches(self):
+        states, trans = make_machine()
+        trans['idle'][Go][1] = T('nowhere', guard=is_medium)
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans, skip_validation=False)
+        assert 'nowhere' in str(exc.value)
+
+    def test_invalid_local_branch(self):
+        states, trans = make_machine()
+        trans['idle'][Go][1] = Local('small', guard=is_medium)
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans)
+        assert 'Invalid local transitions' in str(exc.value)
+
+    def test_initial_cannot_be_list(self):
+        states, trans = make_machine()
+        trans['top'][Initial] = [T('idle')]
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans)
+        assert 'cannot use list of transitions' in str(exc.value)
+
+    @pytest.mark.parametrize('branches', [
+        [],
+        [Choice({1: 'small'}), T('large')],
+    ])
+    def test_invalid_lists(self, branches):
+        states, trans = make_machine()
+        trans['idle'][Go] = branches
+        with pytest.raises(ValueError):
+            HSM(states, trans)
+
+    def test_reachability_follows_branches(self):
+        states, trans = make_machine()
+        states['top'].states['medium'] = State()
+        trans['idle'][Go][1] = T('medium', guard=is_medium)
+        HSM(states, trans)
+        trans['idle'][Go] = [T('small')] + trans['idle'][Go]
+        with pytest.raises(ValueError) as exc:
+            HSM(states, trans)
+        assert 'Unreachable states' in str(exc.value)
+
+    def test_artifact(self):
+        hsm = artifact.loads(artifact.dumps(HSM(*make_machine())))
+        assert hsm.trans[('idle',)][Go].branches[0].guard is is_small
+        hsm.start(EventBus())
+        hsm.eb.dispatch(Go(500))
+        assert active_leaf(hsm) == 'large'
+
+    def test_branches_are_counted_separately(self):
+        hsm = HSM(*make_machine())
+        hsm.counters = Counters(hsm)
+        hsm.start(EventBus())
+        hsm.eb.dispatch(Go(500))
+        hsm.eb.dispatch(Other())
+        hsm.eb.dispatch(Go(1))
+        counts = [(tr['target'], tr['count'])
+                  for tr in hsm.counters.report()['transitions']
+                  if tr['source'] == 'idle']
+        assert counts == [('small', 1), (None, 0), ('large', 1)]